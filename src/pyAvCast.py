@@ -1,5 +1,6 @@
 import pyaudio
 import cv2
+import numpy as np
 import subprocess
 import os
 import sys
@@ -7,6 +8,8 @@ import threading
 import time
 import argparse
 import ctypes
+import errno
+import tempfile
 from ctypes import wintypes
 
 # --- Configuration ---
@@ -19,6 +22,8 @@ AUDIO_RATE = 44100
 VIDEO_WIDTH = 1280
 VIDEO_HEIGHT = 720
 VIDEO_FPS = 30
+FRAME_POOL_SIZE = 3
+PIXEL_FORMAT = 'bgr24'
 
 # --- Named Pipe Constants ---
 PIPE_ACCESS_OUTBOUND = 0x00000002
@@ -28,10 +33,16 @@ PIPE_WAIT = 0x00000000
 PIPE_UNLIMITED_INSTANCES = 255
 INVALID_HANDLE_VALUE = -1
 
-class NamedPipe:
+# --- FIFO Constants (Linux/macOS) ---
+PIPE_CONNECT_TIMEOUT = 10            # Seconds to wait for FFmpeg to open a FIFO
+PIPE_BUFFER_SIZE = 1024 * 1024       # Requested pipe capacity (F_SETPIPE_SZ, Linux only)
+F_SETPIPE_SZ = 1031
+
+class WindowsNamedPipe:
     """Helper class to create and write to a Windows Named Pipe."""
     def __init__(self, name):
         self.name = f"\\\\.\\pipe\\{name}"
+        self.path = self.name
         self.handle = None
         self._create_pipe()
 
@@ -49,7 +60,7 @@ class NamedPipe:
         if self.handle == INVALID_HANDLE_VALUE:
             raise Exception(f"Failed to create named pipe: {self.name} (Error: {ctypes.get_last_error()})")
 
-    def connect(self):
+    def connect(self, timeout=None):
         """Wait for a client (FFmpeg) to connect."""
         print(f"Waiting for connection on {self.name}...")
         connected = ctypes.windll.kernel32.ConnectNamedPipe(self.handle, None)
@@ -59,15 +70,20 @@ class NamedPipe:
         print(f"Connected: {self.name}")
 
     def write(self, data):
-        """Write bytes to the pipe."""
+        """Write bytes (or any contiguous buffer, e.g. an ndarray frame) to the pipe."""
         if not self.handle:
             return
         
+        view = memoryview(data).cast('B')
+        if not view.readonly:
+            # Hand WriteFile the frame's own memory instead of a tobytes() copy
+            data = (ctypes.c_char * len(view)).from_buffer(view)
+
         written = wintypes.DWORD()
         success = ctypes.windll.kernel32.WriteFile(
             self.handle,
             data,
-            len(data),
+            len(view),
             ctypes.byref(written),
             None
         )
@@ -79,6 +95,89 @@ class NamedPipe:
             ctypes.windll.kernel32.CloseHandle(self.handle)
             self.handle = None
 
+class FifoPipe:
+    """
+    POSIX counterpart of WindowsNamedPipe: an os.mkfifo() FIFO that FFmpeg
+    opens by path. connect() waits (with a timeout) for FFmpeg to open the
+    read end, then enlarges the pipe so bursts of video frames don't stall.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.path = os.path.join(tempfile.gettempdir(), f"{name}-{os.getpid()}")
+        self.fd = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        os.mkfifo(self.path, 0o600)
+
+    def connect(self, timeout=PIPE_CONNECT_TIMEOUT):
+        """Wait for a reader (FFmpeg) to open the FIFO."""
+        print(f"Waiting for connection on {self.path}...")
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            try:
+                # Non-blocking open fails with ENXIO until a reader is present
+                fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+            if deadline and time.monotonic() > deadline:
+                raise TimeoutError(f"No reader connected to {self.path} within {timeout}s")
+            time.sleep(0.05)
+
+        os.set_blocking(fd, True)
+        if sys.platform.startswith('linux'):
+            try:
+                import fcntl
+                fcntl.fcntl(fd, getattr(fcntl, 'F_SETPIPE_SZ', F_SETPIPE_SZ), PIPE_BUFFER_SIZE)
+            except OSError as e:
+                # Capped by /proc/sys/fs/pipe-max-size for unprivileged users
+                print(f"Warning: could not enlarge {self.path}: {e}")
+        self.fd = fd
+        print(f"Connected: {self.path}")
+
+    def write(self, data):
+        """Write bytes (or any contiguous buffer) to the FIFO."""
+        if self.fd is None:
+            return
+        view = memoryview(data).cast('B')
+        while view:
+            n = os.write(self.fd, view)
+            view = view[n:]
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+NamedPipe = WindowsNamedPipe if os.name == 'nt' else FifoPipe
+
+class FramePool:
+    """Preallocated frame buffers that cap.read(image=...) fills in place."""
+    def __init__(self, shape, size=FRAME_POOL_SIZE):
+        self.shape = tuple(shape)
+        self.buffers = [np.empty(self.shape, dtype=np.uint8) for _ in range(size)]
+        self.next = 0
+        self.reallocations = 0
+
+    def next_buffer(self):
+        buf = self.buffers[self.next]
+        self.next = (self.next + 1) % len(self.buffers)
+        return buf
+
+    def read(self, cap):
+        """Returns (ret, frame) where frame is one of the pool's buffers."""
+        buf = self.next_buffer()
+        ret, frame = cap.read(image=buf)
+        if ret and frame is not buf:
+            self.reallocations += 1
+            if frame.shape != buf.shape:
+                return False, None
+            np.copyto(buf, frame)
+        return ret, buf
+
 def get_ffmpeg_path():
     if shutil_which := __import__('shutil').which("ffmpeg"):
         return "ffmpeg"
@@ -94,20 +193,25 @@ def get_ffmpeg_path():
     return None
 
 def list_audio_devices(p):
-    info = p.get_host_api_info_by_type(pyaudio.paMME)
+    try:
+        info = p.get_host_api_info_by_type(pyaudio.paMME)
+    except (IOError, OSError):
+        # No MME outside Windows; use the platform's default host API (e.g. ALSA)
+        info = p.get_default_host_api_info()
     if not info:
-        print("MME Host API not found")
+        print("No audio host API found")
         return []
     
     numdevices = info.get('deviceCount')
     devices = []
-    print("\nAvailable Audio Input Devices (MME):")
+    print(f"\nAvailable Audio Input Devices ({info.get('name')}):")
     for i in range(0, numdevices):
-        if (p.get_device_info_by_host_api_device_index(info['index'], i).get('maxInputChannels')) > 0:
-            dev_name = p.get_device_info_by_host_api_device_index(info['index'], i).get('name')
+        dev_info = p.get_device_info_by_host_api_device_index(info['index'], i)
+        if dev_info.get('maxInputChannels') > 0:
+            dev_name = dev_info.get('name')
             if "Microsoft Sound Mapper" not in dev_name:
-                print(f"Index {i}: {dev_name}")
-                devices.append((i, dev_name))
+                print(f"Index {dev_info['index']}: {dev_name}")
+                devices.append((dev_info['index'], dev_name))
     return devices
 
 def list_video_devices():
@@ -124,6 +228,15 @@ def list_video_devices():
     return devices
 
 def audio_thread_func(p, device_index, pipe, stop_event):
+    # FFmpeg opens its inputs in order, so each thread connects its own pipe
+    try:
+        pipe.connect()
+    except Exception as e:
+        print(f"Audio pipe error: {e}")
+        stop_event.set()
+        pipe.close()
+        return
+
     stream = p.open(format=AUDIO_FORMAT,
                     channels=AUDIO_CHANNELS,
                     rate=AUDIO_RATE,
@@ -145,19 +258,63 @@ def audio_thread_func(p, device_index, pipe, stop_event):
         pipe.close()
         print("Audio thread finished.")
 
-def video_thread_func(device_index, pipe, stop_event):
+# FOURCC -> (FFmpeg pix_fmt, bytes per pixel) for raw formats we can pipe as-is
+NATIVE_PIXEL_FORMATS = {
+    'YUYV': ('yuyv422', 2.0),
+    'NV12': ('nv12', 1.5),
+}
+
+def open_video_capture(device_index):
+    """
+    Opens the camera and settles the pixel format piped to FFmpeg.
+    Returns (cap, ffmpeg_pix_fmt, frame_shape, convert_to_i420).
+    """
     cap = cv2.VideoCapture(device_index)
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, VIDEO_WIDTH)
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, VIDEO_HEIGHT)
     cap.set(cv2.CAP_PROP_FPS, VIDEO_FPS)
+
+    if PIXEL_FORMAT == 'native':
+        for fourcc, (pix_fmt, bytes_per_pixel) in NATIVE_PIXEL_FORMATS.items():
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+            if not cap.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+                break
+            ret, frame = cap.read()
+            if ret and frame is not None and frame.nbytes == int(VIDEO_WIDTH * VIDEO_HEIGHT * bytes_per_pixel):
+                return cap, pix_fmt, frame.shape, False
+        cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+        print("Native pixel format passthrough not available, converting to yuv420p.")
+
+    if PIXEL_FORMAT == 'bgr24':
+        return cap, 'bgr24', (VIDEO_HEIGHT, VIDEO_WIDTH, 3), False
+    return cap, 'yuv420p', (VIDEO_HEIGHT * 3 // 2, VIDEO_WIDTH), True
+
+def video_thread_func(cap, frame_shape, convert_to_i420, pipe, stop_event):
+    try:
+        pipe.connect()
+    except Exception as e:
+        print(f"Video pipe error: {e}")
+        stop_event.set()
+        cap.release()
+        pipe.close()
+        return
+
+    pool = FramePool(frame_shape)
+    scratch = np.empty((VIDEO_HEIGHT, VIDEO_WIDTH, 3), dtype=np.uint8) if convert_to_i420 else None
     
     try:
         while not stop_event.is_set():
-            ret, frame = cap.read()
+            if scratch is not None:
+                ret, _ = cap.read(image=scratch)
+                frame = pool.next_buffer()
+                if ret:
+                    cv2.cvtColor(scratch, cv2.COLOR_BGR2YUV_I420, dst=frame)
+            else:
+                ret, frame = pool.read(cap)
             if not ret:
                 break
             try:
-                pipe.write(frame.tobytes())
+                pipe.write(frame)
             except IOError:
                 break
     except Exception as e:
@@ -165,13 +322,17 @@ def video_thread_func(device_index, pipe, stop_event):
     finally:
         cap.release()
         pipe.close()
-        print("Video thread finished.")
+        print(f"Video thread finished. Frame pool reallocations: {pool.reallocations}")
 
 def main():
+    global PIXEL_FORMAT
+
     parser = argparse.ArgumentParser(description="PyAvCast - Combined Audio/Video Streamer")
     parser.add_argument("--ip", default=OBS_IP, help="Target IP")
     parser.add_argument("--port", type=int, default=TARGET_PORT, help="Target Port")
+    parser.add_argument("--pixel-format", choices=['bgr24', 'yuv420p', 'native'], default=PIXEL_FORMAT, help="Video pixel format piped to FFmpeg")
     args = parser.parse_args()
+    PIXEL_FORMAT = args.pixel_format
 
     ffmpeg_bin = get_ffmpeg_path()
     if not ffmpeg_bin:
@@ -194,6 +355,10 @@ def main():
             print("No video devices.")
             return
         v_idx = int(input("Select Video Device Index: "))
+        cap, pix_fmt, frame_shape, convert_to_i420 = open_video_capture(v_idx)
+        frame_bytes = int(np.prod(frame_shape))
+        print(f"Video pixel format: {pix_fmt}, {frame_bytes} bytes/frame "
+              f"(bgr24: {VIDEO_WIDTH * VIDEO_HEIGHT * 3}, {frame_bytes * VIDEO_FPS / 1e6:.1f} MB/s at {VIDEO_FPS}fps)")
 
         # Create Named Pipes
         pipe_video_name = "pyavcast_video"
@@ -207,28 +372,13 @@ def main():
 
         # Start Capture Threads
         t_audio = threading.Thread(target=audio_thread_func, args=(p, a_idx, pipe_audio, stop_event))
-        t_video = threading.Thread(target=video_thread_func, args=(v_idx, pipe_video, stop_event))
+        t_video = threading.Thread(target=video_thread_func, args=(cap, frame_shape, convert_to_i420, pipe_video, stop_event))
         
         t_audio.start()
         t_video.start()
         
-        # Wait for pipes to be ready (FFmpeg will connect to them)
-        # Note: In Windows, CreateNamedPipe waits for client connection if we call ConnectNamedPipe.
-        # However, to avoid blocking the main thread from launching FFmpeg, we should launch FFmpeg *first* 
-        # or launch connection waiting in threads? 
-        # Actually, standard practice: Create pipes, Launch FFmpeg (it opens pipes), then we write.
-        # But ConnectNamedPipe blocks until client connects.
-        
-        # Let's launch connection waiters in threads or just rely on the fact that we can start writing? 
-        # No, we must accept the connection.
-        
-        def connect_pipe(pipe):
-            pipe.connect()
-            
-        t_conn_v = threading.Thread(target=connect_pipe, args=(pipe_video,))
-        t_conn_a = threading.Thread(target=connect_pipe, args=(pipe_audio,))
-        t_conn_v.start()
-        t_conn_a.start()
+        # Each capture thread connects its own pipe before writing, so FFmpeg
+        # can open the inputs one after another.
 
         # Construct FFmpeg Command
         cmd = [
@@ -237,15 +387,15 @@ def main():
             # Video Input (Pipe)
             '-f', 'rawvideo',
             '-vcodec', 'rawvideo',
-            '-pix_fmt', 'bgr24',
+            '-pix_fmt', pix_fmt,
             '-s', f'{VIDEO_WIDTH}x{VIDEO_HEIGHT}',
             '-r', str(VIDEO_FPS),
-            '-i', f'\\\\.\\pipe\\{pipe_video_name}',
+            '-i', pipe_video.path,
             # Audio Input (Pipe)
             '-f', 's16le',
             '-ac', str(AUDIO_CHANNELS),
             '-ar', str(AUDIO_RATE),
-            '-i', f'\\\\.\\pipe\\{pipe_audio_name}',
+            '-i', pipe_audio.path,
             # Encoding & Output
             '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency',
             '-c:a', 'aac', '-b:a', '128k',
@@ -257,24 +407,27 @@ def main():
         # print(" ".join(cmd))
         proc = subprocess.Popen(cmd)
 
-        t_conn_v.join()
-        t_conn_a.join()
-        print("Pipes connected. Streaming...")
-
         try:
-            while proc.poll() is None:
+            # Capture threads set stop_event if their pipe never connects
+            while proc.poll() is None and not stop_event.is_set():
                 time.sleep(1)
         except KeyboardInterrupt:
             print("Stopping...")
-            stop_event.set()
+        stop_event.set()
+        if proc.poll() is None:
             proc.terminate()
+        t_audio.join(timeout=2)
+        t_video.join(timeout=2)
             
     except Exception as e:
         print(f"Error: {e}")
     finally:
         stop_event.set()
         p.terminate()
-        cv2.destroyAllWindows()
+        try:
+            cv2.destroyAllWindows()
+        except cv2.error:
+            pass  # Headless OpenCV builds have no GUI
         print("Exited.")
 
 if __name__ == "__main__":
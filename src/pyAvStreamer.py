@@ -1,5 +1,6 @@
 import pyaudio
 import cv2
+import numpy as np
 import subprocess
 import os
 import shutil
@@ -9,6 +10,31 @@ import time
 import argparse
 import ctypes
 import queue
+import collections
+import itertools
+import json
+import glob
+import concurrent.futures
+import asyncio
+import multiprocessing
+from multiprocessing import shared_memory
+import socket
+import struct
+import select
+import random
+from urllib.parse import urlsplit
+from fractions import Fraction
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import fcntl  # V4L2 ioctls for device discovery (Linux)
+except ImportError:
+    fcntl = None
+
+try:
+    import av  # PyAV, optional: only needed for --encoder-backend pyav
+except ImportError:
+    av = None
 
 # --- Configuration ---
 OBS_IP = "127.0.0.1"
@@ -16,12 +42,66 @@ BASE_PORT_AUDIO = 1337
 BASE_PORT_VIDEO = 1729
 CHUNK = 4096
 AUDIO_FORMAT = pyaudio.paInt16
-AUDIO_CHANNELS = 1
-AUDIO_RATE = 44100
+AUDIO_CHANNELS = 1    # Sent to OBS; devices are captured at their native rate/channels
+AUDIO_RATE = 44100    # and converted once, in the encoder
+AUDIO_HOST_API = None # PortAudio host API to list devices from (None = MME on Windows, default elsewhere)
+AUDIO_MAX_CAPTURE_CHANNELS = 2
+COMBINE_MICS = False  # Interleave all selected mics into one multichannel stream/encoder
+DRIFT_COMPENSATION = False  # Resample each mic onto the monotonic clock
+DRIFT_WINDOW = 120.0        # Seconds of (time, frames) history used for the drift fit
+DRIFT_MIN_SPAN = 10.0       # Seconds of history before trusting the estimate
+DRIFT_SAMPLE_INTERVAL = 0.5
+DRIFT_MAX_PPM = 2000
+DRIFT_DEPTH_TIME_CONSTANT = 10.0  # Seconds over which a buffer depth error is corrected
+DRIFT_MAX_CORRECTION = 500e-6
+TIMESTAMP_MODE = 'wallclock'  # PTS on arrival, or 'capture': from capture time (Matroska-framed pipe)
+AUDIO_RESYNC_MS = 40        # Audio timeline error tolerated before re-anchoring
+AUDIO_MAX_LATENCY_MS = 200
+AUDIO_MODE = 'blocking'
+AUDIO_PERIOD = 256
 VIDEO_WIDTH = 0
 VIDEO_HEIGHT = 0
 VIDEO_FPS = 0
 USE_MAX_QUALITY = False
+FRAME_POOL_SIZE = 3
+PIXEL_FORMAT = 'bgr24'
+MJPEG_COPY = False
+USE_SHARED_FFMPEG = False
+SHARED_FFMPEG_TIMEOUT = 10
+ENCODER_BACKEND = 'subprocess'
+USE_FANOUT = False
+FANOUT_HOSTS = []     # Extra receivers; each stream is sent to the same port on every host
+UDP_BATCH = 32        # Max datagrams per sendmmsg() call in fan-out mode
+UDP_PACING_MBPS = 0   # Peak egress rate per stream in fan-out mode (0 = unpaced)
+FEC_COLUMNS = 0       # Row/column XOR FEC matrix in fan-out mode (0 = no FEC)
+FEC_ROWS = 0          # 0 = row FEC only
+FEC_PORT_OFFSET = 10000     # FEC packets go to stream port + this
+FEC_FORWARD_OFFSET = 20000  # --fec-receive hands the repaired stream to OBS on port + this
+VIDEO_QUEUE_SIZE = 2
+RESTART_BACKOFF_INITIAL = 0.1  # Seconds before the first restart of a failed encoder/stream
+RESTART_BACKOFF_MAX = 30.0     # Cap of the doubling delay (0 = never restart)
+RESTART_STABLE = 10.0          # A run this long resets the delay
+VIDEO_DROP_POLICY = 'drop-oldest'
+CPU_AFFINITY = False   # Pin each video stream (capture, writer, FFmpeg) to its own CPUs
+CPU_PLAN = None        # CpuPlan when CPU_AFFINITY is on
+REALTIME_CAPTURE = False  # Raise capture threads to SCHED_FIFO (or a lower nice value)
+REALTIME_PRIORITY = 10
+REALTIME_NICE = -10
+CAPTURE_PROCESSES = False     # Capture each camera in its own process (shared-memory frames)
+CAPTURE_PROCESS_TIMEOUT = 30  # Seconds a capture process gets to open its camera
+METRICS_PORT = 0      # Prometheus endpoint on localhost (0 = off)
+TRACE_BUFFER = 200000  # Stage spans kept by the tracer (oldest overwritten)
+TRACE_FILE = "pyavstreamer_trace.json"
+DEVICE_CACHE_FILE = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                                 'pyavstreamer', 'devices.json')
+USE_ABR = False
+ABR_DOWN_AFTER = 2    # Consecutive bad progress reports before stepping quality down
+ABR_UP_AFTER = 10     # Consecutive good reports before stepping back up
+ABR_HOLD = 5.0        # Minimum seconds between quality changes
+ABR_SPEED_LOW = 0.97  # A progress report is bad under this encode speed...
+ABR_SPEED_OK = 0.99   # ...and good from this speed up (in between resets the good count)
+ABR_BUSY_HIGH = 0.8   # Bad when pipe writes block this share of the frame interval...
+ABR_BUSY_OK = 0.5     # ...good only under this share
 
 def get_ffmpeg_path():
     # 1. Check PATH
@@ -42,7 +122,12 @@ def get_ffmpeg_path():
     return None
 
 def set_high_priority():
-    """Sets the process priority to High on Windows."""
+    """
+    Sets the process priority to High on Windows. Elsewhere the process is
+    left alone; --realtime raises just the capture threads (Linux).
+    """
+    if os.name != 'nt':
+        return
     try:
         # HIGH_PRIORITY_CLASS = 0x00000080
         pid = os.getpid()
@@ -65,46 +150,2231 @@ def set_high_priority():
     except Exception as e:
         print(f"Warning: Failed to set process priority: {e}")
 
+# --- CPU Scheduling ---
+
+class CpuPlan:
+    """
+    Splits the CPUs this process may run on across video streams. Each
+    stream gets its own contiguous slice (one CPU each, shared round-robin,
+    once streams outnumber CPUs); its capture thread, writer and FFmpeg
+    process are pinned to it and x264 runs that many threads. A stream keeps
+    its slice across restarts. Running streams are not re-planned (x264's
+    thread count is fixed at spawn), so a batch started later from the menu
+    gets the least-used CPUs and shares them with earlier streams once every
+    CPU is taken; start all cameras together for disjoint slices.
+    """
+    def __init__(self):
+        self.cpus = sorted(os.sched_getaffinity(0))
+        self.expected = 0
+        self.slices = {}
+        self.lock = threading.Lock()
+
+    def expect(self, count):
+        """Announces streams about to start, so the first ones don't take every CPU."""
+        with self.lock:
+            self.expected += count
+
+    def assign(self, key):
+        with self.lock:
+            if key not in self.slices:
+                total = max(self.expected, len(self.slices) + 1)
+                per = max(1, len(self.cpus) // total)
+                load = dict.fromkeys(self.cpus, 0)
+                for cpus in self.slices.values():
+                    for cpu in cpus:
+                        load[cpu] += 1
+                # Busiest slice each CPU belongs to, so later streams spread over earlier slices
+                crowding = dict.fromkeys(self.cpus, 0)
+                for cpus in self.slices.values():
+                    busy = sum(load[cpu] for cpu in cpus) / len(cpus)
+                    for cpu in cpus:
+                        crowding[cpu] = max(crowding[cpu], busy)
+                # Least-used first, in CPU order on ties: contiguous slices for a batch planned together
+                chosen = sorted(sorted(self.cpus, key=lambda cpu: (load[cpu], crowding[cpu]))[:per])
+                if any(load[cpu] for cpu in chosen) and len(self.slices) < len(self.cpus):
+                    print(f"CPU plan: {key[0]} shares {'CPU' if per == 1 else 'CPUs'} {','.join(map(str, chosen))} "
+                          f"with streams started earlier")
+                self.slices[key] = chosen
+            return self.slices[key]
+
+def pin_thread(cpus):
+    """Pins the calling thread; threads and processes it starts afterwards inherit the mask."""
+    try:
+        os.sched_setaffinity(0, cpus)
+        return True
+    except (AttributeError, OSError) as e:
+        print(f"Warning: could not pin to CPUs {cpus}: {e}")
+        return False
+
+def raise_thread_priority():
+    """
+    Puts the calling thread on SCHED_FIFO (needs root or CAP_SYS_NICE),
+    falling back to a lower nice value. Returns a description of the result.
+    """
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(REALTIME_PRIORITY))
+        return f"SCHED_FIFO {REALTIME_PRIORITY}"
+    except (AttributeError, OSError):
+        pass
+    try:
+        # Linux keeps a nice value per thread; target this one by its TID
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), REALTIME_NICE)
+        return f"nice {REALTIME_NICE}"
+    except (AttributeError, OSError):
+        return "priority unchanged (needs root or CAP_SYS_NICE)"
+
+# --- Pipe I/O ---
+
+class PipeWriter:
+    """
+    Writes buffer-protocol objects (ndarray frames, bytes) straight to a pipe's
+    raw file descriptor, skipping the intermediate copy made by frame.tobytes().
+    Keeps running totals so the saving can be checked.
+    """
+    def __init__(self, fd):
+        self.fd = fd
+        self.bytes_written = 0
+        self.writes = 0
+        self.partial_writes = 0
+        self.copies_avoided = 0
+        self.write_seconds = 0.0
+        self.start_time = time.monotonic()
+
+    def write(self, data, prefix=None):
+        """Writes data, optionally preceded by a small header in the same writev()."""
+        start = time.perf_counter()
+        try:
+            view = memoryview(data).cast('B')
+            if isinstance(data, np.ndarray):
+                # Only frames used to go through tobytes(); bytes and ring views never did
+                self.copies_avoided += 1
+        except TypeError:
+            # Non-contiguous buffers can't be viewed as flat bytes
+            view = memoryview(bytes(data))
+
+        total = len(view)
+        if prefix is not None:
+            total += len(prefix)
+            if hasattr(os, 'writev'):
+                parts = [memoryview(prefix), view]
+                while parts:
+                    n = os.writev(self.fd, parts)
+                    if n < sum(len(part) for part in parts):
+                        self.partial_writes += 1
+                    while parts and n >= len(parts[0]):
+                        n -= len(parts.pop(0))
+                    if parts:
+                        parts[0] = parts[0][n:]
+                view = view[:0]
+            else:
+                head = memoryview(prefix)
+                while head:
+                    head = head[os.write(self.fd, head):]
+        while view:
+            n = os.write(self.fd, view)
+            if n < len(view):
+                self.partial_writes += 1
+            view = view[n:]
+
+        self.bytes_written += total
+        self.writes += 1
+        self.write_seconds += time.perf_counter() - start
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.start_time, 1e-6)
+        return {
+            'bytes_per_sec': self.bytes_written / elapsed,
+            'bytes_written': self.bytes_written,
+            'writes': self.writes,
+            'partial_writes': self.partial_writes,
+            'copies_avoided': self.copies_avoided,
+        }
+
+    def report(self):
+        s = self.stats()
+        return (f"{s['bytes_per_sec'] / 1e6:.1f} MB/s, {s['writes']} writes, "
+                f"{s['copies_avoided']} copies avoided, {s['partial_writes']} partial writes")
+
+def get_peak_rss():
+    """Returns the peak resident set size of this process in bytes, or None."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS reports bytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+
+    try:
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ('cb', ctypes.c_uint32),
+                ('PageFaultCount', ctypes.c_uint32),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t),
+            ]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        kernel32 = ctypes.windll.kernel32
+        kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+        if ctypes.windll.psapi.GetProcessMemoryInfo(
+                ctypes.c_void_p(kernel32.GetCurrentProcess()), ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except Exception:
+        pass
+    return None
+
+class FramePool:
+    """
+    Fixed set of preallocated frame buffers. The capture side acquires a buffer
+    and fills it in place with cap.read(image=...); the encoder side releases it
+    after writing, so steady-state streaming of raw frames allocates nothing
+    per frame. Undecoded MJPEG is the exception: see read_compressed().
+    """
+    def __init__(self, shape, size=FRAME_POOL_SIZE):
+        self.shape = tuple(shape)
+        self.size = size
+        self.buffers = [np.empty(self.shape, dtype=np.uint8) for _ in range(size)]
+        self.free = queue.Queue()
+        for buf in self.buffers:
+            self.free.put(buf)
+        self.reallocations = 0
+
+    @property
+    def nbytes(self):
+        return sum(buf.nbytes for buf in self.buffers)
+
+    def acquire(self, timeout=None):
+        """Returns a free buffer, or None if none became free within timeout."""
+        try:
+            return self.free.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, buf):
+        # Compressed frames travel as views into a pool buffer
+        self.free.put(buf if buf.base is None else buf.base)
+
+    def read(self, cap, buf):
+        """
+        Fills buf from cap. If the driver hands back a different array anyway,
+        it is copied into buf so the pool stays bounded; a size change fails the read.
+        """
+        ret, frame = cap.read(image=buf)
+        if ret and frame is not buf:
+            self.reallocations += 1
+            if frame.shape != buf.shape:
+                return False
+            np.copyto(buf, frame)
+        return ret
+
+    def read_compressed(self, cap, buf):
+        """
+        Reads one undecoded (e.g. MJPEG) frame and copies it into the flat buf.
+        Returns a view of the filled part, or None on failure. OpenCV returns
+        each JPEG as a new 1 x N array sized to that frame, and a pool buffer
+        passed as image= would only fit a frame of the same N, so this still
+        allocates one array per read; the pool bounds what is queued, not that.
+        """
+        ret, data = cap.read()
+        if not ret or data is None or data.size > buf.size:
+            return None
+        n = data.size
+        buf[:n] = data.reshape(-1)
+        return buf[:n]
+
+    def report(self):
+        peak = get_peak_rss()
+        peak_str = f"{peak / 1e6:.1f} MB" if peak else "n/a"
+        return (f"{self.size} x {self.shape} buffers = {self.nbytes / 1e6:.1f} MB, "
+                f"{self.reallocations} reallocations, process peak RSS {peak_str}")
+
+class FrameRing:
+    """
+    Bounded hand-off between the capture and writer stages of a video stream.
+    When full, the overflow policy decides what happens to the incoming frame:
+      - 'drop-oldest': evict the stalest queued frame (latency stays bounded)
+      - 'drop-newest': discard the incoming frame
+      - 'block':       wait for the writer (capture slows to encoder rate)
+    Evicted buffers go back to the FramePool they came from.
+    """
+    POLICIES = ('drop-oldest', 'drop-newest', 'block')
+
+    def __init__(self, pool, capacity=VIDEO_QUEUE_SIZE, policy=VIDEO_DROP_POLICY):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown drop policy: {policy}")
+        self.pool = pool
+        self.capacity = max(1, capacity)
+        self.policy = policy
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.pushed = 0
+        self.dropped = 0
+        self.last_age = 0.0
+        self.max_age = 0.0
+
+    def put(self, frame, timestamp):
+        with self.cond:
+            if len(self.items) >= self.capacity:
+                if self.policy == 'drop-oldest':
+                    old, _ = self.items.popleft()
+                    self.pool.release(old)
+                    self.dropped += 1
+                elif self.policy == 'drop-newest':
+                    self.pool.release(frame)
+                    self.dropped += 1
+                    return
+                else:
+                    while len(self.items) >= self.capacity and not self.closed:
+                        self.cond.wait()
+            if self.closed:
+                self.pool.release(frame)
+                return
+            self.items.append((frame, timestamp))
+            self.pushed += 1
+            self.cond.notify_all()
+
+    def get(self, timeout=None):
+        """Returns (frame, capture_timestamp), or None on timeout/close."""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items or self.closed, timeout):
+                return None
+            if not self.items:
+                return None
+            frame, timestamp = self.items.popleft()
+            self.cond.notify_all()
+        self.last_age = time.monotonic() - timestamp
+        self.max_age = max(self.max_age, self.last_age)
+        return frame, timestamp
+
+    @property
+    def depth(self):
+        return len(self.items)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            while self.items:
+                frame, _ = self.items.popleft()
+                self.pool.release(frame)
+            self.cond.notify_all()
+
+    def report(self):
+        return (f"{self.policy}, {self.pushed} queued, {self.dropped} dropped, "
+                f"queue age last {self.last_age * 1000:.1f} ms / max {self.max_age * 1000:.1f} ms")
+
+class RunningStats:
+    """Count/mean/std/max of a series of samples without storing them."""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.max = max(self.max, value)
+
+    @property
+    def std(self):
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0
+
+class PeriodJitter:
+    """Measures how far each capture period's arrival deviates from nominal."""
+    def __init__(self, period_s):
+        self.period_s = period_s
+        self.last = None
+        self.deviation = RunningStats()
+
+    def tick(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self.last is not None:
+            self.deviation.add(abs((now - self.last) - self.period_s))
+        self.last = now
+
+    def report(self):
+        d = self.deviation
+        return (f"period {self.period_s * 1000:.1f} ms, jitter mean {d.mean * 1000:.2f} ms, "
+                f"std {d.std * 1000:.2f} ms, max {d.max * 1000:.2f} ms")
+
+class AudioRing:
+    """
+    Single-producer/single-consumer byte ring for PCM between the mic reader
+    and the FFmpeg writer. Capacity is a hard latency ceiling: if a write would
+    exceed it, the oldest audio is dropped down to half the ceiling (resync)
+    instead of blocking the mic reader. The consumer drains everything queued
+    in one coalesced read.
+    """
+    def __init__(self, max_latency_ms, rate, frame_bytes):
+        self.frame_bytes = frame_bytes
+        self.bytes_per_ms = rate * frame_bytes / 1000.0
+        capacity = int(self.bytes_per_ms * max_latency_ms) // frame_bytes * frame_bytes
+        self.capacity = max(capacity, frame_bytes)
+        self.buf = bytearray(self.capacity)
+        self.out = bytearray(self.capacity)
+        self.head = 0
+        self.tail = 0
+        self.used = 0
+        self.cond = threading.Condition()
+        self.closed = False
+        self.started = False
+        self.overflows = 0
+        self.underflows = 0
+        self.dropped_bytes = 0
+        self.max_used = 0
+        self.oldest_time = 0.0
+        self.newest_time = 0.0
+        self.read_end_time = 0.0   # Arrival time of the last sample handed out by read()
+        self.wait = RunningStats()
+
+    @property
+    def depth_ms(self):
+        return self.used / self.bytes_per_ms
+
+    def write(self, data):
+        view = memoryview(data).cast('B')
+        n = len(view)
+        with self.cond:
+            if n > self.capacity:
+                self.dropped_bytes += n - self.capacity
+                view = view[n - self.capacity:]
+                n = self.capacity
+            if self.used + n > self.capacity:
+                target = max(self.capacity // 2 - n, 0) // self.frame_bytes * self.frame_bytes
+                drop = self.used - min(self.used, target)
+                self.tail = (self.tail + drop) % self.capacity
+                self.used -= drop
+                self.overflows += 1
+                self.dropped_bytes += drop
+
+            self.newest_time = time.monotonic()
+            if not self.used:
+                self.oldest_time = self.newest_time
+            first = min(n, self.capacity - self.head)
+            self.buf[self.head:self.head + first] = view[:first]
+            self.buf[:n - first] = view[first:]
+            self.head = (self.head + n) % self.capacity
+            self.used += n
+            self.max_used = max(self.max_used, self.used)
+            self.started = True
+            self.cond.notify()
+
+    def read(self, timeout=None, max_bytes=None):
+        """
+        Returns a memoryview of everything queued (at most max_bytes), or None
+        on timeout/close. The view is only valid until the next read.
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.used or self.closed, timeout) or not self.used:
+                if self.started and not self.closed:
+                    self.underflows += 1
+                return None
+            n = self.used if max_bytes is None else min(self.used, max_bytes)
+            first = min(n, self.capacity - self.tail)
+            self.out[:first] = self.buf[self.tail:self.tail + first]
+            self.out[first:n] = self.buf[:n - first]
+            self.tail = (self.tail + n) % self.capacity
+            self.used -= n
+            self.read_end_time = self.newest_time - self.used / self.bytes_per_ms / 1000
+            self.wait.add(time.monotonic() - self.oldest_time)
+            if self.used:
+                self.oldest_time = time.monotonic()
+        return memoryview(self.out)[:n]
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def report(self):
+        return (f"depth {self.depth_ms:.0f} ms (max {self.max_used / self.bytes_per_ms:.0f} ms "
+                f"of {self.capacity / self.bytes_per_ms:.0f} ms), {self.overflows} overflows "
+                f"({self.dropped_bytes} bytes dropped), {self.underflows} underflows")
+
+class ClockDrift:
+    """
+    Estimates a capture device's clock drift against time.monotonic() and,
+    if enabled, resamples its PCM onto the monotonic clock. The estimate is
+    a least-squares fit of cumulative frames vs. arrival time over the last
+    DRIFT_WINDOW seconds, so scheduling jitter averages out. The resampler
+    is linear interpolation over whole chunks (vectorized over frames and
+    channels), carrying its fractional phase across chunks. depth_error
+    (seconds of buffer above target) nudges the ratio so a ring fed at the
+    common clock stays at a bounded depth despite estimation error. Input
+    lost to an overflow would read as a slow clock for a whole window, so
+    capture paths report it through discontinuity(). With an output_rate
+    other than the nominal rate the same resampler also converts the rate,
+    following the estimate only if resample (drift compensation) is on.
+    """
+    def __init__(self, nominal_rate, channels, resample=False, output_rate=None):
+        self.nominal_rate = nominal_rate
+        self.channels = channels
+        self.output_rate = output_rate or nominal_rate
+        self.compensate = resample
+        self.resample = resample or self.output_rate != nominal_rate
+        self.frames = 0
+        self.points = collections.deque()
+        self.last_point = 0.0
+        self.rate = float(nominal_rate)
+        self.depth_error = 0.0
+        self.phase = None
+        self.last = None
+        self.frames_out = 0
+        self.discontinuities = 0
+
+    @property
+    def ppm(self):
+        return (self.rate / self.nominal_rate - 1) * 1e6
+
+    def process(self, data, now=None):
+        """Accounts for a chunk arriving now; returns it resampled to the output rate (or as-is)."""
+        now = time.monotonic() if now is None else now
+        chunk = np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels)
+        self.frames += len(chunk)
+        if now - self.last_point >= DRIFT_SAMPLE_INTERVAL:
+            self._update(now)
+        if not self.resample:
+            return data
+        out = self._resample(chunk)
+        self.frames_out += len(out)
+        return out
+
+    def discontinuity(self):
+        """
+        Input was lost (an overflow): restarts the fit from the next chunk,
+        keeping the current estimate until DRIFT_MIN_SPAN of new history.
+        """
+        self.points.clear()
+        self.last_point = 0.0
+        self.discontinuities += 1
+
+    def _update(self, now):
+        self.last_point = now
+        self.points.append((now, self.frames))
+        while now - self.points[0][0] > DRIFT_WINDOW:
+            self.points.popleft()
+        if now - self.points[0][0] < DRIFT_MIN_SPAN:
+            return
+        t, n = np.array(self.points, dtype=np.float64).T
+        rate = np.polyfit(t - t[0], n, 1)[0]
+        # Beyond this it's a stall or glitch, not a crystal's drift
+        if abs(rate / self.nominal_rate - 1) < DRIFT_MAX_PPM / 1e6:
+            self.rate = rate
+
+    def _resample(self, chunk):
+        if self.last is None:
+            self.last = chunk[0].astype(np.float64)
+            self.phase = 1.0
+        if self.compensate:
+            correction = min(max(self.depth_error / DRIFT_DEPTH_TIME_CONSTANT, -DRIFT_MAX_CORRECTION), DRIFT_MAX_CORRECTION)
+            step = self.rate / self.output_rate * (1 + correction)  # Input frames per output frame
+        else:
+            step = self.nominal_rate / self.output_rate
+        n = len(chunk)
+        # Position 0 is the previous chunk's last frame, 1..n this chunk
+        frames = np.vstack((self.last[None, :], chunk.astype(np.float64)))
+        count = int((n - self.phase) // step) + 1 if self.phase <= n else 0
+        positions = self.phase + step * np.arange(count)
+        index = np.minimum(positions.astype(np.int64), n - 1) if n else positions.astype(np.int64)
+        frac = (positions - index)[:, None]
+        out = frames[index] + (frames[index + 1] - frames[index]) * frac
+        self.phase = (positions[-1] + step - n) if count else self.phase - n
+        self.last = frames[-1]
+        return np.clip(np.rint(out), -32768, 32767).astype(np.int16)
+
+    def report(self):
+        text = f"clock drift {self.ppm:+.1f} ppm"
+        if self.discontinuities:
+            text += f" ({self.discontinuities} refits after lost input)"
+        if self.resample:
+            text += f" (resampled {self.frames} -> {self.frames_out} frames)"
+        return text
+
+# --- Capture Timestamps ---
+
+# Zero point of every stream's capture timestamps, so PTS are comparable across streams
+CAPTURE_EPOCH = time.monotonic()
+MATROSKA_TIMESCALE = 1000000  # Ticks per second (TimestampScale = 1000 ns)
+
+# FFmpeg's raw pix_fmt -> Matroska V_UNCOMPRESSED ColourSpace FOURCC
+MATROSKA_FOURCC = {
+    'bgr24': b'BGR\x18',
+    'yuv420p': b'I420',
+    'nv12': b'NV12',
+    'yuyv422': b'YUY2',
+}
+
+def ebml_size(n, length=None):
+    """EBML variable-length size; the shortest form unless length is given."""
+    if length is None:
+        length = 1
+        while n >= (1 << (7 * length)) - 1:
+            length += 1
+    return (n | (1 << (7 * length))).to_bytes(length, 'big')
+
+def ebml(element_id, payload):
+    """Encodes one EBML element; ints become unsigned, floats doubles, strs UTF-8."""
+    if isinstance(payload, float):
+        payload = struct.pack('>d', payload)
+    elif isinstance(payload, int):
+        payload = payload.to_bytes(max(1, (payload.bit_length() + 7) // 8), 'big')
+    elif isinstance(payload, str):
+        payload = payload.encode()
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big') + ebml_size(len(payload)) + payload
+
+def matroska_video_track(pix_fmt, width, height, fps):
+    """TrackEntry for raw video (or MJPEG) as the video tasks pipe it."""
+    video = ebml(0xB0, width) + ebml(0xBA, height)
+    if pix_fmt == 'mjpeg':
+        codec = 'V_MJPEG'
+    else:
+        codec = 'V_UNCOMPRESSED'
+        video += ebml(0x2EB524, MATROSKA_FOURCC[pix_fmt])
+    return ebml(0xAE, ebml(0xD7, 1) + ebml(0x73C5, 1) + ebml(0x83, 1) + ebml(0x86, codec)
+                + ebml(0x23E383, int(1e9 / fps)) + ebml(0xE0, video))
+
+def matroska_audio_track(rate, channels):
+    """TrackEntry for interleaved s16le PCM."""
+    audio = ebml(0xB5, float(rate)) + ebml(0x9F, channels) + ebml(0x6264, 16)
+    return ebml(0xAE, ebml(0xD7, 1) + ebml(0x73C5, 1) + ebml(0x83, 2) + ebml(0x86, 'A_PCM/INT/LIT')
+                + ebml(0xE1, audio))
+
+def capture_timestamp_input_args():
+    """FFmpeg input options for a MatroskaFramer pipe: take its timestamps as-is."""
+    return ['-copyts', '-f', 'matroska']
+
+class MatroskaFramer:
+    """
+    Live Matroska framing on a stream's pipe, so FFmpeg gets each frame or
+    PCM chunk with the monotonic time it was captured at instead of stamping
+    it when it arrives (-use_wallclock_as_timestamps). One track, unknown
+    segment size, and one small cluster per block; the header goes out in
+    the same writev() as the payload, which is still written from the
+    caller's buffer.
+    """
+    def __init__(self, writer, track):
+        self.writer = writer
+        self.last = -1
+        header = ebml(0x1A45DFA3, ebml(0x4286, 1) + ebml(0x42F7, 1) + ebml(0x42F2, 4) + ebml(0x42F3, 8)
+                      + ebml(0x4282, 'matroska') + ebml(0x4287, 4) + ebml(0x4285, 2))
+        info = ebml(0x1549A966, ebml(0x2AD7B1, 1000000000 // MATROSKA_TIMESCALE)
+                    + ebml(0x4D80, 'PyAvStreamer') + ebml(0x5741, 'PyAvStreamer'))
+        segment = b'\x18\x53\x80\x67\x01\xff\xff\xff\xff\xff\xff\xff'  # Unknown size: live
+        writer.write(header + segment + info + ebml(0x1654AE6B, track))
+
+    def write(self, data, capture_time):
+        timestamp = max(int((capture_time - CAPTURE_EPOCH) * MATROSKA_TIMESCALE), self.last + 1)
+        self.last = timestamp
+        # SimpleBlock: track 1, relative time 0, keyframe
+        block = b'\xa3' + ebml_size(memoryview(data).nbytes + 4, 8) + b'\x81\x00\x00\x80'
+        cluster_time = ebml(0xE7, timestamp)
+        size = len(cluster_time) + len(block) + memoryview(data).nbytes
+        self.writer.write(data, prefix=b'\x1f\x43\xb6\x75' + ebml_size(size, 8) + cluster_time + block)
+
+class AudioTimeline:
+    """
+    Capture times of successive PCM chunks from the sample count, anchored
+    to the arrival time of the first one, so jitter in when chunks reach the
+    writer doesn't reach the timestamps. Re-anchors when the sample clock
+    and arrival times disagree by more than AUDIO_RESYNC_MS (dropped audio,
+    or drift when it isn't compensated).
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.start = None
+        self.frames = 0
+        self.resyncs = 0
+
+    def stamp(self, frames, end_time):
+        """Capture time of the first of frames whose last one arrived at end_time."""
+        expected = end_time - frames / self.rate
+        if self.start is None:
+            self.start = expected
+        else:
+            now = self.start + self.frames / self.rate
+            if abs(now - expected) > AUDIO_RESYNC_MS / 1000:
+                self.start = expected
+                self.frames = 0
+                self.resyncs += 1
+        timestamp = self.start + self.frames / self.rate
+        self.frames += frames
+        return timestamp
+
+def av_skew_report():
+    """
+    Capture-to-pipe delay of every stream and the audio/video difference:
+    the skew wallclock-on-arrival stamping bakes into the PTS, which capture
+    timestamps remove.
+    """
+    delays = {'video': RunningStats(), 'audio': RunningStats()}
+    lines = []
+    with STREAM_METRICS_LOCK:
+        streams = list(STREAM_METRICS)
+    for m in streams:
+        d = m.capture_delay
+        if d.count:
+            lines.append(f"  {m.kind} {m.name}: capture-to-pipe {d.mean * 1000:.1f} ms "
+                         f"(std {d.std * 1000:.1f}, max {d.max * 1000:.1f})")
+            delays[m.kind].add(d.mean)
+    if delays['video'].count and delays['audio'].count:
+        skew = (delays['video'].mean - delays['audio'].mean) * 1000
+        where = "kept out of the timestamps" if TIMESTAMP_MODE == 'capture' else "in the wallclock timestamps"
+        lines.append(f"  A/V skew {skew:+.1f} ms (video later than audio), {where}")
+    return "\n".join(lines)
+
+# --- UDP Distribution ---
+
+TS_PACKET_BYTES = 188
+UDP_PAYLOAD_BYTES = 7 * TS_PACKET_BYTES  # 1316, as with ?pkt_size=1316
+
+# Every running UdpFanout, so destinations can be added/removed at runtime
+FANOUTS = []
+FANOUTS_LOCK = threading.Lock()
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(_IoVec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+def _load_sendmmsg():
+    """Returns libc's sendmmsg (Linux), or None to fall back to one send() per datagram."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        fn = ctypes.CDLL(None, use_errno=True).sendmmsg
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    fn.restype = ctypes.c_int
+    return fn
+
+_sendmmsg = _load_sendmmsg()
+
+class TokenBucket:
+    """Monotonic-clock token bucket; consume() sleeps until n bytes may be sent."""
+    def __init__(self, rate_bytes_per_sec, burst_bytes):
+        self.rate = rate_bytes_per_sec
+        self.burst = burst_bytes
+        self.tokens = burst_bytes
+        self.last = time.monotonic()
+
+    def consume(self, n):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < n:
+            time.sleep((n - self.tokens) / self.rate)
+            self.last = time.monotonic()
+            self.tokens = n
+        self.tokens -= n
+
+class UdpBatchSender:
+    """
+    Connected UDP socket for one destination that sends a batch of datagrams
+    (slices of one buffer) with a single sendmmsg() call where available.
+    Each datagram can be prefixed with its own header (RTP, for FEC) through
+    a second iovec, so the payload is still never copied.
+    """
+    def __init__(self, dest, max_batch, fec_dest=None):
+        self.dest = dest
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect(dest)
+        self.fec_sock = None
+        if fec_dest:
+            self.fec_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.fec_sock.connect(fec_dest)
+        self.datagrams = 0
+        self.syscalls = 0
+        self.errors = 0
+        if _sendmmsg:
+            # Two iovecs per datagram: header (may be empty), then payload
+            self.iov = (_IoVec * (2 * max_batch))()
+            self.msgs = (_MMsgHdr * max_batch)()
+            for i in range(max_batch):
+                self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iov[2 * i])
+                self.msgs[i].msg_hdr.msg_iovlen = 2
+
+    def send(self, base_address, view, ranges, headers=None, header_address=0, header_size=0):
+        """
+        Sends each (offset, length) slice of view as one datagram, prefixed
+        with the matching header_size-byte slice of headers if given.
+        """
+        if not _sendmmsg:
+            for i, (offset, length) in enumerate(ranges):
+                datagram = view[offset:offset + length]
+                if headers:
+                    datagram = headers[i * header_size:(i + 1) * header_size] + datagram
+                self._count(self._send_one(self.sock, datagram), 1)
+            return
+
+        for i, (offset, length) in enumerate(ranges):
+            self.iov[2 * i].iov_base = header_address + i * header_size
+            self.iov[2 * i].iov_len = header_size if headers else 0
+            self.iov[2 * i + 1].iov_base = base_address + offset
+            self.iov[2 * i + 1].iov_len = length
+        done = 0
+        while done < len(ranges):
+            n = _sendmmsg(self.sock.fileno(), ctypes.byref(self.msgs[done]), len(ranges) - done, 0)
+            self.syscalls += 1
+            if n <= 0:
+                self.errors += len(ranges) - done
+                return
+            self.datagrams += n
+            done += n
+
+    def send_fec(self, packets):
+        for packet in packets:
+            self._count(self._send_one(self.fec_sock, packet), 1)
+
+    def _send_one(self, sock, datagram):
+        try:
+            sock.send(datagram)
+            return True
+        except OSError:
+            return False
+
+    def _count(self, ok, n):
+        self.syscalls += 1
+        if ok:
+            self.datagrams += n
+        else:
+            self.errors += n
+
+    def close(self):
+        self.sock.close()
+        if self.fec_sock:
+            self.fec_sock.close()
+
+class UdpFanout:
+    """
+    Reads the mpegts an encoder writes to stdout and sends every 1316-byte
+    datagram to each destination, so one encode can feed many receivers.
+    Destinations can be added and removed while streaming. Datagrams go out
+    in batches of up to UDP_BATCH per syscall, optionally paced by a token
+    bucket to UDP_PACING_MBPS so keyframe bursts don't overflow receivers.
+    With FEC_COLUMNS set, datagrams are RTP-wrapped and row/column FEC
+    packets go to port + FEC_PORT_OFFSET on every destination.
+    """
+    def __init__(self, source, port, name):
+        self.source = source
+        self.port = port
+        self.name = name
+        self.senders = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.max_batch = max(1, UDP_BATCH)
+        self.bucket = None
+        if UDP_PACING_MBPS > 0:
+            self.bucket = TokenBucket(UDP_PACING_MBPS * 1e6 / 8, self.max_batch * UDP_PAYLOAD_BYTES)
+        self.packets_in = 0
+        self.batches = 0
+        # Datagrams per batch, in power-of-two buckets: 1, 2-3, 4-7, ...
+        self.burst_histogram = collections.Counter()
+        self.start_time = time.monotonic()
+        self.fec = None
+        if FEC_COLUMNS > 0:
+            self.fec = FecEncoder(FEC_COLUMNS, FEC_ROWS)
+            self.headers = bytearray(RTP_HEADER.size * self.max_batch)
+            self.header_address = ctypes.addressof((ctypes.c_char * len(self.headers)).from_buffer(self.headers))
+
+    def add(self, host, port=None):
+        dest = (host, port or self.port)
+        with self.lock:
+            if all(sender.dest != dest for sender in self.senders):
+                fec_dest = (dest[0], dest[1] + FEC_PORT_OFFSET) if self.fec else None
+                self.senders = self.senders + [UdpBatchSender(dest, self.max_batch, fec_dest)]
+
+    def remove(self, host, port=None):
+        dest = (host, port or self.port)
+        with self.lock:
+            keep = [sender for sender in self.senders if sender.dest != dest]
+            gone = [sender for sender in self.senders if sender.dest == dest]
+            self.senders = keep
+        for sender in gone:
+            sender.close()
+
+    def start(self):
+        with FANOUTS_LOCK:
+            FANOUTS.append(self)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        buf = bytearray(UDP_PAYLOAD_BYTES * max(64, self.max_batch))
+        view = memoryview(buf)
+        base_address = ctypes.addressof((ctypes.c_char * len(buf)).from_buffer(buf))
+        filled = 0
+        try:
+            while True:
+                n = self.source.readinto(view[filled:])
+                if not n:
+                    break
+                filled += n
+                sent = 0
+                while filled - sent >= UDP_PAYLOAD_BYTES:
+                    count = min((filled - sent) // UDP_PAYLOAD_BYTES, self.max_batch)
+                    self._send(base_address, view, [(sent + i * UDP_PAYLOAD_BYTES, UDP_PAYLOAD_BYTES) for i in range(count)])
+                    sent += count * UDP_PAYLOAD_BYTES
+                # Keep any partial datagram at the front of the buffer
+                buf[:filled - sent] = buf[sent:filled]
+                filled -= sent
+            if filled:
+                self._send(base_address, view, [(0, filled)])
+        except Exception as e:
+            print(f"UDP fan-out error for {self.name}: {e}")
+        finally:
+            with FANOUTS_LOCK:
+                if self in FANOUTS:
+                    FANOUTS.remove(self)
+            for sender in self.senders:
+                sender.close()
+
+    def _send(self, base_address, view, ranges):
+        fec_packets = []
+        if self.fec:
+            for i, (offset, length) in enumerate(ranges):
+                self.fec.protect(view[offset:offset + length], self.headers, i * RTP_HEADER.size, fec_packets)
+        if self.bucket:
+            size = sum(length for _, length in ranges) + sum(len(packet) for packet in fec_packets)
+            self.bucket.consume(size + (RTP_HEADER.size * len(ranges) if self.fec else 0))
+        self.packets_in += len(ranges)
+        self.batches += 1
+        self.burst_histogram[1 << (len(ranges).bit_length() - 1)] += 1
+        # Copy-on-write list: add/remove never block the send loop
+        for sender in self.senders:
+            if self.fec:
+                sender.send(base_address, view, ranges, self.headers, self.header_address, RTP_HEADER.size)
+                sender.send_fec(fec_packets)
+            else:
+                sender.send(base_address, view, ranges)
+
+    def join(self, timeout=2):
+        if self.thread:
+            self.thread.join(timeout)
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.start_time, 1e-6)
+        senders = self.senders
+        sent = sum(sender.datagrams for sender in senders)
+        syscalls = sum(sender.syscalls for sender in senders)
+        errors = sum(sender.errors for sender in senders)
+        histogram = ", ".join(f"{size}-{size * 2 - 1}: {count}" if size > 1 else f"1: {count}"
+                              for size, count in sorted(self.burst_histogram.items()))
+        text = (f"{self.packets_in / elapsed:.0f} datagrams/s encoded, {sent / elapsed:.0f} packets/s and "
+                f"{syscalls / elapsed:.0f} syscalls/s to {len(senders)} destinations, {errors} send errors, "
+                f"burst sizes [{histogram}]")
+        if self.fec:
+            text += f", {self.fec.report()}"
+        return text
+
+def add_fanout_destination(host):
+    """Adds a receiver host to every running stream and to streams started later."""
+    if host not in FANOUT_HOSTS:
+        FANOUT_HOSTS.append(host)
+    with FANOUTS_LOCK:
+        for fanout in FANOUTS:
+            fanout.add(host)
+
+def remove_fanout_destination(host):
+    if host in FANOUT_HOSTS:
+        FANOUT_HOSTS.remove(host)
+    with FANOUTS_LOCK:
+        for fanout in FANOUTS:
+            fanout.remove(host)
+
+# --- Forward Error Correction ---
+
+# RTP header on every media datagram: V=2, payload type, sequence, 90 kHz timestamp, SSRC
+RTP_HEADER = struct.Struct('!BBHII')
+RTP_PT_MP2T = 33
+RTP_PT_FEC = 96
+# FEC header after the RTP header: SN base, length recovery, direction, offset, count
+FEC_HEADER = struct.Struct('!HHBBBx')
+FEC_COLUMN = 0
+FEC_ROW = 1
+
+class FecEncoder:
+    """
+    Pro-MPEG (SMPTE 2022-1 style) row/column XOR FEC over a matrix of
+    columns x rows media datagrams. Every completed row and column yields one
+    FEC packet that rebuilds any single missing datagram in it, so the
+    overhead is (columns + rows) / (columns * rows); rows=0 is row-only FEC.
+    """
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+        self.ssrc = random.getrandbits(32)
+        self.seq = 0
+        self.fec_seq = 0
+        self.index = 0  # Position in the current matrix
+        self.row_xor = np.zeros(UDP_PAYLOAD_BYTES, np.uint8)
+        self.row_length = 0
+        self.column_xor = np.zeros((columns if rows else 1, UDP_PAYLOAD_BYTES), np.uint8)
+        self.column_length = [0] * columns
+        self.data_packets = 0
+        self.fec_packets = 0
+
+    def protect(self, payload, headers, header_offset, fec_packets):
+        """
+        Writes payload's RTP header into headers at header_offset, folds it
+        into the row/column XOR and appends any completed FEC packets.
+        """
+        timestamp = int(time.monotonic() * 90000) & 0xFFFFFFFF
+        RTP_HEADER.pack_into(headers, header_offset, 0x80, RTP_PT_MP2T, self.seq & 0xFFFF, timestamp, self.ssrc)
+        data = np.frombuffer(payload, np.uint8)
+        row, column = divmod(self.index, self.columns)
+
+        self.row_xor[:len(data)] ^= data
+        self.row_length ^= len(data)
+        if column == self.columns - 1:
+            fec_packets.append(self._packet(FEC_ROW, self.seq - column, 1, self.columns, self.row_xor, self.row_length))
+            self.row_xor[:] = 0
+            self.row_length = 0
+
+        if self.rows:
+            self.column_xor[column, :len(data)] ^= data
+            self.column_length[column] ^= len(data)
+            if row == self.rows - 1:
+                snbase = self.seq - row * self.columns
+                fec_packets.append(self._packet(FEC_COLUMN, snbase, self.columns, self.rows,
+                                                self.column_xor[column], self.column_length[column]))
+                self.column_xor[column] = 0
+                self.column_length[column] = 0
+
+        self.seq += 1
+        self.data_packets += 1
+        self.index = (self.index + 1) % (self.columns * max(self.rows, 1))
+
+    def _packet(self, direction, snbase, offset, count, xor, length):
+        header = RTP_HEADER.pack(0x80, RTP_PT_FEC, self.fec_seq & 0xFFFF, 0, self.ssrc)
+        self.fec_seq += 1
+        self.fec_packets += 1
+        return header + FEC_HEADER.pack(snbase & 0xFFFF, length, direction, offset, count) + xor.tobytes()
+
+    def report(self):
+        overhead = 100 * self.fec_packets / max(self.data_packets, 1)
+        matrix = f"{self.columns}x{self.rows}" if self.rows else f"{self.columns} row-only"
+        return f"FEC {matrix}: {self.fec_packets} FEC packets ({overhead:.1f}% overhead)"
+
+class FecDecoder:
+    """
+    Reorders RTP-wrapped datagrams by sequence number and rebuilds missing
+    ones from row/column FEC packets, repeating until no more can be
+    recovered (a row repair can complete a column and vice versa). A gap is
+    given up on once it is further back than one FEC matrix.
+    """
+    def __init__(self, output):
+        self.output = output  # Called with each payload, in order
+        self.packets = {}     # Extended sequence number -> payload, kept for a while after output
+        self.fec = []         # (snbase, offset, count, length recovery, xor payload)
+        self.next_seq = None
+        self.highest = None
+        self.holdback = 32
+        self.ssrc = None
+        self.received = 0
+        self.fec_received = 0
+        self.recovered = 0
+        self.lost = 0
+
+    def _extend(self, seq):
+        """Unwraps a 16-bit RTP sequence number relative to the highest one seen."""
+        if self.highest is None:
+            return seq
+        return self.highest + ((seq - self.highest + 0x8000) & 0xFFFF) - 0x8000
+
+    def on_data(self, datagram):
+        if len(datagram) < RTP_HEADER.size:
+            return
+        _, _, seq, _, ssrc = RTP_HEADER.unpack_from(datagram)
+        if ssrc != self.ssrc:
+            # The sender restarted: new SSRC, sequence numbers start over
+            self.flush(force=True)
+            self.packets.clear()
+            self.fec = []
+            self.next_seq = None
+            self.highest = None
+            self.ssrc = ssrc
+        seq = self._extend(seq)
+        if self.next_seq is None:
+            self.next_seq = seq
+        if seq < self.next_seq or seq in self.packets:
+            return
+        self.received += 1
+        self.packets[seq] = bytes(datagram[RTP_HEADER.size:])
+        self.highest = seq if self.highest is None else max(self.highest, seq)
+        self._recover()
+        self.flush()
+
+    def on_fec(self, datagram):
+        if len(datagram) < RTP_HEADER.size + FEC_HEADER.size:
+            return
+        _, _, _, _, ssrc = RTP_HEADER.unpack_from(datagram)
+        snbase, length, _, offset, count = FEC_HEADER.unpack_from(datagram, RTP_HEADER.size)
+        if ssrc != self.ssrc or offset < 1 or count < 1:
+            return
+        self.fec_received += 1
+        # A column FEC packet arrives about one matrix after its first datagram
+        self.holdback = max(self.holdback, offset * count + count)
+        xor = np.frombuffer(datagram, np.uint8, offset=RTP_HEADER.size + FEC_HEADER.size)
+        self.fec.append((self._extend(snbase), offset, count, length, xor))
+        self._recover()
+        self.flush()
+
+    def _recover(self):
+        progress = True
+        while progress:
+            progress = False
+            pending = []
+            for entry in self.fec:
+                snbase, offset, count, length, xor = entry
+                members = range(snbase, snbase + offset * count, offset)
+                missing = [seq for seq in members if seq not in self.packets]
+                if not missing or self.next_seq is None or members[-1] < self.next_seq:
+                    continue
+                if missing[0] < self.next_seq:
+                    continue
+                # Wait while several are missing, or the one missing may simply not have arrived yet
+                if len(missing) > 1 or missing[0] > self.highest:
+                    pending.append(entry)
+                    continue
+                rebuilt = xor.copy()
+                for seq in members:
+                    if seq != missing[0]:
+                        data = np.frombuffer(self.packets[seq], np.uint8)
+                        rebuilt[:len(data)] ^= data
+                        length ^= len(data)
+                self.packets[missing[0]] = rebuilt[:length].tobytes()
+                self.recovered += 1
+                progress = True
+            self.fec = pending
+
+    def flush(self, force=False):
+        """Outputs datagrams in order; force gives up on every gap now (e.g. the sender went idle)."""
+        if self.next_seq is None:
+            return
+        while self.next_seq <= self.highest:
+            if self.next_seq in self.packets:
+                self.output(self.packets[self.next_seq])
+            elif force or self.highest - self.next_seq > self.holdback:
+                self.lost += 1
+            else:
+                break
+            self.next_seq += 1
+        oldest = self.next_seq - 2 * self.holdback
+        if len(self.packets) > 4 * self.holdback:
+            for seq in [seq for seq in self.packets if seq < oldest]:
+                del self.packets[seq]
+
+    def report(self):
+        missing = self.recovered + self.lost
+        rate = 100 * self.recovered / missing if missing else 100.0
+        return (f"{self.received} datagrams, {self.fec_received} FEC packets, {missing} missing: "
+                f"{self.recovered} recovered, {self.lost} lost ({rate:.1f}% recovered)")
+
+class FecReceiver:
+    """
+    Local receiver for an FEC-protected stream: listens on the media port and
+    port + FEC_PORT_OFFSET, repairs the stream and forwards plain datagrams
+    to OBS. drop_probability injects random loss for testing.
+    """
+    def __init__(self, port, forward, drop_probability=0.0, seed=None):
+        self.port = port
+        self.data_sock = self._bind(port)
+        self.fec_sock = self._bind(port + FEC_PORT_OFFSET)
+        self.out_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.out_sock.connect(forward)
+        self.decoder = FecDecoder(self._forward)
+        self.drop_probability = drop_probability
+        self.random = random.Random(seed)
+        self.dropped = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _bind(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        sock.bind(('0.0.0.0', port))
+        return sock
+
+    def _forward(self, payload):
+        try:
+            self.out_sock.send(payload)
+        except OSError:
+            pass
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        handlers = {self.data_sock: self.decoder.on_data, self.fec_sock: self.decoder.on_fec}
+        while not self.stop_event.is_set():
+            ready, _, _ = select.select(list(handlers), [], [], 0.2)
+            if not ready:
+                self.decoder.flush(force=True)
+            for sock in ready:
+                datagram = sock.recv(65536)
+                if self.drop_probability and self.random.random() < self.drop_probability:
+                    self.dropped += 1
+                    continue
+                handlers[sock](datagram)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=2)
+        self.decoder.flush(force=True)
+        for sock in (self.data_sock, self.fec_sock, self.out_sock):
+            sock.close()
+
+    def report(self):
+        text = self.decoder.report()
+        if self.drop_probability:
+            text += f", {self.dropped} dropped by loss injection"
+        return text
+
+def parse_fec_matrix(text):
+    """Parses an --fec value like '10x5' into (columns, rows)."""
+    try:
+        columns, rows = (int(part) for part in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected COLSxROWS, e.g. 10x5, got '{text}'")
+    if not 1 <= columns <= 255 or not 0 <= rows <= 255:
+        raise argparse.ArgumentTypeError("FEC columns must be 1-255 and rows 0-255")
+    return columns, rows
+
+def run_fec_receivers(ports):
+    """Repairs FEC-protected streams on the given ports until Ctrl+C."""
+    receivers = []
+    for port in ports:
+        receiver = FecReceiver(port, ('127.0.0.1', port + FEC_FORWARD_OFFSET))
+        receiver.start()
+        receivers.append(receiver)
+        print(f"[FEC] Receiving port {port} (+FEC on {port + FEC_PORT_OFFSET}) -> udp://127.0.0.1:{port + FEC_FORWARD_OFFSET}")
+    try:
+        while True:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    for receiver in receivers:
+        receiver.stop()
+        print(f"[FEC] Port {receiver.port}: {receiver.report()}")
+
+# --- Encoders ---
+
+# Every FFmpeg process we spawn, for process/thread/CPU accounting
+ENCODER_PROCS = []
+
+def spawn_ffmpeg(cmd, **kwargs):
+    proc = subprocess.Popen(cmd, **kwargs)
+    ENCODER_PROCS.append(proc)
+    return proc
+
+def encoder_stats():
+    """
+    Returns (processes spawned, live processes, live threads, CPU seconds) for
+    all FFmpeg encoders. Threads and live CPU come from /proc, so they are
+    only counted on Linux; exited encoders are counted via os.times().
+    """
+    live = [proc for proc in ENCODER_PROCS if proc.poll() is None]
+    threads = 0
+    cpu = 0.0
+    for proc in live:
+        try:
+            with open(f"/proc/{proc.pid}/status") as f:
+                for line in f:
+                    if line.startswith("Threads:"):
+                        threads += int(line.split()[1])
+            with open(f"/proc/{proc.pid}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        except (OSError, ValueError, IndexError):
+            pass
+    if hasattr(os, 'times'):
+        times = os.times()
+        cpu += times.children_user + times.children_system
+    return len(ENCODER_PROCS), len(live), threads, cpu
+
+class FFmpegEncoder:
+    """One FFmpeg process per stream, fed through its stdin."""
+    def __init__(self, stderr=subprocess.DEVNULL):
+        self.stderr = stderr
+        self.proc = None
+        self.writer = None
+        self.fanout = None
+
+    def start(self, input_args, output_args):
+        stdout = None
+        if USE_FANOUT:
+            # FFmpeg writes the mpegts to stdout; UdpFanout sends it to every receiver
+            url = urlsplit(output_args[-1])
+            output_args = [*output_args[:-1], 'pipe:1']
+            stdout = subprocess.PIPE
+
+        cmd = [get_ffmpeg_path(), '-y', *input_args, '-i', 'pipe:0', *output_args]
+        # Unbuffered stdin: data goes straight to the fd via PipeWriter
+        self.proc = spawn_ffmpeg(cmd, stdin=subprocess.PIPE, stdout=stdout, stderr=self.stderr, bufsize=0)
+        self.proc.closing = False  # Set by close(): the supervisor expects this process's exit
+        self.writer = PipeWriter(self.proc.stdin.fileno())
+        handle = getattr(CURRENT_STREAM, 'handle', None)
+        if handle:
+            handle.watch_process(self.proc)
+
+        if USE_FANOUT:
+            self.fanout = UdpFanout(self.proc.stdout, url.port, f"udp://{url.hostname}:{url.port}")
+            self.fanout.add(url.hostname)
+            for host in FANOUT_HOSTS:
+                self.fanout.add(host)
+            self.fanout.start()
+
+    def write(self, data):
+        self.writer.write(data)
+
+    def close(self):
+        if not self.proc:
+            return
+        self.proc.closing = True
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=2)
+        except:
+            self.proc.kill()
+        if self.fanout:
+            self.fanout.join()
+            print(f"[Fan-out] {self.fanout.name}: {self.fanout.report()}")
+
+def ffmpeg_option(args, name, default=None):
+    """Returns the value following name in an FFmpeg argument list."""
+    for i in range(len(args) - 1):
+        if args[i] == name:
+            return args[i + 1]
+    return default
+
+class PyAvEncoder:
+    """
+    In-process encoder/muxer using PyAV (libav bindings). Takes the same
+    FFmpeg-style arguments as FFmpegEncoder, but frames are encoded straight
+    from the ndarray with no pipe copy and no ffmpeg subprocess. The codec
+    context is created once and reused for every frame.
+    """
+    # Shapes of the raw frame layouts the video tasks produce, by pix_fmt
+    FRAME_SHAPES = {
+        'bgr24': lambda w, h: (h, w, 3),
+        'yuv420p': lambda w, h: (h * 3 // 2, w),
+        'nv12': lambda w, h: (h * 3 // 2, w),
+        'yuyv422': lambda w, h: (h, w, 2),
+    }
+
+    def __init__(self):
+        if av is None:
+            raise RuntimeError("PyAV is not installed (pip install av)")
+        self.container = None
+        self.stream = None
+        self.writer = self
+        self.bytes_written = 0
+        self.writes = 0
+        self.write_seconds = 0.0
+        self.encode_time = RunningStats()
+
+    def start(self, input_args, output_args):
+        url = output_args[-1]
+        self.container = av.open(url, mode='w', format=ffmpeg_option(output_args, '-f', 'mpegts'))
+        video_codec = ffmpeg_option(output_args, '-c:v')
+        if video_codec:
+            self.pix_fmt = ffmpeg_option(input_args, '-pix_fmt')
+            if ffmpeg_option(input_args, '-f') != 'rawvideo' or self.pix_fmt not in self.FRAME_SHAPES or video_codec == 'copy':
+                raise RuntimeError("PyAV backend only encodes raw bgr24/yuv420p/nv12/yuyv422 video")
+            width, height = (int(v) for v in ffmpeg_option(input_args, '-s').split('x'))
+            rate = Fraction(ffmpeg_option(input_args, '-r', '30')).limit_denominator(1001)
+            self.shape = self.FRAME_SHAPES[self.pix_fmt](width, height)
+            self.stream = self.container.add_stream(video_codec, rate=rate)
+            self.stream.width = width
+            self.stream.height = height
+            self.stream.pix_fmt = 'yuv420p'
+            self.stream.options = {k: v for k, v in (
+                ('preset', ffmpeg_option(output_args, '-preset')),
+                ('tune', ffmpeg_option(output_args, '-tune')),
+                ('threads', ffmpeg_option(output_args, '-threads')),
+            ) if v}
+            self.stream.codec_context.time_base = 1 / rate
+        else:
+            self.rate = int(ffmpeg_option(input_args, '-ar'))
+            self.channels = int(ffmpeg_option(input_args, '-ac', '1'))
+            self.layout = audio_layout(self.channels)
+            # PyAV resamples frames to the stream's rate/layout, like -ar/-ac in FFmpeg
+            out_rate = int(ffmpeg_option(output_args, '-ar', self.rate))
+            out_channels = int(ffmpeg_option(output_args, '-ac', self.channels))
+            self.stream = self.container.add_stream(ffmpeg_option(output_args, '-c:a'), rate=out_rate)
+            self.stream.layout = audio_layout(out_channels)
+            bitrate = ffmpeg_option(output_args, '-b:a')
+            if bitrate:
+                self.stream.bit_rate = int(bitrate.rstrip('k')) * (1000 if bitrate.endswith('k') else 1)
+        self.pts = 0
+
+    def write(self, data):
+        start = time.perf_counter()
+        if self.stream.type == 'video':
+            frame = av.VideoFrame.from_ndarray(np.asarray(data).reshape(self.shape), format=self.pix_fmt)
+            frame.pts = self.pts
+            self.pts += 1
+        else:
+            samples = np.frombuffer(data, dtype=np.int16).reshape(1, -1)
+            frame = av.AudioFrame.from_ndarray(samples, format='s16', layout=self.layout)
+            frame.sample_rate = self.rate
+            frame.time_base = Fraction(1, self.rate)
+            frame.pts = self.pts
+            self.pts += samples.shape[1] // self.channels
+        for packet in self.stream.encode(frame):
+            self.container.mux(packet)
+        elapsed = time.perf_counter() - start
+        self.encode_time.add(elapsed)
+        self.write_seconds += elapsed
+        self.bytes_written += memoryview(data).nbytes
+        self.writes += 1
+
+    def report(self):
+        t = self.encode_time
+        return (f"in-process encode, {self.writes} writes, mean {t.mean * 1000:.2f} ms, "
+                f"max {t.max * 1000:.2f} ms per write")
+
+    def close(self):
+        if not self.container:
+            return
+        try:
+            for packet in self.stream.encode(None):
+                self.container.mux(packet)
+        except Exception:
+            pass
+        self.container.close()
+        self.container = None
+
+def audio_layout(channels):
+    """FFmpeg channel layout name for a channel count."""
+    return {1: 'mono', 2: 'stereo'}.get(channels, f"{channels}c")
+
+def new_encoder(stderr=subprocess.DEVNULL):
+    """Creates a per-stream encoder for the configured --encoder-backend."""
+    if ENCODER_BACKEND == 'pyav':
+        return PyAvEncoder()
+    return FFmpegEncoder(stderr=stderr)
+
+class SharedFFmpeg:
+    """
+    A single FFmpeg process encoding a whole batch of streams. Each stream gets
+    its own pipe, passed to FFmpeg with pass_fds and opened as /dev/fd/N, and
+    its own output. FFmpeg is launched once every expected stream has attached
+    (or SHARED_FFMPEG_TIMEOUT passes). POSIX only.
+    """
+    def __init__(self, expected):
+        self.expected = expected
+        self.inputs = []
+        self.cond = threading.Condition()
+        self.proc = None
+        self.launched = False
+
+    def slot(self):
+        return SharedFFmpegInput(self)
+
+    def attach(self, inp):
+        with self.cond:
+            if self.launched:
+                raise RuntimeError("Shared FFmpeg is already running")
+            inp.read_fd, inp.fd = os.pipe()
+            self.inputs.append(inp)
+            if len(self.inputs) >= self.expected:
+                self._launch()
+            elif not self.cond.wait_for(lambda: self.launched, SHARED_FFMPEG_TIMEOUT):
+                print(f"Shared FFmpeg: starting with {len(self.inputs)} of {self.expected} streams.")
+                self._launch()
+            if not self.proc:
+                raise RuntimeError("Shared FFmpeg failed to start")
+
+    def withdraw(self):
+        """Called for a stream that will never attach."""
+        with self.cond:
+            self.expected -= 1
+            if self.inputs and not self.launched and len(self.inputs) >= self.expected:
+                self._launch()
+
+    def detach(self):
+        with self.cond:
+            self.expected -= 1
+            last = self.expected <= 0
+        if last and self.proc:
+            try:
+                self.proc.wait(timeout=2)
+            except:
+                self.proc.kill()
+
+    def _launch(self):
+        self.launched = True
+        cmd = [get_ffmpeg_path(), '-y']
+        for inp in self.inputs:
+            cmd += [*inp.input_args, '-i', f'/dev/fd/{inp.read_fd}']
+        for i, inp in enumerate(self.inputs):
+            cmd += ['-map', f'{i}:0', *inp.output_args]
+        try:
+            self.proc = spawn_ffmpeg(cmd, pass_fds=[inp.read_fd for inp in self.inputs], stderr=subprocess.DEVNULL)
+            print(f"Shared FFmpeg started for {len(self.inputs)} streams (pid {self.proc.pid}).")
+        except Exception as e:
+            print(f"Failed to start shared FFmpeg: {e}")
+        finally:
+            for inp in self.inputs:
+                os.close(inp.read_fd)
+            self.cond.notify_all()
+
+class SharedFFmpegInput:
+    """One stream's handle on a SharedFFmpeg; same interface as FFmpegEncoder."""
+    def __init__(self, shared):
+        self.shared = shared
+        self.fd = None
+        self.read_fd = None
+        self.writer = None
+        self.attached = False
+        self.closed = False
+
+    def start(self, input_args, output_args):
+        self.input_args = input_args
+        self.output_args = output_args
+        self.attached = True
+        self.shared.attach(self)
+        self.writer = PipeWriter(self.fd)
+
+    def write(self, data):
+        self.writer.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if not self.attached:
+            self.shared.withdraw()
+            return
+        if self.fd is not None:
+            # EOF on this input ends just this stream's output
+            os.close(self.fd)
+        self.shared.detach()
+
+# --- Adaptive Bitrate ---
+
+# Quality ladder, best first: (scale, frame rate divisor, bitrate factor)
+ABR_LADDER = [
+    (1.0, 1, 1.0),
+    (1.0, 1, 0.7),
+    (1.0, 2, 0.5),
+    (0.75, 2, 0.35),
+    (0.5, 2, 0.2),
+]
+ABR_BITS_PER_PIXEL = 0.1  # Top-level H.264 bitrate per pixel per frame
+
+class ProgressMonitor:
+    """
+    Receives FFmpeg's -progress key=value reports on a localhost UDP socket,
+    keeps the latest one and calls on_sample (if given) with each as a dict.
+    """
+    def __init__(self, on_sample=None):
+        self.on_sample = on_sample
+        self.latest = {}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.url = f"udp://127.0.0.1:{self.sock.getsockname()[1]}"
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def args(self):
+        """Global FFmpeg options that send progress here twice a second."""
+        return ['-progress', self.url, '-stats_period', '0.5']
+
+    def _run(self):
+        sample = {}
+        try:
+            while True:
+                for line in self.sock.recv(65536).decode('ascii', 'replace').splitlines():
+                    key, _, value = line.partition('=')
+                    sample[key.strip()] = value.strip()
+                    if key == 'progress':
+                        self.latest = sample
+                        if self.on_sample:
+                            self.on_sample(sample)
+                        sample = {}
+        except OSError:
+            pass
+
+    def close(self):
+        self.sock.close()
+
+def progress_value(sample, key):
+    """Parses a numeric -progress field like '1.02x' or '2310.5kbits/s'; None if N/A."""
+    value = sample.get(key, '')
+    for suffix in ('kbits/s', 'x'):
+        if value.endswith(suffix):
+            value = value[:-len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+class AdaptiveBitrate:
+    """
+    Steps a video stream along ABR_LADDER from FFmpeg's progress reports and
+    pipe backpressure. A report is bad when encode speed is under
+    ABR_SPEED_LOW, the frame ring dropped frames, or writes blocked more
+    than ABR_BUSY_HIGH of the frame interval; good when speed is at least
+    ABR_SPEED_OK and writes blocked under ABR_BUSY_OK. ABR_DOWN_AFTER bad
+    reports step down, ABR_UP_AFTER good ones step up, and no change
+    happens within ABR_HOLD seconds of the last one.
+    The task thread polls level and restarts its encoder when it changes.
+    """
+    def __init__(self, name, width, height, fps, ring):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.ring = ring
+        self.max_kbps = width * height * fps * ABR_BITS_PER_PIXEL / 1000
+        self.level = 0
+        self.bad = 0
+        self.good = 0
+        self.last_change = time.monotonic()
+        self.dropped_seen = 0
+        self.write_time = 0.0
+        self.writes = 0
+        self.changes = 0
+        self.monitor = ProgressMonitor(self.on_progress)
+
+    def describe(self, level):
+        scale, divisor, factor = ABR_LADDER[level]
+        width, height = self.scaled(scale)
+        return f"{width}x{height} @ {self.fps / divisor:g} fps, {self.max_kbps * factor:.0f} kbps"
+
+    def scaled(self, scale):
+        # Even dimensions for yuv420p
+        return int(self.width * scale) // 2 * 2, int(self.height * scale) // 2 * 2
+
+    def output_args(self, level):
+        """libx264 rate control, scaling and frame rate for a ladder level."""
+        scale, divisor, factor = ABR_LADDER[level]
+        kbps = int(self.max_kbps * factor)
+        args = ['-b:v', f'{kbps}k', '-maxrate', f'{kbps}k', '-bufsize', f'{kbps}k']
+        if scale < 1.0:
+            width, height = self.scaled(scale)
+            args += ['-vf', f'scale={width}:{height}']
+        if divisor > 1:
+            args += ['-r', f'{self.fps / divisor:g}']
+        return args
+
+    def frame_divisor(self):
+        """Only every Nth captured frame needs piping at the current level."""
+        return ABR_LADDER[self.level][1]
+
+    def note_write(self, seconds):
+        self.write_time += seconds
+        self.writes += 1
+
+    def on_progress(self, sample):
+        speed = progress_value(sample, 'speed')
+        if speed is None:
+            return
+        dropped = self.ring.dropped - self.dropped_seen
+        self.dropped_seen = self.ring.dropped
+        # Share of the (decimated) frame interval spent blocked writing to FFmpeg
+        busy = self.write_time * self.fps / self.frame_divisor() / max(self.writes, 1)
+        self.write_time = 0.0
+        self.writes = 0
+
+        if speed < ABR_SPEED_LOW or dropped or busy > ABR_BUSY_HIGH:
+            self.bad += 1
+            self.good = 0
+        elif speed >= ABR_SPEED_OK and busy < ABR_BUSY_OK:
+            self.good += 1
+            self.bad = 0
+        else:
+            self.good = 0
+
+        if self.bad >= ABR_DOWN_AFTER and self.level < len(ABR_LADDER) - 1:
+            step = 1
+        elif self.good >= ABR_UP_AFTER and self.level > 0:
+            step = -1
+        else:
+            return
+        fps = progress_value(sample, 'fps') or 0
+        kbps = progress_value(sample, 'bitrate') or 0
+        reason = (f"speed {speed:.2f}x, {fps:.1f} fps, {kbps:.0f} kbps, "
+                  f"{dropped} dropped frames, pipe busy {100 * busy:.0f}%")
+        if time.monotonic() - self.last_change < ABR_HOLD:
+            print(f"[ABR] {self.name}: holding at level {self.level} ({reason})")
+            return
+        new_level = self.level + step
+        print(f"[ABR] {self.name}: level {self.level} -> {new_level} "
+              f"({self.describe(new_level)}): {reason}")
+        self.level = new_level
+        self.bad = 0
+        self.good = 0
+        self.changes += 1
+        self.last_change = time.monotonic()
+
+    def report(self):
+        return f"level {self.level} ({self.describe(self.level)}), {self.changes} changes"
+
+    def close(self):
+        self.monitor.close()
+
+# --- Metrics ---
+
+# StreamMetrics of every stream started, for the metrics endpoint
+STREAM_METRICS = []
+STREAM_METRICS_LOCK = threading.Lock()
+
+class StreamMetrics:
+    """
+    Per-stream numbers for the Prometheus endpoint. The hot paths only bump
+    plain int attributes (here, or the counters PipeWriter/FrameRing/AudioRing
+    already keep); everything is read and formatted at scrape time.
+    """
+    def __init__(self, kind, name, port):
+        self.kind = kind
+        self.name = name
+        self.port = port
+        self.up = 1
+        self.captured = 0          # Video frames / audio periods read from the device
+        self.input_overflows = None  # PortAudio input overflows; set to 0 by callback-mode streams
+        self.writer = None         # PipeWriter (or PyAvEncoder) of the current encoder
+        self.ring = None           # FrameRing
+        self.audio_ring = None     # AudioRing
+        self.drift = None          # ClockDrift of the (first) capture device
+        self.progress = None       # ProgressMonitor
+        self.capture_delay = RunningStats()  # Seconds from capture to the encoder write
+        self.capture_jitter = None  # PeriodJitter of a video capture thread
+        self.live = False          # Set by the first successful encoder write
+        self.restarts = 0          # Encoder respawns and whole-stream restarts
+        self.reconnect = RunningStats()  # Seconds from a failure to the next successful write
+        self.failed_at = None
+        self.handle = getattr(CURRENT_STREAM, 'handle', None)
+        previous = None
+        if self.handle:
+            self.handle.name = f"{kind} {name}"
+            previous, self.handle.metrics = self.handle.metrics, self
+            if self.handle.failed_at is not None:
+                # Restarted by the supervisor: same series, counters carried over
+                self.failed_at = self.handle.failed_at
+                self.handle.failed_at = None
+                self.restarts = previous.restarts + 1 if previous else 1
+                if previous:
+                    self.reconnect = previous.reconnect
+        with STREAM_METRICS_LOCK:
+            if previous in STREAM_METRICS:
+                STREAM_METRICS.remove(previous)
+            STREAM_METRICS.append(self)
+
+    def labels(self):
+        name = self.name.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return f'kind="{self.kind}",stream="{name}",port="{self.port}"'
+
+    def samples(self):
+        """Yields (metric name, value) for every metric this stream has."""
+        yield 'stream_up', self.up
+        yield 'captured_total', self.captured
+        writer = self.writer
+        if writer:
+            yield 'written_total', writer.writes
+            yield 'written_bytes_total', writer.bytes_written
+            yield 'write_latency_seconds_sum', writer.write_seconds
+            yield 'write_latency_seconds_count', writer.writes
+        if self.ring:
+            yield 'video_frames_dropped_total', self.ring.dropped
+            yield 'queue_depth', self.ring.depth
+        if self.audio_ring:
+            yield 'audio_resyncs_total', self.audio_ring.overflows
+            yield 'audio_dropped_bytes_total', self.audio_ring.dropped_bytes
+            yield 'audio_buffer_ms', self.audio_ring.depth_ms
+            if self.input_overflows is not None:
+                # Blocking reads don't report overflows without discarding the chunk
+                yield 'audio_input_overflows_total', self.input_overflows
+        if self.drift:
+            yield 'audio_clock_drift_ppm', self.drift.ppm
+        if self.capture_delay.count:
+            yield 'capture_delay_seconds', self.capture_delay.mean
+        if self.capture_jitter and self.capture_jitter.deviation.count:
+            yield 'capture_jitter_seconds', self.capture_jitter.deviation.mean
+            yield 'capture_jitter_max_seconds', self.capture_jitter.deviation.max
+        yield 'restarts_total', self.restarts
+        if self.reconnect.count:
+            yield 'reconnect_seconds_sum', self.reconnect.mean * self.reconnect.count
+            yield 'reconnect_seconds_count', self.reconnect.count
+        if self.progress:
+            sample = self.progress.latest
+            for key, metric in (('fps', 'ffmpeg_fps'), ('speed', 'ffmpeg_speed'), ('bitrate', 'ffmpeg_bitrate_kbps')):
+                value = progress_value(sample, key)
+                if value is not None:
+                    yield metric, value
+
+    def set_live(self):
+        """Marks the stream live; tells the supervisor when it runs under one."""
+        self.live = True
+        if self.failed_at is not None:
+            self.reconnect.add(time.monotonic() - self.failed_at)
+            self.failed_at = None
+        if self.handle:
+            self.handle.mark_live()
+
+    def close(self):
+        self.up = 0
+        if self.progress:
+            self.progress.close()
+
+METRIC_HELP = {
+    'stream_up': ('gauge', "1 while the stream is running"),
+    'captured_total': ('counter', "Video frames or audio periods read from the device"),
+    'written_total': ('counter', "Writes to the encoder"),
+    'written_bytes_total': ('counter', "Bytes written to the encoder"),
+    'write_latency_seconds': ('summary', "Time spent in encoder writes"),
+    'video_frames_dropped_total': ('counter', "Video frames dropped by the frame queue"),
+    'audio_resyncs_total': ('counter', "Audio ring resyncs that dropped the oldest PCM to bound latency"),
+    'queue_depth': ('gauge', "Frames waiting for the encoder"),
+    'audio_dropped_bytes_total': ('counter', "PCM bytes dropped to bound audio latency"),
+    'audio_buffer_ms': ('gauge', "Audio buffered between the mic and the encoder"),
+    'audio_input_overflows_total': ('counter', "PortAudio input overflows (callback-mode streams)"),
+    'audio_clock_drift_ppm': ('gauge', "Capture clock drift against the monotonic clock"),
+    'capture_delay_seconds': ('gauge', "Mean time from capture to the encoder write"),
+    'capture_jitter_seconds': ('gauge', "Mean deviation of video capture periods from nominal"),
+    'capture_jitter_max_seconds': ('gauge', "Largest deviation of a video capture period from nominal"),
+    'restarts_total': ('counter', "Encoder respawns and stream restarts after a failure"),
+    'reconnect_seconds': ('summary', "Time from a failure to streaming again"),
+    'ffmpeg_fps': ('gauge', "Output frame rate reported by FFmpeg"),
+    'ffmpeg_speed': ('gauge', "Encode speed reported by FFmpeg (1.0 = real time)"),
+    'ffmpeg_bitrate_kbps': ('gauge', "Output bitrate reported by FFmpeg"),
+}
+
+def render_metrics():
+    """Formats every stream's metrics in the Prometheus text exposition format."""
+    series = collections.defaultdict(list)
+    with STREAM_METRICS_LOCK:
+        streams = list(STREAM_METRICS)
+    for stream in streams:
+        labels = stream.labels()
+        for name, value in stream.samples():
+            series[name].append(f"pyavstreamer_{name}{{{labels}}} {value}")
+
+    lines = []
+    for name, (kind, text) in METRIC_HELP.items():
+        names = [f"{name}_sum", f"{name}_count"] if kind == 'summary' else [name]
+        if not any(series[n] for n in names):
+            continue
+        lines.append(f"# HELP pyavstreamer_{name} {text}")
+        lines.append(f"# TYPE pyavstreamer_{name} {kind}")
+        for n in names:
+            lines.extend(series[n])
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # No console line per scrape
+
+def start_metrics_server(port):
+    """Serves /metrics on localhost from a daemon thread."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics: http://127.0.0.1:{port}/metrics")
+    return server
+
+# --- Tracing ---
+
+TRACE_STAGES = [
+    'cap.read', 'convert', 'ring.put', 'ring.get', 'queued', 'pipe.write', 'encoder.restart',
+    'mic.read', 'audio.callback', 'audio.ring.read',
+]
+(TRACE_CAP_READ, TRACE_CONVERT, TRACE_RING_PUT, TRACE_RING_GET, TRACE_QUEUED, TRACE_PIPE_WRITE,
+ TRACE_ENCODER_RESTART, TRACE_MIC_READ, TRACE_AUDIO_CALLBACK, TRACE_AUDIO_RING_READ) = range(len(TRACE_STAGES))
+# Spans that overlap each other on one thread (a frame waiting in the queue), exported as async events
+TRACE_ASYNC_STAGES = {TRACE_QUEUED}
+
+class Tracer:
+    """
+    Opt-in per-frame stage tracing. Spans go into preallocated arrays used as
+    a ring (the last `capacity` spans are kept), so tracing never allocates
+    per frame and its memory is bounded. begin() returns 0 while disabled,
+    making the hot path a single attribute check; it can be switched on and
+    off at any time. dump() writes Chrome trace JSON (Perfetto, chrome://tracing).
+    """
+    def __init__(self, capacity=TRACE_BUFFER):
+        self.capacity = capacity
+        self.enabled = False
+        self.stages = None
+        self.thread_names = {}
+        self.counter = itertools.count()
+
+    def _allocate(self):
+        # Plain lists: slot assignment is several times cheaper than into ndarrays
+        self.stages = [0] * self.capacity
+        self.tids = [0] * self.capacity
+        self.starts = [0] * self.capacity
+        self.ends = [0] * self.capacity
+
+    def start(self):
+        if self.stages is None:
+            self._allocate()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def name_thread(self, name):
+        self.thread_names[threading.get_ident()] = name
+
+    def begin(self):
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def end(self, stage, start):
+        if start:
+            self.span(stage, start, time.perf_counter_ns())
+
+    def span(self, stage, start, end):
+        # next() on itertools.count is atomic under the GIL, so threads never share a slot
+        i = next(self.counter) % self.capacity
+        self.stages[i] = stage
+        self.tids[i] = threading.get_ident()
+        self.starts[i] = start
+        self.ends[i] = end
+
+    def dump(self, path=None):
+        """Writes the recorded spans as Chrome trace JSON; returns the number written."""
+        path = path or TRACE_FILE
+        if self.stages is None:
+            return 0
+        starts = np.array(self.starts, np.int64)
+        used = starts > 0
+        starts = starts[used]
+        stages = np.array(self.stages, np.int16)[used]
+        tids = np.array(self.tids, np.int64)[used]
+        ends = np.array(self.ends, np.int64)[used]
+        order = np.argsort(starts, kind='stable')
+        base = int(starts[order[0]]) if len(order) else 0
+
+        pid = os.getpid()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'PyAvStreamer'}}]
+        for tid, name in self.thread_names.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+        for n, i in enumerate(order):
+            stage = int(stages[i])
+            event = {'name': TRACE_STAGES[stage], 'cat': 'pipeline', 'pid': pid, 'tid': int(tids[i]),
+                     'ts': (int(starts[i]) - base) / 1000}
+            if stage in TRACE_ASYNC_STAGES:
+                events.append({**event, 'ph': 'b', 'id': n})
+                events.append({**event, 'ph': 'e', 'id': n, 'ts': (int(ends[i]) - base) / 1000})
+            else:
+                events.append({**event, 'ph': 'X', 'dur': (int(ends[i]) - int(starts[i])) / 1000})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(order)
+
+    def report(self):
+        buffered = self.capacity - self.starts.count(0) if self.stages is not None else 0
+        return f"{buffered}/{self.capacity} spans buffered"
+
+TRACER = Tracer()
+
+def toggle_tracing():
+    """Starts tracing, or stops it and writes the trace file."""
+    if TRACER.enabled:
+        TRACER.stop()
+        print(f"Tracing stopped: {TRACER.report()}; wrote {TRACER.dump()} spans to {TRACE_FILE} "
+              f"(open in https://ui.perfetto.dev)")
+    else:
+        TRACER.start()
+        print(f"Tracing started (keeping the last {TRACER.capacity} spans).")
+
+# --- Device Discovery ---
+
+# V4L2 ioctls and structs (linux/videodev2.h)
+VIDIOC_QUERYCAP = 0x80685600             # struct v4l2_capability, 104 bytes
+VIDIOC_ENUM_FMT = 0xC0405602             # struct v4l2_fmtdesc, 64 bytes
+VIDIOC_ENUM_FRAMESIZES = 0xC02C564A      # struct v4l2_frmsizeenum, 44 bytes
+VIDIOC_ENUM_FRAMEINTERVALS = 0xC034564B  # struct v4l2_frmivalenum, 52 bytes
+V4L2_CAPABILITY = struct.Struct('16s32s32sIII12x')
+V4L2_FMTDESC = struct.Struct('III32sII12x')
+V4L2_FRMSIZE = struct.Struct('III6I8x')
+V4L2_FRMIVAL = struct.Struct('IIIII6I8x')
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_FRMSIZE_TYPE_DISCRETE = 1
+V4L2_FRMIVAL_TYPE_DISCRETE = 1
+
+# Discovered video devices, reused for the rest of the session
+VIDEO_DEVICES = None
+AUDIO_DEVICES = None
+# Background discovery started at launch, overlapping PortAudio init
+VIDEO_DISCOVERY = None
+
+def prefetch_video_devices():
+    global VIDEO_DISCOVERY
+    VIDEO_DISCOVERY = concurrent.futures.ThreadPoolExecutor(max_workers=1).submit(discover_video_devices)
+
+def v4l2_ioctl(fd, request, layout, *fields):
+    """Runs a V4L2 ioctl on a packed struct; returns the unpacked result or None on error."""
+    buf = bytearray(layout.pack(*fields) if fields else layout.size)
+    try:
+        fcntl.ioctl(fd, request, buf)
+    except OSError:
+        return None
+    return layout.unpack(buf)
+
+def v4l2_probe(path):
+    """
+    Queries one /dev/video* node with V4L2 ioctls (no streaming, no frame
+    grabbed). Returns {'index', 'name', 'modes'} for capture devices, where
+    modes maps a FOURCC to [[width, height, [fps, ...]], ...]; None otherwise.
+    """
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+    except OSError:
+        return None
+    try:
+        cap = v4l2_ioctl(fd, VIDIOC_QUERYCAP, V4L2_CAPABILITY)
+        if cap is None:
+            return None
+        capabilities = cap[5] if cap[4] & V4L2_CAP_DEVICE_CAPS else cap[4]
+        if not capabilities & V4L2_CAP_VIDEO_CAPTURE:
+            return None  # Metadata/output node of a camera
+        modes = {}
+        for fmt_index in range(64):
+            fmt = v4l2_ioctl(fd, VIDIOC_ENUM_FMT, V4L2_FMTDESC, fmt_index, V4L2_BUF_TYPE_VIDEO_CAPTURE, 0, b'', 0, 0)
+            if fmt is None:
+                break
+            pixelformat = fmt[4]
+            fourcc = pixelformat.to_bytes(4, 'little').decode('ascii', 'replace')
+            sizes = modes.setdefault(fourcc, [])
+            for size_index in range(256):
+                size = v4l2_ioctl(fd, VIDIOC_ENUM_FRAMESIZES, V4L2_FRMSIZE, size_index, pixelformat, 0, 0, 0, 0, 0, 0, 0)
+                if size is None:
+                    break
+                if size[2] == V4L2_FRMSIZE_TYPE_DISCRETE:
+                    width, height = size[3], size[4]
+                else:
+                    width, height = size[4], size[7]  # Stepwise/continuous: report the maximum
+                rates = []
+                for rate_index in range(64):
+                    rate = v4l2_ioctl(fd, VIDIOC_ENUM_FRAMEINTERVALS, V4L2_FRMIVAL,
+                                      rate_index, pixelformat, width, height, 0, 0, 0, 0, 0, 0, 0)
+                    if rate is None or rate[4] != V4L2_FRMIVAL_TYPE_DISCRETE:
+                        break
+                    if rate[5]:
+                        rates.append(round(rate[6] / rate[5], 2))
+                sizes.append([width, height, rates])
+                if size[2] != V4L2_FRMSIZE_TYPE_DISCRETE:
+                    break
+        name = cap[1].split(b'\0', 1)[0].decode('utf-8', 'replace')
+        return {'index': int(path[len('/dev/video'):]), 'name': name, 'modes': modes}
+    finally:
+        os.close(fd)
+
+def video_device_fingerprint(paths):
+    """Identity of the current /dev/video* nodes; changes when a camera is plugged or unplugged."""
+    fingerprint = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            fingerprint.append([path, st.st_rdev, st.st_ctime_ns])
+        except OSError:
+            pass
+    return fingerprint
+
+def load_device_cache(fingerprint):
+    try:
+        with open(DEVICE_CACHE_FILE) as f:
+            cache = json.load(f)
+        if cache.get('fingerprint') == fingerprint:
+            return cache['devices']
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def save_device_cache(fingerprint, devices):
+    try:
+        os.makedirs(os.path.dirname(DEVICE_CACHE_FILE), exist_ok=True)
+        tmp = DEVICE_CACHE_FILE + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'devices': devices}, f)
+        os.replace(tmp, DEVICE_CACHE_FILE)
+    except OSError as e:
+        print(f"Warning: could not write device cache: {e}")
+
+def opencv_probe(index):
+    """Opens (but doesn't read from) a camera index; used where V4L2 isn't available."""
+    cap = cv2.VideoCapture(index)
+    try:
+        if not cap.isOpened():
+            return None
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = round(cap.get(cv2.CAP_PROP_FPS), 2)
+        return {'index': index, 'name': f"Camera {index}", 'modes': {'default': [[width, height, [fps] if fps > 0 else []]]}}
+    finally:
+        cap.release()
+
+def discover_video_devices(rescan=False):
+    """
+    Finds cameras, probing all candidates in parallel. On Linux this queries
+    /dev/video* with V4L2 ioctls and caches the result on disk, keyed by the
+    device nodes' identity so plugging/unplugging a camera invalidates it.
+    Elsewhere camera indices 0-9 are opened in parallel (no frames read).
+    Returns (devices, seconds, source).
+    """
+    start = time.perf_counter()
+    if sys.platform.startswith('linux') and fcntl is not None:
+        paths = sorted(glob.glob('/dev/video[0-9]*'), key=lambda p: int(p[len('/dev/video'):]))
+        fingerprint = video_device_fingerprint(paths)
+        devices = None if rescan else load_device_cache(fingerprint)
+        if devices is not None:
+            return devices, time.perf_counter() - start, "cache"
+        probe, candidates = v4l2_probe, paths
+    else:
+        fingerprint = None
+        probe, candidates = opencv_probe, range(10)
+
+    devices = []
+    if candidates:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+            devices = [d for d in pool.map(probe, candidates) if d]
+    if fingerprint is not None:
+        save_device_cache(fingerprint, devices)
+    return devices, time.perf_counter() - start, "probe"
+
+def describe_modes(modes):
+    """Largest resolution and highest rate per pixel format, e.g. 'MJPG 1920x1080@30'."""
+    parts = []
+    for fourcc, sizes in modes.items():
+        if not sizes:
+            continue
+        width, height, rates = max(sizes, key=lambda size: size[0] * size[1])
+        parts.append(f"{fourcc} {width}x{height}" + (f"@{max(rates):g}" if rates else ""))
+    return ", ".join(parts)
+
 # --- Audio Functions ---
 
+def find_host_api(pyaudio_instance):
+    """
+    Returns the index of the host API to list devices from: --audio-host-api
+    if given (matched by name, e.g. ALSA, PulseAudio, JACK, WASAPI), else MME
+    on Windows and PortAudio's default host API elsewhere. -1 if not found.
+    """
+    wanted = AUDIO_HOST_API or ('MME' if os.name == 'nt' else None)
+    if wanted is None:
+        try:
+            return pyaudio_instance.get_default_host_api_info()['index']
+        except (IOError, OSError):
+            return -1
+    for i in range(pyaudio_instance.get_host_api_count()):
+        if wanted.lower() in pyaudio_instance.get_host_api_info_by_index(i).get('name', '').lower():
+            return i
+    return -1
+
+def native_audio_format(pyaudio_instance, device_index):
+    """
+    Returns (rate, channels) to capture a device at without PortAudio/ALSA
+    resampling: its default rate, and its channel count up to
+    AUDIO_MAX_CAPTURE_CHANNELS (ALSA/Pulse virtual devices report dozens).
+    Falls back to AUDIO_RATE/AUDIO_CHANNELS if the device rejects that.
+    """
+    info = pyaudio_instance.get_device_info_by_index(device_index)
+    rate = int(info.get('defaultSampleRate') or AUDIO_RATE)
+    channels = max(1, min(int(info.get('maxInputChannels') or 1), AUDIO_MAX_CAPTURE_CHANNELS))
+    try:
+        pyaudio_instance.is_format_supported(rate, input_device=device_index,
+                                             input_channels=channels, input_format=AUDIO_FORMAT)
+    except ValueError:
+        return AUDIO_RATE, AUDIO_CHANNELS
+    return rate, channels
+
+def audio_stream_failed(stream):
+    """
+    True once a callback-mode stream has stopped on its own: PortAudio ends
+    it without an error to the reader when its device is unplugged or fails.
+    """
+    try:
+        return not stream.is_active()
+    except (IOError, OSError):
+        return True
+
 def list_audio_devices(pyaudio_instance):
     """
-    Lists available audio input devices using the MME host API.
+    Lists available audio input devices on the selected host API.
     Returns a list of tuples: (index, name).
+    PortAudio snapshots its device list when initialized, so the result is
+    computed once per session.
     """
-    # Find the MME Host API index
-    mme_index = -1
-    for i in range(pyaudio_instance.get_host_api_count()):
-        info = pyaudio_instance.get_host_api_info_by_index(i)
-        if info.get('name') == 'MME':
-            mme_index = i
-            break
+    global AUDIO_DEVICES
+    if AUDIO_DEVICES is not None:
+        print("\nAvailable Audio Input Devices:")
+        for i, name in AUDIO_DEVICES:
+            print(f"Index {i}: {name}")
+        return AUDIO_DEVICES
 
-    if mme_index == -1:
-        print("Error: MME Host API not found.")
+    host_api_index = find_host_api(pyaudio_instance)
+    if host_api_index == -1:
+        apis = [pyaudio_instance.get_host_api_info_by_index(i).get('name')
+                for i in range(pyaudio_instance.get_host_api_count())]
+        print(f"Error: audio host API '{AUDIO_HOST_API or 'MME'}' not found (available: {', '.join(apis)}).")
         return []
+    host_api = pyaudio_instance.get_host_api_info_by_index(host_api_index).get('name')
 
     devices = []
-    print("\nAvailable Audio Input Devices:")
+    print(f"\nAvailable Audio Input Devices ({host_api}):")
     for i in range(pyaudio_instance.get_device_count()):
         try:
             device_info = pyaudio_instance.get_device_info_by_index(i)
-            # Filter for Input devices on MME API
+            # Filter for Input devices on the selected host API
             if (device_info.get('maxInputChannels') > 0 and 
-                device_info.get('hostApi') == mme_index):
+                device_info.get('hostApi') == host_api_index):
                 
                 name = device_info.get('name')
                 # Exclude the mapper
                 if name != "Microsoft Sound Mapper - Input":
-                    print(f"Index {i}: {name}")
+                    rate, channels = native_audio_format(pyaudio_instance, i)
+                    print(f"Index {i}: {name} ({rate} Hz, {channels} ch)")
                     devices.append((i, name))
                     
         except Exception as e:
             print(f"Error reading device {i}: {e}")
             
+    AUDIO_DEVICES = devices
     return devices
 
-def stream_audio_task(pyaudio_instance, device_index, device_name, port, stop_event):
+def stream_audio_task(pyaudio_instance, device_index, device_name, port, stop_event, encoder=None):
     """
     Worker function to stream audio from a specific device to a UDP port.
     """
@@ -116,102 +2386,204 @@ def stream_audio_task(pyaudio_instance, device_index, device_name, port, stop_ev
         print(f"Error: FFmpeg not found for {device_name}.")
         return
 
+    use_callback = AUDIO_MODE == 'callback'
+    period = AUDIO_PERIOD if use_callback else CHUNK
+    # Capture at the device's native rate/channels; FFmpeg converts once to AUDIO_RATE/AUDIO_CHANNELS
+    capture_rate, capture_channels = native_audio_format(pyaudio_instance, device_index)
+    print(f"{device_name}: capturing {capture_rate} Hz, {capture_channels} ch"
+          + ("" if (capture_rate, capture_channels) == (AUDIO_RATE, AUDIO_CHANNELS)
+             else f" (encoder converts to {AUDIO_RATE} Hz, {AUDIO_CHANNELS} ch)"))
+    frame_bytes = pyaudio.get_sample_size(AUDIO_FORMAT) * capture_channels
+    audio_ring = AudioRing(AUDIO_MAX_LATENCY_MS, capture_rate, frame_bytes)
+    jitter = PeriodJitter(period / capture_rate)
+    drift = ClockDrift(capture_rate, capture_channels, DRIFT_COMPENSATION)
+    metrics = StreamMetrics('audio', device_name, port)
+    metrics.audio_ring = audio_ring
+    metrics.drift = drift
+    if use_callback:
+        metrics.input_overflows = 0
+
+    def on_audio(in_data, frame_count, time_info, status):
+        """PortAudio callback: feeds each period straight into the ring."""
+        t = TRACER.begin()
+        jitter.tick()
+        metrics.captured += 1
+        if status & pyaudio.paInputOverflow:
+            metrics.input_overflows += 1
+            drift.discontinuity()
+        audio_ring.write(drift.process(in_data))
+        TRACER.end(TRACE_AUDIO_CALLBACK, t)
+        if stop_event.is_set():
+            audio_ring.close()
+            return (None, pyaudio.paComplete)
+        return (None, pyaudio.paContinue)
+
     try:
         # Open the microphone stream
         stream = pyaudio_instance.open(
             format=AUDIO_FORMAT,
-            channels=AUDIO_CHANNELS,
-            rate=AUDIO_RATE,
+            channels=capture_channels,
+            rate=capture_rate,
             input=True,
             input_device_index=device_index,
-            frames_per_buffer=CHUNK
+            frames_per_buffer=period,
+            start=not use_callback,
+            stream_callback=on_audio if use_callback else None
         )
     except Exception as e:
         print(f"Failed to open audio stream for {device_name}: {e}")
+        metrics.close()
         return
 
     # FFmpeg command
-    cmd = [
-        FFMPEG_BIN,
+    input_args = [
         '-use_wallclock_as_timestamps', '1',
         '-f', 's16le',
-        '-ar', str(AUDIO_RATE),
-        '-ac', str(AUDIO_CHANNELS),
-        '-i', 'pipe:0',
+        '-ar', str(capture_rate),
+        '-ac', str(capture_channels),
+    ]
+    output_args = [
         # --- New Optimization Flags ---
         '-probesize', '32',           # Minimal data analysis before starting
         '-analyzeduration', '0',      # Start streaming instantly
         '-fflags', 'nobuffer+genpts', # Disable FFmpeg's internal buffer
         '-flush_packets', '1',        # Push every packet to the network immediately
         # ------------------------------
+        '-ar', str(AUDIO_RATE),       # The one rate/channel conversion, if any
+        '-ac', str(AUDIO_CHANNELS),
         '-c:a', 'libmp3lame',
         '-b:a', '128k',               # Explicit bitrate helps maintain steady flow
         '-f', 'mpegts',
         f'udp://{OBS_IP}:{port}?pkt_size=1316'
     ]
 
+    if encoder is None:
+        encoder = new_encoder(stderr=sys.stderr)
+    framed = TIMESTAMP_MODE == 'capture' and not isinstance(encoder, PyAvEncoder)
+    if framed:
+        input_args = capture_timestamp_input_args()
+    if METRICS_PORT and isinstance(encoder, FFmpegEncoder):
+        metrics.progress = ProgressMonitor()
+        input_args = [*metrics.progress.args(), *input_args]
     try:
-        # Silencing stderr to avoid console spam
-        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=sys.stderr)
+        encoder.start(input_args, output_args)
     except Exception as e:
         print(f"Failed to start FFmpeg for {device_name}: {e}")
         stream.close()
+        metrics.close()
         return
 
-    audio_queue = queue.Queue(maxsize=50)
+    writer = encoder.writer
+    metrics.writer = writer
+    framer = MatroskaFramer(writer, matroska_audio_track(capture_rate, capture_channels)) if framed else None
+    timeline = AudioTimeline(capture_rate)
+    backoff = Backoff()
     local_stop_event = threading.Event()
 
     def read_mic():
-        """Reads data from microphone and puts into queue."""
+        """Reads data from microphone and puts into the ring."""
+        TRACER.name_thread(f"audio capture: {device_name}")
+        if REALTIME_CAPTURE:
+            print(f"{device_name} capture thread: {raise_thread_priority()}")
+        last_read = None
         try:
+            # Blocking reads don't report overflows: a loop held up for longer than
+            # PortAudio buffers has lost input, which the drift fit must not see as drift
+            stall_limit = CHUNK / capture_rate + stream.get_input_latency()
             while not stop_event.is_set() and not local_stop_event.is_set():
                 try:
+                    t = TRACER.begin()
                     data = stream.read(CHUNK, exception_on_overflow=False)
+                    TRACER.end(TRACE_MIC_READ, t)
                     if not data:
                         break
-                    audio_queue.put(data)
+                    now = time.monotonic()
+                    if last_read is not None and now - last_read > stall_limit:
+                        drift.discontinuity()
+                    last_read = now
+                    jitter.tick()
+                    metrics.captured += 1
+                    audio_ring.write(drift.process(data))
                 except Exception as e:
                     if not stop_event.is_set() and not local_stop_event.is_set():
                         print(f"Error reading audio {device_name}: {e}")
                     local_stop_event.set()
                     break
         except Exception:
+            pass
+        finally:
+            # Wake the writer now rather than at its next read timeout
             local_stop_event.set()
+            audio_ring.close()
 
     def write_ffmpeg():
-        """Reads data from queue and writes to FFmpeg stdin."""
+        """Drains the ring and writes to FFmpeg stdin, one write per wakeup."""
+        nonlocal writer, framer
+        TRACER.name_thread(f"audio writer: {device_name}")
+        CURRENT_STREAM.handle = metrics.handle
         try:
             while not stop_event.is_set() and not local_stop_event.is_set():
-                try:
-                    data = audio_queue.get(timeout=0.5)
-                    try:
-                        proc.stdin.write(data)
-                    except Exception as e:
-                        if not stop_event.is_set() and not local_stop_event.is_set():
-                            print(f"Error writing audio to ffmpeg {device_name}: {e}")
-                        local_stop_event.set()
+                t = TRACER.begin()
+                data = audio_ring.read(timeout=0.5)
+                TRACER.end(TRACE_AUDIO_RING_READ, t)
+                if data is None:
+                    if use_callback and not stop_event.is_set() and audio_stream_failed(stream):
+                        # Ending the task lets the supervisor reopen the device on the same port
+                        print(f"Audio callbacks from {device_name} stopped; the device failed or was unplugged.")
                         break
-                    finally:
-                        audio_queue.task_done()
-                except queue.Empty:
                     continue
+                captured_at = timeline.stamp(len(data) // audio_ring.frame_bytes, audio_ring.read_end_time)
+                try:
+                    t = TRACER.begin()
+                    if framer:
+                        framer.write(data, captured_at)
+                    else:
+                        writer.write(data)
+                    metrics.capture_delay.add(time.monotonic() - captured_at)
+                    TRACER.end(TRACE_PIPE_WRITE, t)
+                    if not metrics.live:
+                        metrics.set_live()
+                except Exception as e:
+                    if stop_event.is_set() or local_stop_event.is_set():
+                        break
+                    print(f"Error writing audio to ffmpeg {device_name}: {e}")
+                    # The mic stays open and keeps filling the ring while FFmpeg respawns
+                    if not restart_encoder(encoder, input_args, output_args, metrics, backoff, stop_event, device_name):
+                        break
+                    writer = metrics.writer = encoder.writer
+                    if framed:
+                        framer = MatroskaFramer(writer, matroska_audio_track(capture_rate, capture_channels))
         except Exception:
+            pass
+        finally:
             local_stop_event.set()
 
-    reader_thread = threading.Thread(target=read_mic, daemon=True)
     writer_thread = threading.Thread(target=write_ffmpeg, daemon=True)
+    if use_callback:
+        # PortAudio's callback thread replaces the reader thread; started
+        # first, so the writer never sees the stream inactive before it ran
+        stream.start_stream()
+        writer_thread.start()
+    else:
+        writer_thread.start()
+        reader_thread = threading.Thread(target=read_mic, daemon=True)
+        reader_thread.start()
 
-    reader_thread.start()
-    writer_thread.start()
-
-    # Wait until global stop or local error
-    while not stop_event.is_set() and not local_stop_event.is_set():
-        time.sleep(0.5)
+    # The writer runs until global stop or a local error on either side
+    writer_thread.join()
 
     print(f"Stopping audio stream: {device_name}")
     
     # Ensure threads stop
     local_stop_event.set()
+    audio_ring.close()
+    print(f"[Audio] {device_name} buffer: {audio_ring.report()}")
+    print(f"[Audio] {device_name} {AUDIO_MODE} capture: {jitter.report()}, "
+          f"capture-to-pipe latency mean {(period / capture_rate + audio_ring.wait.mean) * 1000:.1f} ms "
+          f"(max {(period / capture_rate + audio_ring.wait.max) * 1000:.1f} ms)"
+          + (f", {metrics.input_overflows} input overflows" if use_callback else ""))
+    print(f"[Audio] {device_name} {drift.report()}, {timeline.resyncs} timestamp resyncs")
+    metrics.close()
 
     # Cleanup
     try:
@@ -220,53 +2592,244 @@ def stream_audio_task(pyaudio_instance, device_index, device_name, port, stop_ev
     except:
         pass
 
+    encoder.close()
+
+
+def stream_multi_audio_task(pyaudio_instance, devices, port, stop_event, encoder=None):
+    """
+    Captures several microphones and interleaves them into one N-channel
+    PCM stream (device order, each at its native channel count) for a
+    single FFmpeg encoder and UDP port. Devices capture at their native
+    rate; one whose rate differs from the mix rate is resampled to it by
+    its ClockDrift, not by PortAudio. Every device feeds its own ring from
+    a PortAudio callback; the first device is the clock master and each of
+    its reads pulls the same number of frames from the others, padding with
+    silence if one is short.
+    """
+    names = ", ".join(name for _, name in devices)
+    print(f"[Audio] Combined stream for {names} starting...")
+    print(f" - udp://{OBS_IP}:{port}")
+
+    sample_bytes = pyaudio.get_sample_size(AUDIO_FORMAT)
+    formats = [native_audio_format(pyaudio_instance, idx) for idx, _ in devices]
+    # Every device captures at its native rate. The mix runs at AUDIO_RATE if a device has it
+    # (FFmpeg then converts nothing), else at the most common rate
+    rates = [r for r, _ in formats]
+    rate = AUDIO_RATE if AUDIO_RATE in rates else collections.Counter(rates).most_common(1)[0][0]
+    channel_counts = [channels for _, channels in formats]
+    total_channels = sum(channel_counts)
+    if total_channels > 8:
+        print(f"Error: {total_channels} channels; the combined stream supports at most 8.")
+        return
+    print(f"Combined: {len(devices)} mics -> {total_channels} channels at {rate} Hz")
+    for (_, name), device_rate in zip(devices, rates):
+        if device_rate != rate:
+            print(f"Combined: {name} captures at {device_rate} Hz, resampled to {rate} Hz in-process")
+
+    rings = [AudioRing(AUDIO_MAX_LATENCY_MS, rate, sample_bytes * ch) for ch in channel_counts]
+    # Per-device drift against the monotonic clock; with compensation all rings fill at the same rate
+    drifts = [ClockDrift(r, ch, DRIFT_COMPENSATION, output_rate=rate) for r, ch in zip(rates, channel_counts)]
+    metrics = StreamMetrics('audio', f"Combined: {names}", port)
+    metrics.audio_ring = rings[0]
+    metrics.drift = drifts[0]
+    metrics.input_overflows = 0  # The combined stream always runs in callback mode
+
+    def make_callback(ring, drift, count_captured):
+        def on_audio(in_data, frame_count, time_info, status):
+            if count_captured:
+                metrics.captured += 1
+            if status & pyaudio.paInputOverflow:
+                metrics.input_overflows += 1
+                drift.discontinuity()
+            ring.write(drift.process(in_data))
+            if stop_event.is_set():
+                return (None, pyaudio.paComplete)
+            return (None, pyaudio.paContinue)
+        return on_audio
+
+    streams = []
     try:
-        proc.stdin.close()
-        proc.wait(timeout=2)
-    except:
-        proc.kill()
+        for i, ((idx, name), channels) in enumerate(zip(devices, channel_counts)):
+            streams.append(pyaudio_instance.open(
+                format=AUDIO_FORMAT,
+                channels=channels,
+                rate=rates[i],
+                input=True,
+                input_device_index=idx,
+                frames_per_buffer=AUDIO_PERIOD,
+                start=False,
+                stream_callback=make_callback(rings[i], drifts[i], i == 0)
+            ))
+    except Exception as e:
+        print(f"Failed to open audio stream for {name}: {e}")
+        for stream in streams:
+            stream.close()
+        metrics.close()
+        return
+
+    input_args = [
+        '-use_wallclock_as_timestamps', '1',
+        '-f', 's16le',
+        '-ar', str(rate),
+        '-ac', str(total_channels),
+    ]
+    # MP3 is mono/stereo only; AAC carries up to 8 channels in mpegts
+    codec = ['-c:a', 'libmp3lame', '-b:a', '128k'] if total_channels <= 2 else \
+            ['-c:a', 'aac', '-b:a', f'{64 * total_channels}k']
+    output_args = [
+        '-probesize', '32',
+        '-analyzeduration', '0',
+        '-fflags', 'nobuffer+genpts',
+        '-flush_packets', '1',
+        '-ar', str(AUDIO_RATE),       # Rate conversion happens here only; channels are kept
+        *codec,
+        '-f', 'mpegts',
+        f'udp://{OBS_IP}:{port}?pkt_size=1316'
+    ]
+
+    if encoder is None:
+        encoder = new_encoder(stderr=sys.stderr)
+    framed = TIMESTAMP_MODE == 'capture' and not isinstance(encoder, PyAvEncoder)
+    if framed:
+        input_args = capture_timestamp_input_args()
+    if METRICS_PORT and isinstance(encoder, FFmpegEncoder):
+        metrics.progress = ProgressMonitor()
+        input_args = [*metrics.progress.args(), *input_args]
+    try:
+        encoder.start(input_args, output_args)
+    except Exception as e:
+        print(f"Failed to start FFmpeg for the combined stream: {e}")
+        for stream in streams:
+            stream.close()
+        metrics.close()
+        return
+    writer = encoder.writer
+    metrics.writer = writer
+    framer = MatroskaFramer(writer, matroska_audio_track(rate, total_channels)) if framed else None
+    # The master's sample clock times the whole interleaved stream
+    timeline = AudioTimeline(rate)
+    backoff = Backoff()
 
+    # Interleave buffer sized for the most the master ring can hand over at once
+    max_frames = rings[0].capacity // rings[0].frame_bytes
+    mixed = np.zeros((max_frames, total_channels), dtype=np.int16)
+    columns = np.cumsum([0, *channel_counts])
+    padded_frames = [0] * len(devices)
+    # What a secondary ring should hold after each pull: a couple of callback periods
+    target_depth = 2 * AUDIO_PERIOD / rate
+
+    for stream in streams:
+        stream.start_stream()
+    TRACER.name_thread(f"audio mixer: {names}")
+    try:
+        while not stop_event.is_set():
+            t = TRACER.begin()
+            master = rings[0].read(timeout=0.5)
+            TRACER.end(TRACE_AUDIO_RING_READ, t)
+            if master is None:
+                failed = [name for (_, name), stream in zip(devices, streams) if audio_stream_failed(stream)]
+                if failed and not stop_event.is_set():
+                    # Ending the task lets the supervisor reopen every mic on the same port
+                    print(f"Audio callbacks from {', '.join(failed)} stopped; the device failed or was unplugged.")
+                    break
+                continue
+            frames = len(master) // rings[0].frame_bytes
+            captured_at = timeline.stamp(frames, rings[0].read_end_time)
+            failed = None
+            out = mixed[:frames]
+            out[:, :columns[1]] = np.frombuffer(master, dtype=np.int16).reshape(frames, channel_counts[0])
+            for i in range(1, len(devices)):
+                data = rings[i].read(timeout=0, max_bytes=frames * rings[i].frame_bytes)
+                got = len(data) // rings[i].frame_bytes if data is not None else 0
+                if got:
+                    out[:got, columns[i]:columns[i + 1]] = np.frombuffer(data, dtype=np.int16).reshape(got, channel_counts[i])
+                if got < frames:
+                    out[got:, columns[i]:columns[i + 1]] = 0
+                    padded_frames[i] += frames - got
+                    if not got and not stop_event.is_set() and audio_stream_failed(streams[i]):
+                        failed = devices[i][1]
+                        break
+                drifts[i].depth_error = rings[i].depth_ms / 1000 - target_depth
+            if failed:
+                # The master keeps the mix going; a dead secondary would only ever be silence
+                print(f"Audio callbacks from {failed} stopped; the device failed or was unplugged.")
+                break
+            try:
+                t = TRACER.begin()
+                if framer:
+                    framer.write(out, captured_at)
+                else:
+                    writer.write(out)
+                metrics.capture_delay.add(time.monotonic() - captured_at)
+                TRACER.end(TRACE_PIPE_WRITE, t)
+                if not metrics.live:
+                    metrics.set_live()
+            except Exception as e:
+                if stop_event.is_set():
+                    break
+                print(f"Error writing combined audio to ffmpeg: {e}")
+                if not restart_encoder(encoder, input_args, output_args, metrics, backoff, stop_event, names):
+                    break
+                writer = metrics.writer = encoder.writer
+                if framed:
+                    framer = MatroskaFramer(writer, matroska_audio_track(rate, total_channels))
+    finally:
+        print(f"Stopping combined audio stream: {names} ({timeline.resyncs} timestamp resyncs)")
+        for (idx, name), ring, drift, padded in zip(devices, rings, drifts, padded_frames):
+            ring.close()
+            print(f"[Audio] {name} buffer: {ring.report()}, {padded / rate * 1000:.0f} ms padded with silence, "
+                  f"{drift.report()}")
+        for stream in streams:
+            try:
+                stream.stop_stream()
+                stream.close()
+            except:
+                pass
+        metrics.close()
+        encoder.close()
 
 # --- Video Functions ---
 
-def list_video_devices():
+def list_video_devices(rescan=False):
     """
-    Probes available video devices (indices 0-9).
+    Lists video devices, discovered once per session (and cached on disk on
+    Linux); rescan=True probes again.
     Returns a list of tuples: (index, str_name).
     """
-    available_devices = []
-    print("\nScanning for video devices (0-9)...")
-    for i in range(10):
-        cap = cv2.VideoCapture(i)
-        if cap.isOpened():
-            # Try to read a frame to confirm it's working
-            ret, _ = cap.read()
-            if ret:
-                print(f"Index {i}: Camera found")
-                available_devices.append((i, f"Camera {i}"))
-            cap.release()
-            
-    return available_devices
+    global VIDEO_DEVICES, VIDEO_DISCOVERY
+    if VIDEO_DEVICES is None or rescan:
+        if VIDEO_DISCOVERY is not None and not rescan:
+            devices, seconds, source = VIDEO_DISCOVERY.result()
+            source += ", in background"
+        else:
+            devices, seconds, source = discover_video_devices(rescan)
+        VIDEO_DISCOVERY = None
+        VIDEO_DEVICES = devices
+        print(f"\nFound {len(devices)} video devices in {seconds * 1000:.0f} ms ({source})")
+    else:
+        print("\nVideo devices:")
+    for device in VIDEO_DEVICES:
+        print(f"Index {device['index']}: {device['name']} ({describe_modes(device['modes']) or 'no modes reported'})")
+    return [(device['index'], device['name']) for device in VIDEO_DEVICES]
 
-def stream_video_task(device_index, device_name, port, stop_event):
+def open_camera(device_index, device_name, capture_class=None):
     """
-    Worker function to stream video from a specific device to a UDP port.
+    Opens and configures a camera and negotiates the pixel format piped to
+    FFmpeg. Returns (cap, fmt), fmt holding width, height, frame_rate,
+    pix_fmt, frame_shape, compressed and convert (BGR -> I420 in-process),
+    or (None, None) if the camera can't be opened. capture_class replaces
+    cv2.VideoCapture (e.g. a generated source in tests).
     """
-    print(f"[Video] Stream for '{device_name}' starting...")
-    print(f" - udp://{OBS_IP}:{port}")
-
-    FFMPEG_BIN = get_ffmpeg_path()
-    if not FFMPEG_BIN:
-        print(f"Error: FFmpeg not found for {device_name}.")
-        return
-
     # Open the video capture
-    cap = cv2.VideoCapture(device_index)
+    cap = (capture_class or cv2.VideoCapture)(device_index)
     if not cap.isOpened():
         print(f"Failed to open camera index {device_index}")
-        return
+        return None, None
 
     # Set properties
+    if PIXEL_FORMAT == 'mjpeg':
+        # FOURCC first: many drivers only offer the high modes in MJPEG
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
     if USE_MAX_QUALITY:
         print(f"Attempting to set max quality for {device_name}...")
         cap.set(cv2.CAP_PROP_FRAME_WIDTH, 3840)
@@ -286,67 +2849,811 @@ def stream_video_task(device_index, device_name, port, stop_event):
 
     print(f"{device_name} opened: {actual_width}x{actual_height} @ {actual_fps}fps")
 
-    # FFmpeg command
-    cmd = [
-        FFMPEG_BIN,
-        '-y',
-        '-use_wallclock_as_timestamps', '1',
-        '-f', 'rawvideo',
-        '-vcodec', 'rawvideo',
-        '-pix_fmt', 'bgr24',       # OpenCV uses BGR
-        '-s', f'{actual_width}x{actual_height}',
-        '-r', str(actual_fps) if actual_fps > 0 else (str(VIDEO_FPS) if VIDEO_FPS > 0 else "30"),
-        '-i', '-',                 # Input from pipe
-        '-c:v', 'libx264',         # Encode to H.264
-        '-preset', 'ultrafast',    # Low latency preset
-        '-tune', 'zerolatency',    # Low latency tuning
-        '-fflags', '+genpts',
-        '-f', 'mpegts',            # Container
-        f'udp://{OBS_IP}:{port}?pkt_size=1316'
-    ]
+    # Pixel format: bgr24 as delivered by OpenCV, native YUV passthrough, or
+    # BGR converted to I420 in-process (fallback when passthrough isn't possible)
+    pix_fmt = 'bgr24'
+    frame_shape = (actual_height, actual_width, 3)
+    convert = False
+    compressed = False
+    if PIXEL_FORMAT == 'mjpeg':
+        compressed = negotiate_mjpeg(cap)
+        if compressed:
+            pix_fmt = 'mjpeg'
+            # Flat buffer with room for any JPEG the camera can produce
+            frame_shape = (actual_width * actual_height * 3,)
+        else:
+            print(f"{device_name}: MJPEG passthrough not available, piping bgr24.")
+    elif PIXEL_FORMAT == 'native':
+        negotiated = negotiate_pixel_format(cap, actual_width, actual_height)
+        if negotiated:
+            pix_fmt, frame_shape = negotiated
+        else:
+            print(f"{device_name}: native pixel format passthrough not available, converting to yuv420p.")
+    if PIXEL_FORMAT in ('native', 'yuv420p') and pix_fmt == 'bgr24':
+        pix_fmt = 'yuv420p'
+        frame_shape = (actual_height * 3 // 2, actual_width)
+        convert = True
 
-    try:
+    bgr_bytes = actual_width * actual_height * 3
+    if compressed:
+        print(f"{device_name} pixel format: mjpeg (compressed, bgr24: {bgr_bytes} bytes/frame)")
+    else:
+        frame_bytes = int(np.prod(frame_shape))
+        print(f"{device_name} pixel format: {pix_fmt}, {frame_bytes} bytes/frame "
+              f"(bgr24: {bgr_bytes}, {100 - 100 * frame_bytes / max(bgr_bytes, 1):.0f}% less pipe bandwidth)")
+
+    frame_rate = str(actual_fps) if actual_fps > 0 else (str(VIDEO_FPS) if VIDEO_FPS > 0 else "30")
+    fmt = {
+        'width': actual_width,
+        'height': actual_height,
+        'frame_rate': frame_rate,
+        'pix_fmt': pix_fmt,
+        'frame_shape': tuple(frame_shape),
+        'compressed': compressed,
+        'convert': convert,
+    }
+    return cap, fmt
+
+def read_video_frame(cap, pool, frame, compressed, convert_scratch):
+    """
+    Reads the next frame into a pool buffer: undecoded MJPEG (returned as a
+    view of the filled part), a raw frame, or BGR converted to I420 through
+    convert_scratch. Returns (frame, capture time), or (None, None) on failure.
+    """
+    t = TRACER.begin()
+    if compressed:
+        data = pool.read_compressed(cap, frame)
+        captured_at = time.monotonic()
+        TRACER.end(TRACE_CAP_READ, t)
+        return data, captured_at
+    ok = pool.read(cap, frame if convert_scratch is None else convert_scratch)
+    captured_at = time.monotonic()
+    TRACER.end(TRACE_CAP_READ, t)
+    if not ok:
+        return None, None
+    if convert_scratch is not None:
+        t = TRACER.begin()
+        cv2.cvtColor(convert_scratch, cv2.COLOR_BGR2YUV_I420, dst=frame)
+        TRACER.end(TRACE_CONVERT, t)
+    return frame, captured_at
+
+def stream_video_task(device_index, device_name, port, stop_event, encoder=None, capture_class=None):
+    """
+    Worker function to stream video from a specific device to a UDP port.
+    capture_class is passed to open_camera.
+    """
+    print(f"[Video] Stream for '{device_name}' starting...")
+    print(f" - udp://{OBS_IP}:{port}")
+
+    FFMPEG_BIN = get_ffmpeg_path()
+    if not FFMPEG_BIN:
+        print(f"Error: FFmpeg not found for {device_name}.")
+        return
+
+    cpus = CPU_PLAN.assign((device_name, port)) if CPU_PLAN else None
+    # Before anything is started: capture thread/process and FFmpeg inherit the mask
+    if cpus and pin_thread(cpus):
+        print(f"{device_name}: CPUs {','.join(map(str, cpus))}, x264 threads {len(cpus)}")
+    else:
+        cpus = None
+
+    source = None
+    if CAPTURE_PROCESSES:
+        # Capture runs in its own process; frames arrive through shared memory
+        source = CaptureProcess(device_index, device_name, capture_class)
+        cap, fmt = None, source.fmt
+    else:
+        cap, fmt = open_camera(device_index, device_name, capture_class)
+    if fmt is None:
+        if source:
+            source.close()
+        return
+    actual_width, actual_height = fmt['width'], fmt['height']
+    pix_fmt, frame_shape, compressed = fmt['pix_fmt'], fmt['frame_shape'], fmt['compressed']
+    frame_rate = fmt['frame_rate']
+    convert_scratch = None
+    if fmt['convert'] and not source:
+        convert_scratch = np.empty((actual_height, actual_width, 3), dtype=np.uint8)
+    if compressed:
+        input_args = [
+            '-use_wallclock_as_timestamps', '1',
+            '-f', 'mjpeg',             # Undecoded JPEG frames from the camera
+            '-r', frame_rate,
+        ]
+    else:
+        input_args = [
+            '-use_wallclock_as_timestamps', '1',
+            '-f', 'rawvideo',
+            '-vcodec', 'rawvideo',
+            '-pix_fmt', pix_fmt,       # bgr24 from OpenCV, or raw YUV
+            '-s', f'{actual_width}x{actual_height}',
+            '-r', frame_rate,
+        ]
+
+    if compressed and MJPEG_COPY:
+        # Re-mux without transcoding; mpegts has no MJPEG mapping, so use matroska
+        output_args = [
+            '-c:v', 'copy',
+            '-f', 'matroska',
+            '-live', '1',
+            f'udp://{OBS_IP}:{port}?pkt_size=1316'
+        ]
+    else:
+        output_args = [
+            '-c:v', 'libx264',         # Encode to H.264
+            '-preset', 'ultrafast',    # Low latency preset
+            '-tune', 'zerolatency',    # Low latency tuning
+            *(['-threads', str(len(cpus))] if cpus else []),  # x264 threads from the CPU budget
+            '-fflags', '+genpts',
+            '-f', 'mpegts',            # Container
+            f'udp://{OBS_IP}:{port}?pkt_size=1316'
+        ]
+
+    if encoder is None:
         # Silencing stderr to avoid console spam
-        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        encoder = new_encoder(stderr=subprocess.DEVNULL)
+    track = None
+    if TIMESTAMP_MODE == 'capture' and not isinstance(encoder, PyAvEncoder):
+        # Frames carry their capture time; no arrival stamps and no forced input rate
+        track = matroska_video_track(pix_fmt, actual_width, actual_height, float(frame_rate))
+        input_args = capture_timestamp_input_args()
+    writer = None
+    framer = None
+    backoff = Backoff()
+    if source:
+        pool, ring = source.pool, source.ring
+    else:
+        # Ring capacity plus one buffer held by each stage
+        pool = FramePool(frame_shape, size=VIDEO_QUEUE_SIZE + 2)
+        ring = FrameRing(pool, VIDEO_QUEUE_SIZE, VIDEO_DROP_POLICY)
+    local_stop_event = threading.Event()
+    metrics = StreamMetrics('video', device_name, port)
+    metrics.ring = ring
+
+    abr = None
+    if USE_ABR and isinstance(encoder, FFmpegEncoder) and not (compressed and MJPEG_COPY):
+        abr = AdaptiveBitrate(device_name, actual_width, actual_height, float(frame_rate), ring)
+        input_args = [*abr.monitor.args(), *input_args]
+        base_output_args = output_args
+        def abr_output_args(level):
+            # Rate control goes before the '-f mpegts <url>' tail
+            tail = base_output_args.index('-f')
+            return [*base_output_args[:tail], *abr.output_args(level), *base_output_args[tail:]]
+        output_args = abr_output_args(0)
+        abr_level = 0
+        skipped = 0
+        metrics.progress = abr.monitor
+    elif METRICS_PORT and isinstance(encoder, FFmpegEncoder):
+        metrics.progress = ProgressMonitor()
+        input_args = [*metrics.progress.args(), *input_args]
+
+    jitter = PeriodJitter(1 / float(frame_rate))
+    metrics.capture_jitter = jitter
+
+    def capture_frames():
+        """Reads frames at sensor rate and hands them to the writer via the ring."""
+        TRACER.name_thread(f"video capture: {device_name}")
+        if REALTIME_CAPTURE:
+            print(f"{device_name} capture thread: {raise_thread_priority()}")
+        try:
+            while not stop_event.is_set() and not local_stop_event.is_set():
+                frame = pool.acquire(timeout=0.5)
+                if frame is None:
+                    continue
+                data, captured_at = read_video_frame(cap, pool, frame, compressed, convert_scratch)
+                if data is None:
+                    pool.release(frame)
+                    if not stop_event.is_set() and not local_stop_event.is_set():
+                        print(f"Error reading frame from {device_name}.")
+                    break
+                jitter.tick(captured_at)
+                metrics.captured += 1
+                t = TRACER.begin()
+                ring.put(data, captured_at)
+                TRACER.end(TRACE_RING_PUT, t)
+        except Exception as e:
+            print(f"Exception in video capture {device_name}: {e}")
+        finally:
+            local_stop_event.set()
+            ring.close()
+
+    capture_thread = None
+    try:
+        encoder.start(input_args, output_args)
+        writer = encoder.writer
+        metrics.writer = writer
+        if track:
+            framer = MatroskaFramer(writer, track)
+
+        if not source:
+            capture_thread = threading.Thread(target=capture_frames, daemon=True)
+            capture_thread.start()
+        TRACER.name_thread(f"video writer: {device_name}")
         
-        while not stop_event.is_set():
-            ret, frame = cap.read()
-            if not ret:
-                if not stop_event.is_set():
-                    print(f"Error reading frame from {device_name}.")
-                break
+        while not stop_event.is_set() and not local_stop_event.is_set():
+            if abr and abr.level != abr_level:
+                # New ladder level: restart FFmpeg with the new scale/rate/bitrate on the same port
+                abr_level = abr.level
+                t = TRACER.begin()
+                encoder.close()
+                output_args = abr_output_args(abr_level)
+                encoder.start(input_args, output_args)
+                TRACER.end(TRACE_ENCODER_RESTART, t)
+                writer = encoder.writer
+                metrics.writer = writer
+                if track:
+                    framer = MatroskaFramer(writer, track)
+
+            t = TRACER.begin()
+            item = ring.get(timeout=0.5)
+            if item is None:
+                if ring.closed:
+                    break  # Capture ended
+                continue
+            if source:
+                metrics.captured = source.captured.value
+            if t:
+                now = time.perf_counter_ns()
+                TRACER.span(TRACE_RING_GET, t, now)
+                TRACER.span(TRACE_QUEUED, now - int(ring.last_age * 1e9), now)
+            frame, captured_at = item
+            if abr:
+                skipped = (skipped + 1) % abr.frame_divisor()
+                if skipped:
+                    pool.release(frame)
+                    continue
                 
             try:
-                proc.stdin.write(frame.tobytes())
+                t = TRACER.begin()
+                write_start = time.perf_counter()
+                if framer:
+                    framer.write(frame, captured_at)
+                else:
+                    writer.write(frame)
+                metrics.capture_delay.add(time.monotonic() - captured_at)
+                if not metrics.live:
+                    metrics.set_live()
+                if abr:
+                    abr.note_write(time.perf_counter() - write_start)
+                TRACER.end(TRACE_PIPE_WRITE, t)
             except Exception:
-                if not stop_event.is_set():
-                    print(f"FFmpeg process error for {device_name}")
-                break
+                if stop_event.is_set():
+                    break
+                print(f"FFmpeg process error for {device_name}")
+                # The camera stays open; the capture thread keeps the ring fresh meanwhile
+                t = TRACER.begin()
+                if not restart_encoder(encoder, input_args, output_args, metrics, backoff, stop_event, device_name):
+                    break
+                TRACER.end(TRACE_ENCODER_RESTART, t)
+                writer = metrics.writer = encoder.writer
+                if track:
+                    framer = MatroskaFramer(writer, track)
+            finally:
+                pool.release(frame)
                 
     except Exception as e:
         print(f"Exception in video stream task {device_name}: {e}")
     finally:
         print(f"Stopping video stream: {device_name}")
+        if writer:
+            print(f"[Video] {device_name} pipe: {writer.report()}")
+            if writer.writes:
+                per_frame = writer.bytes_written / writer.writes
+                print(f"[Video] {device_name} {per_frame:.0f} bytes/frame piped "
+                      f"({actual_width * actual_height * 3 / per_frame:.1f}x less than bgr24)")
+        local_stop_event.set()
+        ring.close()
+        if capture_thread:
+            capture_thread.join(timeout=2)
+        print(f"[Video] {device_name} frame pool: {pool.report()}")
+        print(f"[Video] {device_name} frame queue: {ring.report()}")
+        if jitter.deviation.count:
+            print(f"[Video] {device_name} capture: {jitter.report()}")
+        if abr:
+            print(f"[ABR] {device_name}: {abr.report()}")
+            abr.close()
+        metrics.close()
+        if source:
+            source.close()
+        else:
+            cap.release()
+        encoder.close()
+
+# FOURCC -> (FFmpeg pix_fmt, bytes per pixel) for raw formats we can pipe as-is
+NATIVE_PIXEL_FORMATS = {
+    'YUYV': ('yuyv422', 2.0),
+    'NV12': ('nv12', 1.5),
+}
+
+def negotiate_pixel_format(cap, width, height):
+    """
+    Asks the camera for unconverted YUV frames (CAP_PROP_CONVERT_RGB=0).
+    Returns (ffmpeg_pix_fmt, frame_shape) if a native format was delivered,
+    or None after restoring OpenCV's BGR conversion.
+    """
+    for fourcc, (pix_fmt, bytes_per_pixel) in NATIVE_PIXEL_FORMATS.items():
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        if not cap.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+            break
+        ret, frame = cap.read()
+        if ret and frame is not None and frame.nbytes == int(width * height * bytes_per_pixel):
+            return pix_fmt, frame.shape
+    cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+    return None
+
+def negotiate_mjpeg(cap):
+    """
+    Checks that the camera delivers undecoded JPEG frames after MJPG FOURCC
+    and CAP_PROP_CONVERT_RGB=0 were requested. Restores decoding otherwise.
+    """
+    if cap.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+        ret, frame = cap.read()
+        if ret and frame is not None and frame.size > 2 and (frame.ndim == 1 or frame.shape[0] == 1):
+            data = frame.reshape(-1)
+            if data[0] == 0xFF and data[1] == 0xD8:  # JPEG SOI marker
+                return True
+    cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+    return False
+
+# --- Capture Processes ---
+
+# Settings a capture process needs from the parent's command line
+CAPTURE_SETTINGS = ('VIDEO_WIDTH', 'VIDEO_HEIGHT', 'VIDEO_FPS', 'USE_MAX_QUALITY', 'PIXEL_FORMAT',
+                    'VIDEO_QUEUE_SIZE', 'VIDEO_DROP_POLICY', 'REALTIME_CAPTURE', 'REALTIME_PRIORITY',
+                    'REALTIME_NICE')
+
+class SharedFramePool(FramePool):
+    """
+    FramePool whose buffers are slots of one multiprocessing.shared_memory
+    block, built the same way in the capture process and in the parent.
+    Buffers cross the process boundary as slot indices: the free queue is a
+    multiprocessing queue, so the parent's release() hands a slot back to
+    the capture process's acquire().
+    """
+    def __init__(self, shape, size, shm, free):
+        self.shape = tuple(shape)
+        self.size = size
+        slot_bytes = int(np.prod(self.shape))
+        self.buffers = [np.ndarray(self.shape, dtype=np.uint8, buffer=shm.buf, offset=i * slot_bytes)
+                        for i in range(size)]
+        self.slots = {id(buf): i for i, buf in enumerate(self.buffers)}
+        self.free = free
+        self.reallocations = 0
+
+    def slot(self, buf):
+        """Slot index of a pool buffer, or of a view into one (compressed frames)."""
+        return self.slots[id(buf)] if id(buf) in self.slots else self.slots[id(buf.base)]
+
+    def acquire(self, timeout=None):
+        try:
+            return self.buffers[self.free.get(timeout=timeout)]
+        except queue.Empty:
+            return None
+
+    def release(self, buf):
+        self.free.put(self.slot(buf))
+
+class ProcessFrameRing(FrameRing):
+    """
+    Parent side of a capture process's hand-off, with FrameRing's interface
+    over the queue of (slot, length, capture time) the process sends. The
+    ring's capacity is a semaphore shared with the process, which applies
+    the overflow policy when it is full just as FrameRing.put does: with
+    drop-oldest it takes the oldest queued slot back, so the camera keeps
+    being read at sensor rate. None on the queue (or the process dying)
+    closes the ring.
+    """
+    def __init__(self, pool, ready, process, child_dropped, ring_slots, capacity=VIDEO_QUEUE_SIZE, policy=VIDEO_DROP_POLICY):
+        super().__init__(pool, capacity, policy)
+        self.ready = ready
+        self.process = process
+        self.child_dropped = child_dropped
+        self.ring_slots = ring_slots
+
+    @property
+    def depth(self):
+        try:
+            return self.ready.qsize()
+        except NotImplementedError:  # macOS
+            return 0
+
+    def get(self, timeout=None):
+        try:
+            item = self.ready.get(timeout=timeout)
+        except queue.Empty:
+            if not self.process.is_alive():
+                self.closed = True
+            return None
+        self.dropped = self.child_dropped.value
+        if item is None:
+            self.closed = True
+            return None
+        self.ring_slots.release()
+        slot, length, timestamp = item
+        frame = self.pool.buffers[slot]
+        if length:
+            frame = frame[:length]
+        self.pushed += 1
+        self.last_age = time.monotonic() - timestamp
+        self.max_age = max(self.max_age, self.last_age)
+        return frame, timestamp
+
+class CaptureProcess:
+    """
+    A camera's capture stage in its own process (--process-per-camera), so
+    reads and conversions of several cameras don't share one GIL. The child
+    opens and negotiates the camera and reports the format; the parent then
+    creates the shared-memory slots and the child reads frames straight into
+    them. Only slot indices and timestamps are queued, nothing is pickled
+    per frame. pool and ring give the writer the same interface as the
+    capture thread's FramePool/FrameRing.
+    """
+    def __init__(self, device_index, device_name, capture_class=None):
+        ctx = multiprocessing.get_context('spawn')  # No fork of a threaded parent
+        self.conn, child_conn = ctx.Pipe()
+        self.free = ctx.Queue()
+        self.ready = ctx.Queue()
+        self.stop = ctx.Event()
+        self.captured = ctx.Value('Q', 0, lock=False)
+        self.dropped = ctx.Value('Q', 0, lock=False)
+        self.capacity = max(1, VIDEO_QUEUE_SIZE)
+        self.ring_slots = ctx.Semaphore(self.capacity)  # Free places in the ring
+        self.shm = None
+        self.pool = None
+        self.ring = None
+        self.fmt = None
+        settings = {name: globals()[name] for name in CAPTURE_SETTINGS}
+        self.process = ctx.Process(
+            target=capture_process_main,
+            args=(settings, device_index, device_name, capture_class, child_conn, self.free, self.ready,
+                  self.ring_slots, self.stop, self.captured, self.dropped),
+            daemon=True
+        )
+        self.process.start()
+        try:
+            if self.conn.poll(CAPTURE_PROCESS_TIMEOUT):
+                self.fmt = self.conn.recv()
+        except (EOFError, OSError):
+            pass
+        if self.fmt is None:
+            print(f"Capture process for {device_name} failed to open the camera.")
+            return
+
+        slots = self.capacity + 2  # Ring capacity plus one buffer held by each stage
+        shape = self.fmt['frame_shape']
+        # Created (and unlinked) by the parent, so it outlives a crashed capture process
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * slots)
+        self.pool = SharedFramePool(shape, slots, self.shm, self.free)
+        for i in range(slots):
+            self.free.put(i)
+        self.ring = ProcessFrameRing(self.pool, self.ready, self.process, self.dropped, self.ring_slots,
+                                     self.capacity, VIDEO_DROP_POLICY)
+        self.conn.send(self.shm.name)
+        print(f"{device_name}: capture process {self.process.pid}, {slots} shared-memory slots "
+              f"of {int(np.prod(shape))} bytes")
+
+    def close(self):
+        self.stop.set()
+        if self.ring:
+            self.ring.closed = True
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        if self.shm:
+            # Views into the block must go before it can be unmapped
+            self.pool.buffers = []
+            self.pool.slots = {}
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+def reserve_ring_slot(ring_slots, ready, pool, stop, dropped):
+    """
+    Capture-process side of ProcessFrameRing: takes a place in the ring for
+    a frame just read, applying VIDEO_DROP_POLICY when the ring is full as
+    FrameRing.put does. Returns False if the frame is to be discarded.
+    """
+    while not ring_slots.acquire(block=False):
+        if stop.is_set():
+            return False
+        if VIDEO_DROP_POLICY == 'drop-newest':
+            dropped.value += 1
+            return False
+        if VIDEO_DROP_POLICY == 'block':
+            if ring_slots.acquire(timeout=0.5):
+                return True
+            continue
+        # drop-oldest: take the stalest queued frame back; its place goes to the new one
+        try:
+            slot = ready.get_nowait()[0]
+        except queue.Empty:
+            # The writer got it first, or it hasn't left this process's queue feeder yet
+            if ring_slots.acquire(timeout=0.005):
+                return True
+            continue
+        pool.release(pool.buffers[slot])
+        dropped.value += 1
+        return True
+    return True
+
+def capture_process_main(settings, device_index, device_name, capture_class, conn, free, ready, ring_slots,
+                         stop, captured, dropped):
+    """Body of a CaptureProcess: opens the camera, then fills shared-memory slots until stopped."""
+    globals().update(settings)
+    cap, fmt = open_camera(device_index, device_name, capture_class)
+    conn.send(fmt)
+    if cap is None:
+        return
+    try:
+        name = conn.recv()
+    except EOFError:
+        cap.release()
+        return
+    shm = shared_memory.SharedMemory(name=name)
+    pool = SharedFramePool(fmt['frame_shape'], max(1, VIDEO_QUEUE_SIZE) + 2, shm, free)
+    scratch = np.empty((fmt['height'], fmt['width'], 3), dtype=np.uint8) if fmt['convert'] else None
+    jitter = PeriodJitter(1 / float(fmt['frame_rate']))
+    if REALTIME_CAPTURE:
+        print(f"{device_name} capture process: {raise_thread_priority()}")
+    try:
+        while not stop.is_set():
+            # One slot per ring place plus one per stage: a slot is free whenever the ring has room
+            frame = pool.acquire(timeout=0.5)
+            if frame is None:
+                continue
+            data, captured_at = read_video_frame(cap, pool, frame, fmt['compressed'], scratch)
+            if data is None:
+                pool.release(frame)
+                if not stop.is_set():
+                    print(f"Error reading frame from {device_name}.")
+                break
+            jitter.tick(captured_at)
+            captured.value += 1
+            if not reserve_ring_slot(ring_slots, ready, pool, stop, dropped):
+                pool.release(frame)
+                continue
+            ready.put((pool.slot(frame), len(data) if fmt['compressed'] else 0, captured_at))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if jitter.deviation.count:
+            print(f"[Video] {device_name} capture: {jitter.report()}")
+        ready.put(None)
+        pool.buffers = []
+        pool.slots = {}
+        shm.close()
         cap.release()
+
+# --- Supervisor ---
+
+CURRENT_STREAM = threading.local()  # .handle: StreamHandle of the stream a thread works for
+SHUTDOWN_DEADLINE = 5.0             # Seconds streams get to exit before their FFmpeg is killed
+
+def _resolve(future, value=None):
+    if not future.done():
+        future.set_result(value)
+
+class StreamHandle:
+    """
+    One supervised stream: its worker thread, and futures on the supervisor's
+    loop for its first encoder write (live) and its end (done). The stream's
+    threads signal them with call_soon_threadsafe, so nothing is polled.
+    """
+    def __init__(self, supervisor, name):
+        self.supervisor = supervisor
+        self.loop = supervisor.loop
+        self.name = name
+        self.live = self.loop.create_future()
+        self.done = self.loop.create_future()
+        self.started_at = time.monotonic()
+        self.thread = None
+        self.processes = []        # FFmpeg processes of this stream that haven't exited yet
+        self.metrics = None        # StreamMetrics of the current run
+        self.failed_at = None      # When the previous run died, until the next one is live
+
+    def mark_live(self):
+        self.loop.call_soon_threadsafe(_resolve, self.live, time.monotonic())
+
+    def finished(self):
+        self.loop.call_soon_threadsafe(_resolve, self.done, time.monotonic())
+
+    def watch_process(self, proc):
+        """Awaits exit of an FFmpeg process the stream just started."""
+        self.loop.call_soon_threadsafe(lambda: self.loop.create_task(self.supervisor.watch(self, proc)))
+
+class Backoff:
+    """Doubling delays between restarts, back to the first once a run lasted RESTART_STABLE seconds."""
+    def __init__(self):
+        self.delay = RESTART_BACKOFF_INITIAL
+        self.started = time.monotonic()
+
+    def next(self):
+        if time.monotonic() - self.started >= RESTART_STABLE:
+            self.delay = RESTART_BACKOFF_INITIAL
+        delay = self.delay
+        self.delay = min(self.delay * 2, RESTART_BACKOFF_MAX)
+        return delay
+
+    def ran(self):
+        self.started = time.monotonic()
+
+def restart_encoder(encoder, input_args, output_args, metrics, backoff, stop_event, name):
+    """
+    Respawns a stream's encoder after a failed write, with backoff, on the
+    same output. The capture device is left open. Returns True once the new
+    encoder is running, False if the stream is stopping or the encoder can't
+    be restarted in place (a shared FFmpeg slot; the supervisor then restarts
+    the whole stream).
+    """
+    metrics.failed_at = time.monotonic()
+    metrics.live = False
+    encoder.close()
+    if not RESTART_BACKOFF_MAX or not isinstance(encoder, (FFmpegEncoder, PyAvEncoder)):
+        return False
+    while True:
+        delay = backoff.next()
+        print(f"[Restart] {name}: restarting encoder in {delay:.2f} s")
+        if stop_event.wait(delay):
+            return False
         try:
-            if proc:
-                proc.stdin.close()
-                proc.wait(timeout=2)
-        except:
-            if proc:
-                proc.kill()
+            encoder.start(input_args, output_args)
+        except Exception as e:
+            print(f"[Restart] {name}: encoder failed to start: {e}")
+            continue
+        backoff.ran()
+        metrics.restarts += 1
+        return True
+
+def run_stream(target, args, encoder, handle=None):
+    """Thread body: runs a stream task and releases its encoder slot however it ends."""
+    CURRENT_STREAM.handle = handle
+    try:
+        target(*args, encoder=encoder)
+    finally:
+        if encoder:
+            encoder.close()
+        if handle:
+            handle.finished()
+
+class StreamSupervisor:
+    """
+    Owns every stream from an asyncio loop on its own thread. The capture and
+    encode work stays on each stream's worker threads; the supervisor starts
+    a batch all at once, awaits each stream's first write, its FFmpeg
+    processes' exit and its end (reporting a dead stream as it happens), and
+    stops everything at once against SHUTDOWN_DEADLINE.
+    """
+    def __init__(self, stop_event):
+        self.stop_event = stop_event
+        self.loop = asyncio.new_event_loop()
+        self.handles = []
+        self.stopping = False
+        self.stop_requested = self.loop.create_future()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def active(self):
+        return sum(1 for handle in self.handles if not handle.done.done())
+
+    def start(self, pending):
+        """
+        Starts a batch of (task, args) streams. With --shared-ffmpeg the whole
+        batch is encoded by one FFmpeg process instead of one per device.
+        Returns a concurrent future for the seconds until all were live.
+        """
+        return asyncio.run_coroutine_threadsafe(self._start(pending), self.loop)
+
+    async def _start(self, pending):
+        began = time.monotonic()
+        shared = None
+        if USE_SHARED_FFMPEG and len(pending) > 1:
+            if os.name == 'posix':
+                shared = SharedFFmpeg(len(pending))
+            else:
+                print("Shared FFmpeg needs /dev/fd pipes (Linux/macOS); using one FFmpeg per device.")
+
+        batch = []
+        for target, args in pending:
+            handle = StreamHandle(self, f"port {args[-2]}")
+            handle.thread = threading.Thread(
+                target=run_stream,
+                args=(target, args, shared.slot() if shared else None, handle),
+                daemon=True
+            )
+            handle.thread.start()
+            self.loop.create_task(self._supervise(handle, target, args))
+            self.handles.append(handle)
+            batch.append(handle)
+
+        # A stream that fails before its first write counts as done, not live
+        await asyncio.gather(*(asyncio.wait([h.live, h.done], return_when=asyncio.FIRST_COMPLETED) for h in batch))
+        elapsed = time.monotonic() - began
+        live = sum(1 for h in batch if h.live.done())
+        print(f"[Supervisor] {live}/{len(batch)} streams live in {elapsed * 1000:.0f} ms")
+        return elapsed
+
+    async def _supervise(self, handle, target, args):
+        """Restarts the stream on the same port, with backoff, whenever it ends on its own."""
+        backoff = Backoff()
+        while True:
+            ended = await handle.done
+            if self.stopping:
+                return
+            if not RESTART_BACKOFF_MAX:
+                print(f"[Supervisor] {handle.name} ended after {ended - handle.started_at:.1f} s")
+                return
+            backoff.started = handle.started_at
+            delay = backoff.next()
+            print(f"[Supervisor] {handle.name} ended after {ended - handle.started_at:.1f} s; "
+                  f"restarting in {delay:.2f} s on port {args[-2]}")
+            await asyncio.wait([self.stop_requested], timeout=delay)
+            if self.stopping:
+                return
+            # A fresh encoder of its own: a shared FFmpeg slot can't be rejoined
+            handle.failed_at = ended
+            handle.done = self.loop.create_future()
+            handle.started_at = time.monotonic()
+            handle.thread = threading.Thread(target=run_stream, args=(target, args, None, handle), daemon=True)
+            handle.thread.start()
+
+    async def watch(self, handle, proc):
+        handle.processes.append(proc)
+        try:
+            returncode = await self._wait_process(proc)
+        finally:
+            handle.processes.remove(proc)
+        if not proc.closing and not self.stopping:
+            print(f"[Supervisor] FFmpeg for {handle.name} exited with code {returncode}")
+
+    async def _wait_process(self, proc):
+        """Awaits a Popen's exit: a pidfd on the loop on Linux, a blocked worker thread elsewhere."""
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except (AttributeError, OSError):
+            return await self.loop.run_in_executor(None, proc.wait)
+        exited = self.loop.create_future()
+        self.loop.add_reader(pidfd, _resolve, exited)
+        try:
+            await exited
+        finally:
+            self.loop.remove_reader(pidfd)
+            os.close(pidfd)
+        return await self.loop.run_in_executor(None, proc.wait)
+
+    def shutdown(self, deadline=SHUTDOWN_DEADLINE):
+        """Stops every stream at once and returns the seconds until all had exited."""
+        return asyncio.run_coroutine_threadsafe(self._shutdown(deadline), self.loop).result()
+
+    async def _shutdown(self, deadline):
+        began = time.monotonic()
+        self.stopping = True
+        self.stop_event.set()
+        _resolve(self.stop_requested)
+        running = [h.done for h in self.handles if not h.done.done()]
+        if running:
+            await asyncio.wait(running, timeout=deadline)
+        late = [h for h in self.handles if not h.done.done()]
+        for handle in late:
+            print(f"[Supervisor] {handle.name} still running after {deadline:g} s; killing its FFmpeg")
+            for proc in list(handle.processes):
+                if proc.poll() is None:
+                    proc.kill()
+        elapsed = time.monotonic() - began
+        if self.handles:
+            print(f"[Supervisor] {len(self.handles) - len(late)}/{len(self.handles)} streams exited "
+                  f"in {elapsed * 1000:.0f} ms")
+        self.loop.call_soon(self.loop.stop)
+        return elapsed
 
 # --- Main App ---
 
 def main():
-    global OBS_IP, BASE_PORT_AUDIO, BASE_PORT_VIDEO, USE_MAX_QUALITY
+    global OBS_IP, BASE_PORT_AUDIO, BASE_PORT_VIDEO, USE_MAX_QUALITY, VIDEO_QUEUE_SIZE, VIDEO_DROP_POLICY, AUDIO_MAX_LATENCY_MS, AUDIO_MODE, AUDIO_PERIOD, PIXEL_FORMAT, MJPEG_COPY, USE_SHARED_FFMPEG, ENCODER_BACKEND, USE_FANOUT, UDP_BATCH, UDP_PACING_MBPS, FEC_COLUMNS, FEC_ROWS, METRICS_PORT, TRACE_FILE, TRACER, AUDIO_HOST_API, AUDIO_RATE, AUDIO_CHANNELS, COMBINE_MICS, DRIFT_COMPENSATION, TIMESTAMP_MODE, USE_ABR, ABR_DOWN_AFTER, ABR_UP_AFTER, ABR_HOLD, ABR_SPEED_LOW, ABR_SPEED_OK, ABR_BUSY_HIGH, ABR_BUSY_OK, RESTART_BACKOFF_MAX, CAPTURE_PROCESSES, CPU_AFFINITY, CPU_PLAN, REALTIME_CAPTURE
 
+    startup = time.perf_counter()
     set_high_priority()
 
-    if not get_ffmpeg_path():
-        print("Error: FFmpeg not found. Please install it or add it to your PATH.")
-        sys.exit(1)
-
     # Parse command line arguments
     parser = argparse.ArgumentParser(description="PyAvStreamer - Audio/Video Streaming Tool")
     parser.add_argument("--obs-ip", default=OBS_IP, help=f"IP address of the OBS machine (default: {OBS_IP})")
@@ -354,6 +3661,41 @@ def main():
     parser.add_argument("--base-port-video", type=int, default=BASE_PORT_VIDEO, help=f"Base UDP port for video (default: {BASE_PORT_VIDEO})")
     parser.add_argument("--stream-type", choices=['audio', 'video', 'both'], default=None, help="Stream type to enable (audio or video). Default: Manual selection")
     parser.add_argument("--max-quality", action="store_true", help="Attempt to use the maximum resolution and FPS supported by the camera")
+    parser.add_argument("--video-queue-size", type=int, default=VIDEO_QUEUE_SIZE, help=f"Frames buffered between video capture and the encoder (default: {VIDEO_QUEUE_SIZE})")
+    parser.add_argument("--video-drop-policy", choices=FrameRing.POLICIES, default=VIDEO_DROP_POLICY, help=f"What to do when the encoder falls behind (default: {VIDEO_DROP_POLICY})")
+    parser.add_argument("--pixel-format", choices=['bgr24', 'yuv420p', 'native', 'mjpeg'], default=PIXEL_FORMAT, help=f"Video pixel format piped to FFmpeg; 'native' passes the camera's YUV through unconverted, 'mjpeg' its undecoded JPEG frames (default: {PIXEL_FORMAT})")
+    parser.add_argument("--mjpeg-copy", action="store_true", help="With --pixel-format mjpeg, send the camera's MJPEG without transcoding (matroska output)")
+    parser.add_argument("--process-per-camera", action="store_true", help="Capture each camera in its own process; frames reach the encoder stage through shared memory")
+    parser.add_argument("--cpu-affinity", action="store_true", help="Split the CPUs across video streams: pin each stream's capture, writer and FFmpeg to its share and give x264 that many threads (Linux)")
+    parser.add_argument("--realtime", action="store_true", help="Run capture threads with SCHED_FIFO priority, or a lower nice value without root/CAP_SYS_NICE (Linux)")
+    parser.add_argument("--shared-ffmpeg", action="store_true", help="Encode each batch of streams in one FFmpeg process fed through /dev/fd pipes (Linux/macOS)")
+    parser.add_argument("--encoder-backend", choices=['subprocess', 'pyav'], default=ENCODER_BACKEND, help=f"Encode in an ffmpeg subprocess fed by a pipe, or in-process with PyAV (default: {ENCODER_BACKEND})")
+    parser.add_argument("--restart-backoff-max", type=float, default=RESTART_BACKOFF_MAX, help=f"Restart a failed encoder or stream on the same port with doubling delays up to this many seconds; 0 disables restarts (default: {RESTART_BACKOFF_MAX:g})")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="Serve per-stream Prometheus metrics on http://127.0.0.1:PORT/metrics (default: off)")
+    parser.add_argument("--trace", action="store_true", help="Start with per-frame pipeline tracing on (toggle at runtime with menu option T)")
+    parser.add_argument("--trace-file", default=TRACE_FILE, help=f"Chrome/Perfetto trace JSON written when tracing stops (default: {TRACE_FILE})")
+    parser.add_argument("--trace-buffer", type=int, default=TRACE_BUFFER, help=f"Stage spans kept in memory; older ones are overwritten (default: {TRACE_BUFFER})")
+    parser.add_argument("--abr", action="store_true", help="Adapt video bitrate, resolution and frame rate to encoder speed and pipe backpressure (restarts FFmpeg on each step)")
+    parser.add_argument("--abr-down-after", type=int, default=ABR_DOWN_AFTER, help=f"Consecutive bad progress reports (0.5 s apart) before stepping quality down (default: {ABR_DOWN_AFTER})")
+    parser.add_argument("--abr-up-after", type=int, default=ABR_UP_AFTER, help=f"Consecutive good progress reports before stepping quality up (default: {ABR_UP_AFTER})")
+    parser.add_argument("--abr-hold", type=float, default=ABR_HOLD, help=f"Minimum seconds between quality changes (default: {ABR_HOLD:g})")
+    parser.add_argument("--abr-speed", type=float, nargs=2, metavar=('LOW', 'OK'), default=[ABR_SPEED_LOW, ABR_SPEED_OK], help=f"Encode speed below LOW makes a progress report bad; at least OK is needed for a good one (default: {ABR_SPEED_LOW:g} {ABR_SPEED_OK:g})")
+    parser.add_argument("--abr-busy", type=float, nargs=2, metavar=('HIGH', 'OK'), default=[ABR_BUSY_HIGH, ABR_BUSY_OK], help=f"Share of the frame interval blocked in pipe writes above HIGH makes a report bad; under OK is needed for a good one (default: {ABR_BUSY_HIGH:g} {ABR_BUSY_OK:g})")
+    parser.add_argument("--fanout", action="store_true", help="Encode once and send each stream from Python to every destination (adds menu options to add/remove receivers)")
+    parser.add_argument("--destination", action="append", default=[], metavar="HOST", help="Extra receiver host for every stream, same ports as --obs-ip (repeatable, implies --fanout)")
+    parser.add_argument("--udp-batch", type=int, default=UDP_BATCH, help=f"Max datagrams per send syscall in fan-out mode (default: {UDP_BATCH})")
+    parser.add_argument("--udp-pacing-mbps", type=float, default=UDP_PACING_MBPS, help="Pace each stream's UDP egress to this peak rate in Mbit/s (implies --fanout; default: unpaced)")
+    parser.add_argument("--fec", type=parse_fec_matrix, default=None, metavar="COLSxROWS", help="Add row/column XOR FEC to every stream, e.g. 10x5 (30%% overhead) or 10x0 for row-only; needs --fec-receive at the OBS end (implies --fanout)")
+    parser.add_argument("--fec-receive", type=int, nargs="+", default=None, metavar="PORT", help=f"Run as the FEC receiver on the OBS machine: repair the streams on these ports and forward them to 127.0.0.1 on port+{FEC_FORWARD_OFFSET}")
+    parser.add_argument("--audio-host-api", default=AUDIO_HOST_API, help="PortAudio host API to list microphones from, e.g. ALSA, PulseAudio, JACK, WASAPI (default: MME on Windows, PortAudio's default elsewhere)")
+    parser.add_argument("--audio-rate", type=int, default=AUDIO_RATE, help=f"Sample rate sent to OBS; devices are captured at their native rate and converted once by the encoder (default: {AUDIO_RATE})")
+    parser.add_argument("--audio-channels", type=int, default=AUDIO_CHANNELS, help=f"Channels sent to OBS (default: {AUDIO_CHANNELS})")
+    parser.add_argument("--combine-mics", action="store_true", help="When several mics are selected, interleave them into one multichannel stream with one encoder and one port")
+    parser.add_argument("--drift-compensation", action="store_true", help="Resample every mic onto one common clock so buffers stay bounded over long sessions (drift in ppm is reported either way)")
+    parser.add_argument("--timestamps", choices=['capture', 'wallclock'], default=TIMESTAMP_MODE, help="Stamp frames and audio with their capture time and pipe them in Matroska framing, or let FFmpeg stamp them on arrival (default: wallclock)")
+    parser.add_argument("--audio-max-latency-ms", type=int, default=AUDIO_MAX_LATENCY_MS, help=f"Audio buffered before the oldest samples are dropped (default: {AUDIO_MAX_LATENCY_MS})")
+    parser.add_argument("--audio-mode", choices=['blocking', 'callback'], default=AUDIO_MODE, help=f"Audio capture mode: blocking reads of {CHUNK} frames, or a PortAudio callback (default: {AUDIO_MODE})")
+    parser.add_argument("--audio-period", type=int, default=AUDIO_PERIOD, help=f"Frames per callback period in callback mode (default: {AUDIO_PERIOD})")
     args = parser.parse_args()
 
     # Update globals with arguments
@@ -361,15 +3703,87 @@ def main():
     BASE_PORT_AUDIO = args.base_port_audio
     BASE_PORT_VIDEO = args.base_port_video
     USE_MAX_QUALITY = args.max_quality
+    VIDEO_QUEUE_SIZE = args.video_queue_size
+    VIDEO_DROP_POLICY = args.video_drop_policy
+    PIXEL_FORMAT = args.pixel_format
+    MJPEG_COPY = args.mjpeg_copy
+    CAPTURE_PROCESSES = args.process_per_camera
+    CPU_AFFINITY = args.cpu_affinity
+    REALTIME_CAPTURE = args.realtime
+    USE_SHARED_FFMPEG = args.shared_ffmpeg
+    ENCODER_BACKEND = args.encoder_backend
+    METRICS_PORT = args.metrics_port
+    RESTART_BACKOFF_MAX = args.restart_backoff_max
+    TRACE_FILE = args.trace_file
+    TRACER = Tracer(args.trace_buffer)
+    if args.trace:
+        TRACER.start()
+    USE_ABR = args.abr
+    ABR_DOWN_AFTER = args.abr_down_after
+    ABR_UP_AFTER = args.abr_up_after
+    ABR_HOLD = args.abr_hold
+    ABR_SPEED_LOW, ABR_SPEED_OK = args.abr_speed
+    ABR_BUSY_HIGH, ABR_BUSY_OK = args.abr_busy
+    if ABR_SPEED_LOW > ABR_SPEED_OK or ABR_BUSY_OK > ABR_BUSY_HIGH:
+        parser.error("--abr-speed needs LOW <= OK and --abr-busy OK <= HIGH")
+    UDP_BATCH = args.udp_batch
+    UDP_PACING_MBPS = args.udp_pacing_mbps
+    FEC_COLUMNS, FEC_ROWS = args.fec or (0, 0)
+    USE_FANOUT = args.fanout or bool(args.destination) or UDP_PACING_MBPS > 0 or FEC_COLUMNS > 0
+    for host in args.destination:
+        add_fanout_destination(host)
+    AUDIO_HOST_API = args.audio_host_api
+    AUDIO_RATE = args.audio_rate
+    AUDIO_CHANNELS = args.audio_channels
+    COMBINE_MICS = args.combine_mics
+    DRIFT_COMPENSATION = args.drift_compensation
+    TIMESTAMP_MODE = args.timestamps
+    AUDIO_MAX_LATENCY_MS = args.audio_max_latency_ms
+    AUDIO_MODE = args.audio_mode
+    AUDIO_PERIOD = args.audio_period
     
+    if args.fec_receive:
+        run_fec_receivers(args.fec_receive)
+        return
+
+    if CPU_AFFINITY:
+        if hasattr(os, 'sched_setaffinity'):
+            CPU_PLAN = CpuPlan()
+        else:
+            print("--cpu-affinity needs Linux (os.sched_setaffinity); ignoring it.")
+
+    if not get_ffmpeg_path():
+        print("Error: FFmpeg not found. Please install it or add it to your PATH.")
+        sys.exit(1)
+
+    if ENCODER_BACKEND == 'pyav':
+        if av is None:
+            print("Error: --encoder-backend pyav needs PyAV (pip install av).")
+            sys.exit(1)
+        if USE_SHARED_FFMPEG:
+            print("--shared-ffmpeg has no effect with the pyav backend.")
+            USE_SHARED_FFMPEG = False
+    if (USE_FANOUT or USE_ABR) and (USE_SHARED_FFMPEG or ENCODER_BACKEND != 'subprocess'):
+        print("--fanout/--abr need one FFmpeg subprocess per stream; ignoring --shared-ffmpeg/--encoder-backend.")
+        USE_SHARED_FFMPEG = False
+        ENCODER_BACKEND = 'subprocess'
+
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+
     # Logic: If specific type provided, filter menu AND auto-execute. If None, show all.
     STREAM_TYPE = args.stream_type if args.stream_type else 'both'
 
+    if STREAM_TYPE in ['video', 'both']:
+        prefetch_video_devices()
     p = pyaudio.PyAudio()
-    active_threads = []
+    menu_shown = False
+    # Streams selected but not yet started; auto-start batches audio and video together
+    pending = []
     audio_offset = 0
     video_offset = 0
     stop_event = threading.Event()
+    supervisor = StreamSupervisor(stop_event)
     
     # Auto-start logic
     auto_choices = []
@@ -382,18 +3796,29 @@ def main():
 
     try:
         while True:
+            if pending and not auto_choices:
+                supervisor.start(pending)
+                pending = []
+
             choice = None
             if auto_choices:
                 choice = auto_choices.pop(0)
             else:
+                if not menu_shown:
+                    print(f"\nTime to menu: {(time.perf_counter() - startup) * 1000:.0f} ms")
+                    menu_shown = True
                 print("\n=== PyAvStreamer ===")
-                print(f"Active Streams: {len(active_threads)}")
+                print(f"Active Streams: {supervisor.active}")
                 
                 if STREAM_TYPE in ['audio', 'both']:
                     print("1. Add Audio Stream")
                 if STREAM_TYPE in ['video', 'both']:
                     print("2. Add Video Stream")
                 print("3. Stop All and Exit")
+                print(f"T. {'Stop tracing and write ' + TRACE_FILE if TRACER.enabled else 'Start tracing'}")
+                if USE_FANOUT:
+                    print(f"4. Add Destination (current extra: {', '.join(FANOUT_HOSTS) or 'none'})")
+                    print("5. Remove Destination")
                 
                 choice = input("Select option: ").strip()
 
@@ -430,16 +3855,15 @@ def main():
                     except ValueError:
                         print("Invalid input.")
 
-                audio_offset += len(to_start)
-                for idx, name, port in to_start:
-                    t = threading.Thread(
-                        target=stream_audio_task,
-                        args=(p, idx, name, port, stop_event),
-                        daemon=True
-                    )
-                    t.start()
-                    active_threads.append(t)
-                    time.sleep(0.5)
+                if COMBINE_MICS and len(to_start) > 1:
+                    # One encoder and one port for all of them
+                    port = BASE_PORT_AUDIO + audio_offset
+                    audio_offset += 1
+                    pending.append((stream_multi_audio_task, (p, [(idx, name) for idx, name, _ in to_start], port, stop_event)))
+                else:
+                    audio_offset += len(to_start)
+                    for idx, name, port in to_start:
+                        pending.append((stream_audio_task, (p, idx, name, port, stop_event)))
 
             elif choice == "2":
                 if STREAM_TYPE not in ['video', 'both']:
@@ -455,7 +3879,10 @@ def main():
                     print("Auto-selecting ALL video devices per --stream-type argument.")
                     sel = 'A'
                 else:
-                    sel = input("Enter Video Device Index (or 'A' for All): ").strip()
+                    sel = input("Enter Video Device Index (or 'A' for All, 'R' to rescan): ").strip()
+                    while sel.upper() == 'R':
+                        devices = list_video_devices(rescan=True)
+                        sel = input("Enter Video Device Index (or 'A' for All, 'R' to rescan): ").strip()
                 to_start = []
                 
                 if sel.upper() == 'A':
@@ -475,25 +3902,40 @@ def main():
                         print("Invalid input.")
 
                 video_offset += len(to_start)
+                if CPU_PLAN:
+                    CPU_PLAN.expect(len(to_start))
                 for idx, name, port in to_start:
-                    t = threading.Thread(
-                        target=stream_video_task,
-                        args=(idx, name, port, stop_event),
-                        daemon=True
-                    )
-                    t.start()
-                    active_threads.append(t)
-                    time.sleep(0.5)
+                    pending.append((stream_video_task, (idx, name, port, stop_event)))
 
             elif choice == "3":
                 break
+
+            elif choice.upper() == "T":
+                toggle_tracing()
+
+            elif choice in ("4", "5") and USE_FANOUT:
+                host = input("Destination host/IP: ").strip()
+                if not host:
+                    continue
+                if choice == "4":
+                    add_fanout_destination(host)
+                    print(f"Streams now also sent to {host}.")
+                else:
+                    remove_fanout_destination(host)
+                    print(f"Stopped sending to {host}.")
             
     except KeyboardInterrupt:
         pass
     finally:
         print("\nShutting down...")
-        stop_event.set()
-        time.sleep(1)
+        spawned, live, threads, cpu = encoder_stats()
+        print(f"Encoders: {spawned} FFmpeg processes spawned, {live} running with {threads} threads, {cpu:.1f} s CPU")
+        supervisor.shutdown()
+        if TRACER.enabled:
+            toggle_tracing()
+        skew = av_skew_report()
+        if skew:
+            print(f"Timestamps ({TIMESTAMP_MODE}):\n{skew}")
         p.terminate()
         cv2.destroyAllWindows()
         print("Done.")
@@ -0,0 +1,107 @@
+"""
+Pass/fail checks for AudioRing, the PCM buffer between mic reader and
+FFmpeg writer: order across the wrap, the latency ceiling's drop-oldest
+resync, timeouts and close.
+
+    python tests/audioRingTest.py
+"""
+import threading
+import time
+
+from harness import streamer, run, check
+
+def new_ring(max_latency_ms=100):
+    # 1 kHz mono s16: 2 bytes per ms, so 100 ms is a 200-byte ring
+    return streamer.AudioRing(max_latency_ms, 1000, 2)
+
+def pcm(start, count):
+    """count bytes counting up from start, so order and gaps are visible."""
+    return bytes((start + i) % 256 for i in range(count))
+
+def test_capacity_is_latency_ceiling():
+    ring = new_ring()
+    check(ring.capacity == 200, f"capacity {ring.capacity}, expected 200 bytes")
+    odd = streamer.AudioRing(10, 44100, 4)  # 441 frames of 4 bytes
+    check(odd.capacity % 4 == 0, f"capacity {odd.capacity} not whole frames")
+
+def test_read_returns_everything_in_order():
+    ring = new_ring()
+    ring.write(pcm(0, 60))
+    ring.write(pcm(60, 40))
+    data = ring.read(timeout=0)
+    check(bytes(data) == pcm(0, 100), "coalesced read out of order")
+    check(ring.used == 0 and ring.overflows == 0, f"used {ring.used}, overflows {ring.overflows}")
+
+def test_wraparound():
+    ring = new_ring()
+    position = 0
+    for _ in range(7):  # 7 x 90 bytes: head and tail wrap the 200-byte buffer several times
+        ring.write(pcm(position, 90))
+        data = ring.read(timeout=0)
+        check(bytes(data) == pcm(position, 90), f"wrong bytes after {position} read")
+        position += 90
+    check(ring.overflows == 0, f"{ring.overflows} overflows without exceeding capacity")
+
+def test_max_bytes_leaves_rest_queued():
+    ring = new_ring()
+    ring.write(pcm(0, 100))
+    check(bytes(ring.read(timeout=0, max_bytes=30)) == pcm(0, 30), "first partial read")
+    check(ring.used == 70, f"{ring.used} bytes left, expected 70")
+    check(bytes(ring.read(timeout=0)) == pcm(30, 70), "rest of the queue")
+
+def test_overflow_drops_oldest_to_half_capacity():
+    ring = new_ring()
+    ring.write(pcm(0, 150))
+    ring.write(pcm(150, 20))     # 170 of 200: still fits
+    check(ring.overflows == 0, "overflowed below capacity")
+    ring.write(pcm(170, 60))     # 230 > 200: resync to half (100) minus the new 60 = keep 40
+    check(ring.overflows == 1, f"{ring.overflows} overflows, expected 1")
+    check(ring.dropped_bytes == 130, f"{ring.dropped_bytes} bytes dropped, expected 130")
+    data = bytes(ring.read(timeout=0))
+    check(data == pcm(130, 100), "kept audio is not the newest, contiguous 100 bytes")
+
+def test_overflow_keeps_whole_frames():
+    ring = streamer.AudioRing(100, 1000, 4)  # 400-byte ring of 4-byte frames
+    ring.write(pcm(0, 396))
+    ring.write(pcm(396, 12))
+    check(ring.dropped_bytes % 4 == 0, f"dropped {ring.dropped_bytes} bytes, not whole frames")
+    check(len(ring.read(timeout=0)) % 4 == 0, "read split a frame")
+
+def test_oversized_write_keeps_newest():
+    ring = new_ring()
+    ring.write(pcm(0, 500))
+    check(ring.dropped_bytes >= 300, f"only {ring.dropped_bytes} bytes dropped")
+    data = bytes(ring.read(timeout=0))
+    check(data == pcm(500 - len(data), len(data)), "oversized write did not keep its tail")
+
+def test_underflow_counted_only_after_start():
+    ring = new_ring()
+    check(ring.read(timeout=0.01) is None, "read from an empty ring returned data")
+    check(ring.underflows == 0, "underflow counted before the first write")
+    ring.write(pcm(0, 10))
+    ring.read(timeout=0)
+    check(ring.read(timeout=0.01) is None and ring.underflows == 1, f"{ring.underflows} underflows, expected 1")
+
+def test_close_wakes_reader():
+    ring = new_ring()
+    result = []
+    reader = threading.Thread(target=lambda: result.append(ring.read(timeout=5)))
+    reader.start()
+    time.sleep(0.05)
+    start = time.monotonic()
+    ring.close()
+    reader.join(timeout=1)
+    check(not reader.is_alive() and result == [None], "close() did not end a blocked read")
+    check(time.monotonic() - start < 0.5, "reader woke by timeout, not by close()")
+
+def test_depth_and_read_end_time():
+    ring = new_ring()
+    ring.write(pcm(0, 100))
+    check(abs(ring.depth_ms - 50) < 1e-9, f"depth {ring.depth_ms} ms, expected 50")
+    newest = ring.newest_time
+    ring.read(timeout=0, max_bytes=60)
+    # 40 bytes (20 ms) still queued: the last sample handed out arrived 20 ms before the newest
+    check(abs((newest - ring.read_end_time) - 0.020) < 1e-9, "read_end_time not 20 ms before newest")
+
+if __name__ == '__main__':
+    run(globals())
@@ -0,0 +1,158 @@
+"""
+Aggregate fps of synthetic 1080p cameras captured on threads vs. in
+capture processes, from one camera up to one per core; every frame is
+written to /dev/null as it would be to an encoder pipe. Fails unless N
+processes reach SCALING_MIN of N times one process (skipped on one CPU).
+Then stalls the writer of a capture process under each drop policy, and
+fails if a drop-oldest/drop-newest process stops reading its camera or
+grows its ring past the queue size, or if shared memory is left behind.
+
+    python tests/captureBenchmark.py [--seconds 3]
+"""
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+from harness import streamer, run, check, SyntheticCapture
+
+SECONDS = 3
+SCALING_MIN = 0.7  # Fraction of linear scaling N capture processes (N <= cores) must reach
+
+def measure_capture(cameras, processes, seconds):
+    """Frames per second written by all cameras together, after a one-second warm-up."""
+    stop = threading.Event()
+    written = [0] * cameras
+    sources = []
+    threads = []
+    null = os.open(os.devnull, os.O_WRONLY)
+
+    def capture(cap, pool, ring, fmt):
+        scratch = np.empty((fmt['height'], fmt['width'], 3), dtype=np.uint8) if fmt['convert'] else None
+        while not stop.is_set():
+            frame = pool.acquire(timeout=0.5)
+            if frame is not None:
+                ring.put(*streamer.read_video_frame(cap, pool, frame, fmt['compressed'], scratch))
+        ring.close()
+
+    def drain(i, pool, ring):
+        writer = streamer.PipeWriter(null)
+        while not stop.is_set():
+            item = ring.get(timeout=0.5)
+            if item is None:
+                if ring.closed:
+                    break
+                continue
+            writer.write(item[0])
+            pool.release(item[0])
+            written[i] += 1
+
+    for i in range(cameras):
+        if processes:
+            source = streamer.CaptureProcess(0, f"synthetic {i}", SyntheticCapture)
+            sources.append(source)
+            pool, ring = source.pool, source.ring
+        else:
+            cap, fmt = streamer.open_camera(0, f"synthetic {i}", SyntheticCapture)
+            pool = streamer.FramePool(fmt['frame_shape'], size=streamer.VIDEO_QUEUE_SIZE + 2)
+            ring = streamer.FrameRing(pool, streamer.VIDEO_QUEUE_SIZE, streamer.VIDEO_DROP_POLICY)
+            threads.append(threading.Thread(target=capture, args=(cap, pool, ring, fmt), daemon=True))
+        threads.append(threading.Thread(target=drain, args=(i, pool, ring), daemon=True))
+    for t in threads:
+        t.start()
+    time.sleep(1)
+    before = sum(written)
+    time.sleep(seconds)
+    fps = (sum(written) - before) / seconds
+    stop.set()
+    for t in threads:
+        t.join(timeout=2)
+    for source in sources:
+        close_checked(source)
+    os.close(null)
+    return fps
+
+def close_checked(source):
+    """Closes a CaptureProcess and checks its shared memory is gone."""
+    name = source.shm.name.lstrip('/')
+    source.close()
+    if os.path.isdir('/dev/shm'):
+        check(not os.path.exists(f"/dev/shm/{name}"), f"{name} left in /dev/shm")
+
+def test_processes_scale_with_cores():
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    if cores < 2:
+        print("     One CPU available; skipping the scaling check")
+        return
+    counts = sorted({1, 2, cores})
+    print(f"\n     Synthetic 1920x1080 cameras, {streamer.PIXEL_FORMAT}, {cores} cores")
+    results = {}
+    for cameras in counts:
+        for processes in (False, True):
+            results[cameras, processes] = measure_capture(cameras, processes, SECONDS)
+    for cameras in counts:
+        threads, processes = results[cameras, False], results[cameras, True]
+        print(f"     {cameras:>3} cameras: threads {threads:.0f} fps, processes {processes:.0f} fps "
+              f"({processes / results[1, True]:.2f}x one process)")
+    one = results[1, True]
+    check(one > 0, "one capture process wrote no frames")
+    for cameras in counts[1:]:
+        scaling = results[cameras, True] / one
+        check(scaling >= SCALING_MIN * cameras,
+              f"{cameras} capture processes ran {scaling:.2f}x one process, under {SCALING_MIN:g} x {cameras}")
+
+def stall_writer(policy, stall=1.0):
+    """
+    Runs a capture process whose reader takes one frame and then holds it for
+    stall seconds. Returns (frames captured during the stall, frames dropped,
+    deepest ring seen, ring capacity).
+    """
+    default = streamer.VIDEO_DROP_POLICY
+    streamer.VIDEO_DROP_POLICY = policy
+    source = streamer.CaptureProcess(0, f"synthetic {policy}", SyntheticCapture)
+    streamer.VIDEO_DROP_POLICY = default
+    try:
+        ring = source.ring
+        item = ring.get(timeout=2)
+        check(item is not None, "no first frame")
+        before = source.captured.value
+        deepest = 0
+        deadline = time.monotonic() + stall
+        while time.monotonic() < deadline:
+            deepest = max(deepest, ring.depth)
+            time.sleep(0.01)
+        captured = source.captured.value - before
+        source.pool.release(item[0])
+        check(ring.get(timeout=2) is not None, "no frame after the stall")
+        return captured, source.dropped.value, deepest, source.capacity
+    finally:
+        close_checked(source)
+
+def test_stalled_writer_drop_oldest():
+    captured, dropped, deepest, capacity = stall_writer('drop-oldest')
+    print(f"     drop-oldest: {captured} frames captured and {dropped} dropped in a 1 s stall, ring depth {deepest}")
+    check(captured > 10, f"only {captured} frames read from the camera while the writer stalled")
+    # One frame may be counted as captured but not yet have evicted the oldest
+    check(dropped >= captured - capacity - 1, f"{dropped} drops for {captured} frames into a ring of {capacity}")
+    check(deepest <= capacity, f"ring reached {deepest} frames, capacity {capacity}")
+
+def test_stalled_writer_drop_newest():
+    captured, dropped, deepest, capacity = stall_writer('drop-newest')
+    print(f"     drop-newest: {captured} frames captured and {dropped} dropped in a 1 s stall, ring depth {deepest}")
+    check(captured > 10, f"only {captured} frames read from the camera while the writer stalled")
+    check(dropped > 0, "no frames dropped")
+    check(deepest <= capacity, f"ring reached {deepest} frames, capacity {capacity}")
+
+def test_stalled_writer_block():
+    captured, dropped, deepest, capacity = stall_writer('block')
+    print(f"     block: {captured} frames captured and {dropped} dropped in a 1 s stall, ring depth {deepest}")
+    check(dropped == 0, f"{dropped} frames dropped under the block policy")
+    check(captured <= capacity + 1, f"{captured} frames read into a full ring of {capacity}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Capture threads vs. processes benchmark")
+    parser.add_argument("--seconds", type=float, default=SECONDS)
+    SECONDS = parser.parse_args().seconds
+    run(globals())
@@ -0,0 +1,145 @@
+"""
+Pass/fail checks for ClockDrift on simulated arrival times: the ppm
+estimate for fast, slow and jittery device clocks, the guards against
+early or implausible estimates, refits after lost input, and the
+resampler's output rate, continuity and sample-rate conversion.
+
+    python tests/clockDriftTest.py
+"""
+import random
+
+import numpy as np
+
+from harness import streamer, run, check
+
+RATE = 48000
+CHUNK = 480  # 10 ms periods
+
+def feed(drift, ppm, seconds, channels=1, jitter=0.0, signal=None, seed=1, lose=None, report_loss=True, lost=0):
+    """
+    Feeds seconds of audio from a device whose clock runs ppm fast, with
+    arrival times jittered by up to jitter seconds. lose=(chunk, frames)
+    drops that many frames before the given chunk, as an overflow does,
+    calling discontinuity() if report_loss; lost is what earlier calls
+    dropped. Returns the output chunks.
+    """
+    rng = random.Random(seed)
+    device_rate = RATE * (1 + ppm / 1e6)
+    out = []
+    start = drift.frames
+    for i in range(int(seconds * device_rate / CHUNK)):
+        if lose and i == lose[0]:
+            lost += lose[1]
+            if report_loss:
+                drift.discontinuity()
+        frame = start + i * CHUNK + lost
+        if signal is None:
+            chunk = np.zeros((CHUNK, channels), dtype=np.int16)
+        else:
+            chunk = signal(np.arange(frame, frame + CHUNK))
+        now = 1000.0 + (frame + CHUNK) / device_rate + rng.uniform(0, jitter)
+        out.append(drift.process(chunk.tobytes(), now))
+    return out
+
+def test_fast_clock():
+    drift = streamer.ClockDrift(RATE, 1)
+    feed(drift, 100, 60)
+    check(abs(drift.ppm - 100) < 1, f"estimated {drift.ppm:+.2f} ppm for a +100 ppm clock")
+
+def test_slow_clock():
+    drift = streamer.ClockDrift(RATE, 2)
+    feed(drift, -250, 60, channels=2)
+    check(abs(drift.ppm + 250) < 1, f"estimated {drift.ppm:+.2f} ppm for a -250 ppm clock")
+
+def test_jitter_averages_out():
+    drift = streamer.ClockDrift(RATE, 1)
+    feed(drift, 40, 90, jitter=0.005)
+    check(abs(drift.ppm - 40) < 5, f"estimated {drift.ppm:+.2f} ppm for +40 ppm under 5 ms jitter")
+
+def test_no_estimate_before_min_span():
+    drift = streamer.ClockDrift(RATE, 1)
+    feed(drift, 300, streamer.DRIFT_MIN_SPAN / 2)
+    check(drift.ppm == 0, f"estimate {drift.ppm:+.2f} ppm after only {streamer.DRIFT_MIN_SPAN / 2:g} s")
+
+def test_implausible_rate_ignored():
+    drift = streamer.ClockDrift(RATE, 1)
+    feed(drift, 2 * streamer.DRIFT_MAX_PPM, 30)
+    check(drift.ppm == 0, f"accepted {drift.ppm:+.0f} ppm, beyond DRIFT_MAX_PPM")
+
+def test_lost_input_is_not_drift():
+    # A 0 ppm device loses one 4096-frame chunk 30 s in: unreported, the fit reads it as a slow clock
+    lose = (int(30 * RATE / CHUNK), 4096)
+    unreported = streamer.ClockDrift(RATE, 1)
+    feed(unreported, 0, 60, lose=lose, report_loss=False)
+    check(abs(unreported.ppm) > 100, f"unreported loss gave only {unreported.ppm:+.2f} ppm; the case no longer tests anything")
+    drift = streamer.ClockDrift(RATE, 1)
+    feed(drift, 0, 60, lose=lose)
+    check(abs(drift.ppm) < 1, f"estimated {drift.ppm:+.2f} ppm for a 0 ppm clock after a reported loss")
+    check(drift.discontinuities == 1, f"{drift.discontinuities} discontinuities")
+
+def test_estimate_kept_while_refitting():
+    drift = streamer.ClockDrift(RATE, 1)
+    feed(drift, 150, 30)
+    converged = drift.ppm
+    # Straight after the loss there is too little history for a new fit: the old estimate stays
+    feed(drift, 150, streamer.DRIFT_MIN_SPAN / 2, lose=(0, 4096))
+    check(drift.ppm == converged, f"estimate moved from {converged:+.2f} to {drift.ppm:+.2f} ppm before DRIFT_MIN_SPAN")
+    feed(drift, 150, 30, lost=4096)
+    check(abs(drift.ppm - 150) < 1, f"estimated {drift.ppm:+.2f} ppm for a +150 ppm clock after the refit")
+
+def test_passthrough_without_resampling():
+    drift = streamer.ClockDrift(RATE, 1)
+    data = np.arange(CHUNK, dtype=np.int16).tobytes()
+    check(drift.process(data, 0.0) is data, "process() copied data with resampling off")
+
+def test_resampled_output_runs_at_nominal_rate():
+    drift = streamer.ClockDrift(RATE, 1, resample=True)
+    feed(drift, 200, 20)  # Converge first
+    before = drift.frames_out
+    feed(drift, 200, 40)
+    produced = drift.frames_out - before
+    consumed_seconds = 40 * RATE * (1 + 200e-6) // CHUNK * CHUNK / (RATE * (1 + 200e-6))
+    expected = consumed_seconds * RATE
+    check(abs(produced - expected) < 20, f"{produced} frames out over {consumed_seconds:.3f} s, expected {expected:.0f}")
+
+def test_depth_error_bounded_correction():
+    drift = streamer.ClockDrift(RATE, 1, resample=True)
+    drift.depth_error = 100.0  # Far too deep: the correction must clamp at DRIFT_MAX_CORRECTION
+    feed(drift, 0, 10)
+    ratio = drift.frames_out / drift.frames
+    expected = 1 / (1 + streamer.DRIFT_MAX_CORRECTION)
+    check(abs(ratio - expected) < 20e-6, f"output/input {ratio:.6f}, expected {expected:.6f}")
+
+def test_rate_conversion():
+    drift = streamer.ClockDrift(44100, 2, output_rate=RATE)
+    amplitude, freq = 10000, 440.0
+    out = []
+    for i in range(441):  # 10 s of 1000-frame chunks at 44.1 kHz, tagged with a 440 Hz sine
+        n = np.arange(i * 1000, (i + 1) * 1000)
+        left = amplitude * np.sin(2 * np.pi * freq * n / 44100)
+        chunk = np.stack((left, left), axis=1).astype(np.int16)
+        out.append(drift.process(chunk.tobytes(), 1000.0 + (i + 1) * 1000 / 44100))
+    out = np.concatenate(out)
+    check(abs(len(out) - 10 * RATE) <= 2, f"{len(out)} frames out for 10 s at {RATE} Hz")
+    # The sine keeps its pitch: same phase at the output rate, within interpolation error
+    t = np.arange(len(out)) / RATE
+    expected = amplitude * np.sin(2 * np.pi * freq * t)
+    error = np.abs(out[:, 0] - expected).max()
+    check(error < amplitude * 0.01, f"output is {error:.0f} off a {freq:g} Hz sine at {RATE} Hz")
+    check(drift.ppm == 0, f"rate conversion alone moved the drift estimate to {drift.ppm:+.2f} ppm")
+
+def test_resampler_is_continuous():
+    drift = streamer.ClockDrift(RATE, 2, resample=True)
+    amplitude, freq = 10000, 440.0
+    def sine(n):
+        left = amplitude * np.sin(2 * np.pi * freq * n / RATE)
+        return np.stack((left, -left), axis=1).astype(np.int16)
+    out = np.concatenate(feed(drift, 150, 30, channels=2, signal=sine))
+    check(out.shape[1] == 2, f"output shape {out.shape}")
+    check(np.all(np.abs(out[:, 0].astype(np.int32) + out[:, 1]) <= 1), "channels were mixed")
+    step = np.abs(np.diff(out[:, 0].astype(np.int32))).max()
+    limit = 2 * np.pi * freq / RATE * amplitude * 1.1
+    check(step <= limit, f"jump of {step} between samples (a sine at this rate moves at most {limit:.0f})")
+
+if __name__ == '__main__':
+    run(globals())
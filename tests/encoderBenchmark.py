@@ -0,0 +1,80 @@
+"""
+Encodes the same synthetic bgr24 frames with each available encoder backend
+as fast as possible and prints throughput, per-frame write latency and CPU
+time (this process plus FFmpeg children). Fails if a backend drops frames
+or its encoder doesn't exit cleanly.
+
+    python tests/encoderBenchmark.py [--width 1280] [--height 720] [--seconds 5]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from harness import streamer, check
+
+def benchmark(name, encoder, frames, count, input_args, output_args):
+    before = os.times()
+    encoder.start(input_args, output_args)
+    latency = streamer.RunningStats()
+    start = time.perf_counter()
+    for i in range(count):
+        t = time.perf_counter()
+        encoder.write(frames[i % len(frames)])
+        latency.add(time.perf_counter() - t)
+    encoder.close()
+    wall = time.perf_counter() - start
+    after = os.times()
+    cpu = sum(after[k] - before[k] for k in range(4))  # user, system, children user/system
+    print(f"{name:>10}: {count / wall:.0f} fps, write latency mean {latency.mean * 1000:.2f} ms "
+          f"/ max {latency.max * 1000:.2f} ms, CPU {cpu:.2f} s ({100 * cpu / wall:.0f}% of one core)")
+
+    check(encoder.writer.writes == count, f"{name}: {encoder.writer.writes} of {count} frames written")
+    if isinstance(encoder, streamer.FFmpegEncoder):
+        check(encoder.proc.returncode == 0, f"{name}: FFmpeg exited with code {encoder.proc.returncode}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CPU and latency of the encoder backends")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--seconds", type=int, default=5)
+    args = parser.parse_args()
+
+    if not streamer.get_ffmpeg_path():
+        print("FFmpeg not found.")
+        sys.exit(1)
+
+    width, height, fps = args.width, args.height, args.fps
+    gradient = np.linspace(0, 255, width, dtype=np.uint8)
+    frames = [np.ascontiguousarray(np.broadcast_to(np.roll(gradient, i * 8)[None, :, None], (height, width, 3)))
+              for i in range(fps)]
+    input_args = [
+        '-f', 'rawvideo', '-vcodec', 'rawvideo', '-pix_fmt', 'bgr24',
+        '-s', f'{width}x{height}', '-r', str(fps),
+    ]
+    output_args = [
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency',
+        '-f', 'mpegts', f'udp://127.0.0.1:{streamer.BASE_PORT_VIDEO}?pkt_size=1316'
+    ]
+
+    backends = [('subprocess', streamer.FFmpegEncoder)]
+    if streamer.av is not None:
+        backends.append(('pyav', streamer.PyAvEncoder))
+    else:
+        print("PyAV not installed; benchmarking the subprocess backend only.")
+
+    print(f"\nEncoder benchmark: {width}x{height} bgr24, {fps * args.seconds} frames")
+    failed = False
+    for name, encoder_class in backends:
+        try:
+            benchmark(name, encoder_class(), frames, fps * args.seconds, input_args, output_args)
+        except Exception as e:
+            print(f"FAIL {name}: {e}")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
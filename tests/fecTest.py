@@ -0,0 +1,191 @@
+"""
+Pass/fail checks for the row/column XOR FEC: FecEncoder output fed to
+FecDecoder in memory with chosen datagrams lost, then the whole path over
+loopback (UdpFanout -> FecReceiver with random loss injected).
+
+    python tests/fecTest.py [--loss 2] [--packets 10000]
+"""
+import argparse
+import os
+import random
+import socket
+import threading
+import time
+
+from harness import streamer, run, check
+
+LOSS_PERCENT = 2.0
+PACKETS = 10000
+
+def encode(payloads, columns, rows, first_seq=0):
+    """Runs payloads through FecEncoder; returns the (kind, datagram) list in send order."""
+    encoder = streamer.FecEncoder(columns, rows)
+    encoder.seq = first_seq
+    sent = []
+    headers = bytearray(streamer.RTP_HEADER.size)
+    for payload in payloads:
+        fec_packets = []
+        encoder.protect(payload, headers, 0, fec_packets)
+        sent.append(('data', bytes(headers) + payload))
+        sent.extend(('fec', packet) for packet in fec_packets)
+    return sent
+
+def decode(sent, lose=()):
+    """Feeds datagrams to a FecDecoder, skipping the data datagrams whose index is in lose."""
+    output = []
+    decoder = streamer.FecDecoder(output.append)
+    index = 0
+    for kind, datagram in sent:
+        if kind == 'fec':
+            decoder.on_fec(datagram)
+            continue
+        if index not in lose:
+            decoder.on_data(datagram)
+        index += 1
+    decoder.flush(force=True)
+    return output, decoder
+
+def payloads(count, seed=1, size=streamer.UDP_PAYLOAD_BYTES):
+    rng = random.Random(seed)
+    return [rng.randbytes(size) for _ in range(count)]
+
+def test_no_loss_passes_through():
+    data = payloads(100)
+    output, decoder = decode(encode(data, 10, 5))
+    check(output == data, "lossless stream changed or reordered")
+    check(decoder.recovered == 0 and decoder.lost == 0, decoder.report())
+
+def test_overhead():
+    sent = encode(payloads(100), 10, 5)
+    fec = sum(1 for kind, _ in sent if kind == 'fec')
+    check(fec == 30, f"{fec} FEC packets for a 10x5 matrix over 100 datagrams, expected 30")
+
+def test_row_fec_repairs_one_loss_per_row():
+    data = payloads(100)
+    # Never the very first datagram: a decoder can't know a stream started before what it got
+    lose = {row * 10 + (row * 3 + 1) % 10 for row in range(10)}
+    output, decoder = decode(encode(data, 10, 0), lose)
+    check(output == data, f"{decoder.report()}")
+    check(decoder.recovered == len(lose), f"recovered {decoder.recovered} of {len(lose)}")
+
+def test_column_fec_repairs_burst():
+    data = payloads(100)
+    lose = set(range(20, 30))  # A whole row of the 10x5 matrix: only columns can repair it
+    output, decoder = decode(encode(data, 10, 5), lose)
+    check(output == data, decoder.report())
+    check(decoder.recovered == 10, f"recovered {decoder.recovered} of 10")
+
+def test_row_and_column_repairs_chain():
+    data = payloads(100)
+    # Two losses in one row and two in one column: the other row's repair completes the
+    # column, whose repair completes the row. Second matrix: until the first column FEC
+    # packet arrives the decoder only holds gaps back 32 datagrams, less than a 10x5 matrix.
+    lose = {51, 52, 61}
+    output, decoder = decode(encode(data, 10, 5), lose)
+    check(output == data, decoder.report())
+
+def test_variable_length_recovered_exactly():
+    rng = random.Random(2)
+    data = [rng.randbytes(rng.randint(1, streamer.UDP_PAYLOAD_BYTES)) for _ in range(50)]
+    output, decoder = decode(encode(data, 10, 5), {3, 17, 44})
+    check(output == data, "recovered datagrams have the wrong length or content")
+
+def test_unrecoverable_loss_is_counted():
+    data = payloads(20)
+    output, decoder = decode(encode(data, 10, 0), {2, 5})  # Two in one row: row-only FEC can't help
+    check(decoder.lost == 2 and decoder.recovered == 0, decoder.report())
+    check(output == [d for i, d in enumerate(data) if i not in (2, 5)], "survivors out of order")
+
+def test_reordering():
+    data = payloads(30)
+    sent = encode(data, 10, 5)
+    data_positions = [i for i, (kind, _) in enumerate(sent) if kind == 'data']
+    a, b = data_positions[4], data_positions[7]
+    sent[a], sent[b] = sent[b], sent[a]
+    output, decoder = decode(sent)
+    check(output == data, "decoder did not restore sequence order")
+
+def test_sequence_wrap():
+    data = payloads(100)
+    output, decoder = decode(encode(data, 10, 5, first_seq=0xFFFF - 40), {38, 41, 42, 77})
+    check(output == data, f"across the 16-bit wrap: {decoder.report()}")
+
+def test_sender_restart():
+    first, second = payloads(20, seed=3), payloads(20, seed=4)
+    output, decoder = decode(encode(first, 10, 5, first_seq=5000) + encode(second, 10, 5, first_seq=10))
+    check(output == first + second, "stream after an SSRC change was dropped or reordered")
+
+def test_loopback_loss():
+    """The whole path with LOSS_PERCENT random loss: FEC must remove most of it."""
+    streamer.FEC_COLUMNS, streamer.FEC_ROWS = 10, 5
+    streamer.UDP_PACING_MBPS = 100  # Keep the loopback receiver's socket buffer from overflowing
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 << 20)
+    sink.bind(('127.0.0.1', 0))
+    sink.settimeout(1.0)
+
+    receiver = None
+    for _ in range(20):
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+        probe.close()
+        if port + streamer.FEC_PORT_OFFSET > 65535:
+            continue
+        try:
+            receiver = streamer.FecReceiver(port, sink.getsockname(), LOSS_PERCENT / 100, 1)
+            break
+        except OSError:
+            continue
+    check(receiver is not None, "no free port pair for the loopback test")
+    receiver.start()
+
+    payload = random.Random(1).randbytes(PACKETS * streamer.UDP_PAYLOAD_BYTES)
+    read_fd, write_fd = os.pipe()
+    fanout = streamer.UdpFanout(os.fdopen(read_fd, 'rb', buffering=0), port, "fec-test")
+    fanout.add('127.0.0.1')
+    fanout.start()
+
+    size = streamer.UDP_PAYLOAD_BYTES
+    expected = {payload[i:i + size] for i in range(0, len(payload), size)}
+    delivered = set()
+    def collect():
+        try:
+            while True:
+                datagram = sink.recv(65536)
+                if datagram in expected:
+                    delivered.add(datagram)
+        except (socket.timeout, OSError):
+            pass
+    collector = threading.Thread(target=collect, daemon=True)
+    collector.start()
+
+    start = time.perf_counter()
+    view = memoryview(payload)
+    for i in range(0, len(payload), 1 << 16):
+        os.write(write_fd, view[i:i + (1 << 16)])
+    os.close(write_fd)
+    fanout.join(timeout=60)
+    collector.join(timeout=60)
+    wall = time.perf_counter() - start
+    receiver.stop()
+    sink.close()
+
+    decoder = receiver.decoder
+    residual = 100 * (PACKETS - len(delivered)) / PACKETS
+    unprotected = 100 * (decoder.recovered + decoder.lost) / PACKETS
+    print(f"     {PACKETS} datagrams, {LOSS_PERCENT:g}% injected loss, {wall:.1f} s")
+    print(f"     Sender:   {fanout.fec.report()}")
+    print(f"     Receiver: {receiver.report()}")
+    print(f"     Output:   {len(delivered)}/{PACKETS} datagrams intact "
+          f"({residual:.2f}% residual loss, {unprotected:.2f}% without FEC)")
+    check(decoder.recovered > 0, "nothing was recovered")
+    check(residual <= unprotected / 4, f"residual loss {residual:.2f}% not under a quarter of {unprotected:.2f}%")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="FEC encoder/decoder checks and loopback loss test")
+    parser.add_argument("--loss", type=float, default=LOSS_PERCENT, help="Packet loss (%%) injected in the loopback test")
+    parser.add_argument("--packets", type=int, default=PACKETS, help="Datagrams sent in the loopback test")
+    args = parser.parse_args()
+    LOSS_PERCENT, PACKETS = args.loss, args.packets
+    run(globals())
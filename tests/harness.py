@@ -0,0 +1,124 @@
+"""
+Shared by the scripts in tests/: imports src/pyAvStreamer.py as `streamer`,
+runs a script's test_* functions (exiting non-zero if any fails) and
+provides synthetic stand-ins for a stream task and a camera.
+"""
+import os
+import sys
+import time
+import traceback
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import pyAvStreamer as streamer
+
+def run(namespace):
+    """Runs every test_* function in a script's globals() in order; exits 1 on any failure."""
+    tests = [(name, func) for name, func in namespace.items() if name.startswith('test_') and callable(func)]
+    failed = 0
+    for name, func in tests:
+        start = time.perf_counter()
+        try:
+            func()
+        except Exception:
+            failed += 1
+            print(f"FAIL {name}")
+            traceback.print_exc()
+            continue
+        print(f"ok   {name} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+    print(f"\n{len(tests) - failed}/{len(tests)} passed")
+    sys.exit(1 if failed else 0)
+
+def check(condition, message):
+    """assert that survives python -O, with the values that failed in the message."""
+    if not condition:
+        raise AssertionError(message)
+
+def synthetic_stream_task(index, port, stop_event, encoder=None, width=320, height=240, fps=30):
+    """
+    Stand-in for a capture device's stream task: paced flat frames through
+    the normal encoder path, restarting the encoder like the video task does.
+    """
+    metrics = streamer.StreamMetrics('video', f"synthetic {index}", port)
+    input_args = [
+        '-f', 'rawvideo', '-vcodec', 'rawvideo', '-pix_fmt', 'bgr24',
+        '-s', f'{width}x{height}', '-r', str(fps),
+    ]
+    output_args = [
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency',
+        '-f', 'mpegts', f'udp://127.0.0.1:{port}?pkt_size=1316'
+    ]
+    if encoder is None:
+        encoder = streamer.new_encoder()
+    frame = np.full((height, width, 3), index * 16 % 256, dtype=np.uint8)
+    backoff = streamer.Backoff()
+    try:
+        encoder.start(input_args, output_args)
+        metrics.writer = encoder.writer
+        next_frame = time.monotonic()
+        while not stop_event.wait(max(next_frame - time.monotonic(), 0)):
+            next_frame = max(next_frame + 1 / fps, time.monotonic() - 1 / fps)
+            try:
+                encoder.writer.write(frame)
+            except OSError:
+                if stop_event.is_set() or not streamer.restart_encoder(
+                        encoder, input_args, output_args, metrics, backoff, stop_event, metrics.name):
+                    break
+                metrics.writer = encoder.writer
+                continue
+            if not metrics.live:
+                metrics.set_live()
+    except Exception as e:
+        if not stop_event.is_set():
+            print(f"Synthetic stream {index} failed: {e}")
+    finally:
+        metrics.close()
+        encoder.close()
+
+class SyntheticCapture:
+    """
+    cv2.VideoCapture stand-in producing moving BGR frames (1080p unless
+    given) as fast as they are read, or paced like a camera at fps. Pass the
+    class as open_camera's or CaptureProcess's capture_class; bind the
+    arguments with functools.partial.
+    """
+    def __init__(self, index=None, width=1920, height=1080, fps=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.next_frame = None
+        self.base = np.ascontiguousarray(np.broadcast_to(
+            np.arange(width, dtype=np.uint8)[None, :, None], (height, width, 3)))
+        self.count = 0
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        return False
+
+    def get(self, prop):
+        return {cv2.CAP_PROP_FRAME_WIDTH: self.width, cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+                cv2.CAP_PROP_FPS: self.fps or 0}.get(prop, 0)
+
+    def grab(self):
+        return True
+
+    def read(self, image=None):
+        if self.fps:
+            # A camera's read blocks until the sensor delivers the next frame
+            now = time.monotonic()
+            self.next_frame = now if self.next_frame is None else self.next_frame + 1 / self.fps
+            if self.next_frame > now:
+                time.sleep(self.next_frame - now)
+        if image is None:
+            image = np.empty_like(self.base)
+        self.count += 1
+        np.add(self.base, self.count % 256, out=image, casting='unsafe')
+        return True, image
+
+    def release(self):
+        pass
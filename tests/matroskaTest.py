@@ -0,0 +1,187 @@
+"""
+Pass/fail checks for the capture-timestamp framing: EBML encoding, the
+live Matroska stream MatroskaFramer writes through a PipeWriter (parsed
+back here, demuxed with PyAV and passed through FFmpeg to MPEG-TS when
+they are installed), and AudioTimeline.
+
+    python tests/matroskaTest.py
+"""
+import io
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+
+from harness import streamer, run, check
+
+def read_vint(data, pos, keep_marker=False):
+    """Reads an EBML variable-length integer; returns (value, next position)."""
+    first = data[pos]
+    length = 1
+    while not first & (0x80 >> (length - 1)):
+        length += 1
+    value = int.from_bytes(data[pos:pos + length], 'big')
+    if not keep_marker:
+        value &= (1 << (7 * length)) - 1
+    return value, pos + length
+
+def elements(data, pos=0, end=None):
+    """Yields (id, payload start, payload end) of the EBML elements in data[pos:end]."""
+    end = len(data) if end is None else end
+    while pos < end:
+        element_id, pos = read_vint(data, pos, keep_marker=True)
+        size, pos = read_vint(data, pos)
+        if element_id == 0x18538067:  # Live segment: unknown size, runs to the end
+            size = end - pos
+        yield element_id, pos, pos + size
+        pos += size
+
+def frame_stream(track, blocks):
+    """Writes blocks of (data, capture time) through a MatroskaFramer; returns the stream bytes."""
+    with tempfile.TemporaryFile() as f:
+        writer = streamer.PipeWriter(f.fileno())
+        framer = streamer.MatroskaFramer(writer, track)
+        for data, capture_time in blocks:
+            framer.write(data, capture_time)
+        f.seek(0)
+        return f.read()
+
+def parse_blocks(stream):
+    """Returns [(cluster timestamp, block payload)] of a framed stream."""
+    top = list(elements(stream))
+    check([e[0] for e in top] == [0x1A45DFA3, 0x18538067], f"top-level elements {[hex(e[0]) for e in top]}")
+    blocks = []
+    for element_id, start, end in elements(stream, top[1][1], top[1][2]):
+        if element_id != 0x1F43B675:
+            continue
+        timestamp = None
+        for child_id, child_start, child_end in elements(stream, start, end):
+            if child_id == 0xE7:
+                timestamp = int.from_bytes(stream[child_start:child_end], 'big')
+            elif child_id == 0xA3:
+                check(stream[child_start:child_start + 4] == b'\x81\x00\x00\x80', "SimpleBlock header")
+                blocks.append((timestamp, stream[child_start + 4:child_end]))
+    return blocks
+
+def ticks(capture_time):
+    return int((capture_time - streamer.CAPTURE_EPOCH) * streamer.MATROSKA_TIMESCALE)
+
+def test_ebml_size():
+    check(streamer.ebml_size(0) == b'\x80', "size 0")
+    check(streamer.ebml_size(126) == b'\xfe', "size 126")
+    check(streamer.ebml_size(127) == b'\x40\x7f', "127 is reserved in one byte (all ones = unknown)")
+    check(streamer.ebml_size(5, 8) == b'\x01' + (5).to_bytes(7, 'big'), "fixed 8-byte size")
+    for n in (0, 1, 126, 127, 16382, 16383, 1 << 40):
+        check(read_vint(streamer.ebml_size(n), 0)[0] == n, f"round trip of {n}")
+
+def test_ebml_payload_types():
+    check(streamer.ebml(0x4286, 1) == b'\x42\x86\x81\x01', "uint")
+    check(streamer.ebml(0xB5, 48000.0) == b'\xb5\x88' + np.array(48000.0, '>f8').tobytes(), "float")
+    check(streamer.ebml(0x86, 'V_MJPEG') == b'\x86\x87V_MJPEG', "string")
+    check(streamer.ebml(0x2EB524, b'I420') == b'\x2e\xb5\x24\x84I420', "binary")
+
+def test_blocks_round_trip_with_capture_times():
+    frames = [np.full((4, 6, 3), i, dtype=np.uint8) for i in range(5)]
+    times = [streamer.CAPTURE_EPOCH + 1.0 + i / 30 for i in range(5)]
+    track = streamer.matroska_video_track('bgr24', 6, 4, 30)
+    blocks = parse_blocks(frame_stream(track, zip(frames, times)))
+    check(len(blocks) == 5, f"{len(blocks)} blocks, expected 5")
+    for (timestamp, payload), frame, t in zip(blocks, frames, times):
+        check(payload == frame.tobytes(), "block payload differs from the frame")
+        check(timestamp == ticks(t), f"cluster time {timestamp}, expected {ticks(t)}")
+
+def test_timestamps_strictly_increase():
+    same = streamer.CAPTURE_EPOCH + 2.0
+    track = streamer.matroska_audio_track(48000, 2)
+    blocks = parse_blocks(frame_stream(track, [(b'\x00' * 8, same), (b'\x00' * 8, same), (b'\x00' * 8, same - 0.5)]))
+    stamps = [timestamp for timestamp, _ in blocks]
+    check(stamps == [ticks(same), ticks(same) + 1, ticks(same) + 2], f"timestamps {stamps}")
+
+def test_pyav_demuxes_stream():
+    if streamer.av is None:
+        print("     PyAV not installed; skipping the demux check")
+        return
+    times = [streamer.CAPTURE_EPOCH + 0.25 + i * 0.04 for i in range(4)]
+    frames = [np.full((6, 8), 16 * i, dtype=np.uint8) for i in range(4)]  # I420 8x4
+    stream = frame_stream(streamer.matroska_video_track('yuv420p', 8, 4, 25), zip(frames, times))
+    container = streamer.av.open(io.BytesIO(stream), format='matroska')
+    packets = [p for p in container.demux(video=0) if p.size]
+    check(len(packets) == 4, f"PyAV demuxed {len(packets)} packets, expected 4")
+    for packet, frame, t in zip(packets, frames, times):
+        seconds = float(packet.pts * packet.time_base)
+        check(abs(seconds - (t - streamer.CAPTURE_EPOCH)) < 1e-3, f"PTS {seconds:.4f} s, expected {t - streamer.CAPTURE_EPOCH:.4f}")
+        check(bytes(packet) == frame.tobytes(), "demuxed payload differs")
+    container.close()
+
+def real_ffmpeg():
+    """Path of an installed FFmpeg that actually decodes, or None."""
+    path = streamer.get_ffmpeg_path()
+    if not path:
+        return None
+    try:
+        out = subprocess.run([path, '-version'], stdin=subprocess.DEVNULL, capture_output=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return path if out.startswith(b'ffmpeg version') else None
+
+def mpegts_video_pts(data):
+    """PTS (90 kHz) of every video PES in an MPEG-TS, read from the packets directly."""
+    pts = []
+    for pos in range(0, len(data) - 187, 188):
+        packet = data[pos:pos + 188]
+        check(packet[0] == 0x47, f"lost TS sync at byte {pos}")
+        if not packet[1] & 0x40:  # Not the start of a PES
+            continue
+        start = 4 + (1 + packet[4] if packet[3] & 0x20 else 0)
+        pes = packet[start:]
+        if pes[:3] == b'\x00\x00\x01' and 0xE0 <= pes[3] <= 0xEF and pes[7] & 0x80:
+            b = pes[9:14]
+            pts.append(((b[0] >> 1) & 7) << 30 | b[1] << 22 | (b[2] >> 1) << 15 | b[3] << 7 | b[4] >> 1)
+    return pts
+
+def test_ffmpeg_keeps_capture_times():
+    ffmpeg = real_ffmpeg()
+    if not ffmpeg:
+        print("     FFmpeg not installed; skipping the end-to-end check")
+        return
+    # 25 fps with a 120 ms hole, as a dropped frame leaves
+    offsets = [0.0, 0.04, 0.08, 0.2, 0.24, 0.28]
+    times = [streamer.CAPTURE_EPOCH + 1.0 + t for t in offsets]
+    frames = [np.full((72, 64), 16 * i, dtype=np.uint8) for i in range(len(times))]  # I420 64x48
+    stream = frame_stream(streamer.matroska_video_track('yuv420p', 64, 48, 25), zip(frames, times))
+    with tempfile.TemporaryDirectory() as directory:
+        ts = os.path.join(directory, 'out.ts')
+        # The live path: framed pipe in, encoded, MPEG-TS out
+        subprocess.run([ffmpeg, '-v', 'error', *streamer.capture_timestamp_input_args(), '-i', 'pipe:0',
+                        '-c:v', 'mpeg2video', '-fflags', '+genpts', '-f', 'mpegts', ts],
+                       input=stream, check=True, timeout=30)
+        with open(ts, 'rb') as f:
+            pts = sorted(mpegts_video_pts(f.read()))
+    check(len(pts) == len(times), f"{len(pts)} packets in the MPEG-TS, expected {len(times)}")
+    spacing = [round((b - a) * 90000) for a, b in zip(times, times[1:])]
+    got = [b - a for a, b in zip(pts, pts[1:])]
+    check(all(abs(g - e) <= 2 for g, e in zip(got, spacing)), f"PTS steps {got}, expected {spacing} (90 kHz)")
+
+def test_audio_timeline_follows_sample_count():
+    timeline = streamer.AudioTimeline(48000)
+    start = 100.0
+    # 10 ms chunks arriving with up to 8 ms of jitter: stamps stay on the sample clock
+    jitter = [0.0, 0.008, 0.002, 0.007, 0.0, 0.005]
+    stamps = [timeline.stamp(480, start + (i + 1) * 0.01 + j) for i, j in enumerate(jitter)]
+    expected = [start + i * 0.01 for i in range(len(jitter))]
+    check(np.allclose(stamps, expected, atol=1e-9), f"stamps {stamps}")
+    check(timeline.resyncs == 0, f"{timeline.resyncs} resyncs under jitter")
+
+def test_audio_timeline_resyncs_after_gap():
+    timeline = streamer.AudioTimeline(48000)
+    timeline.stamp(480, 1.01)
+    limit = streamer.AUDIO_RESYNC_MS / 1000
+    # Audio dropped: the next chunk arrives well after the sample clock expects it
+    stamp = timeline.stamp(480, 1.02 + 2 * limit)
+    check(timeline.resyncs == 1, f"{timeline.resyncs} resyncs after a {2 * limit * 1000:.0f} ms gap")
+    check(abs(stamp - (1.01 + 2 * limit)) < 1e-9, f"re-anchored at {stamp}")
+    check(abs(timeline.stamp(480, 1.03 + 2 * limit) - (1.02 + 2 * limit)) < 1e-9, "sample clock after resync")
+
+if __name__ == '__main__':
+    run(globals())
@@ -0,0 +1,270 @@
+"""
+Fault injection for the stream supervisor: kills the FFmpeg of synthetic
+streams repeatedly, and silences microphones (a PyAudio stand-in whose
+callbacks stop, as when a device is unplugged) in callback and combined
+mode. Checks every stream is streaming again on its port, with one restart
+counted per fault, that blocking-mode reads keep overflowed chunks
+without a restart, and that deliberate encoder restarts (as on an ABR step)
+are neither reported as exits nor left tracked once their FFmpeg is gone.
+
+    python tests/recoveryTest.py [--streams 4] [--kills 3]
+"""
+import argparse
+import contextlib
+import io
+import sys
+import threading
+import time
+
+import numpy as np
+
+from harness import streamer, run, check, synthetic_stream_task
+
+STREAMS = 4
+KILLS = 3
+RECOVERY_TIMEOUT = 5.0  # Seconds a stream gets to stream again after a fault
+
+def wait_until(condition, timeout=RECOVERY_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+class FakeInputStream:
+    """Callback-mode PyAudio stream fed with silence from a thread at the device's rate."""
+    def __init__(self, rate, channels, frames, callback):
+        self.rate = rate
+        self.frames = frames
+        self.data = bytes(frames * channels * 2)
+        self.callback = callback
+        self.running = False
+        self.failed = False
+        self.thread = None
+
+    def start_stream(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        next_period = time.monotonic()
+        while self.running and not self.failed:
+            next_period += self.frames / self.rate
+            time.sleep(max(next_period - time.monotonic(), 0))
+            if self.callback(self.data, self.frames, {}, 0)[1] != streamer.pyaudio.paContinue:
+                break
+
+    def is_active(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def stop_stream(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1)
+
+    def close(self):
+        self.stop_stream()
+
+class FakeBlockingStream:
+    """Blocking-mode PyAudio stream paced at the device's rate; every overflow_every-th read overflows."""
+    def __init__(self, rate, channels, frames, overflow_every):
+        self.rate = rate
+        self.data = bytes(frames * channels * 2)
+        self.frames = frames
+        self.overflow_every = overflow_every
+        self.reads = 0
+        self.next_period = time.monotonic()
+
+    def read(self, frames, exception_on_overflow=True):
+        self.next_period += self.frames / self.rate
+        time.sleep(max(self.next_period - time.monotonic(), 0))
+        self.reads += 1
+        if self.reads % self.overflow_every == 0 and exception_on_overflow:
+            raise OSError(streamer.pyaudio.paInputOverflowed, "Input overflowed")
+        return self.data
+
+    def is_active(self):
+        return True
+
+    def get_input_latency(self):
+        return 0.05
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+class FakeMicrophones:
+    """
+    PyAudio instance stand-in with mono inputs (48 kHz unless rates gives a
+    device another): callback-mode streams that fail() silences, or blocking
+    streams overflowing every overflow_every-th read.
+    """
+    def __init__(self, overflow_every=None, rates=None):
+        self.streams = {}
+        self.overflow_every = overflow_every
+        self.rates = rates or {}
+
+    def get_device_info_by_index(self, index):
+        return {'index': index, 'defaultSampleRate': float(self.rates.get(index, 48000)), 'maxInputChannels': 1}
+
+    def is_format_supported(self, *args, **kwargs):
+        return True
+
+    def open(self, rate, channels, input_device_index, frames_per_buffer, stream_callback=None, **kwargs):
+        if stream_callback is None:
+            check(self.overflow_every is not None, "blocking mode needs overflow_every")
+            stream = FakeBlockingStream(rate, channels, frames_per_buffer, self.overflow_every)
+        else:
+            stream = FakeInputStream(rate, channels, frames_per_buffer, stream_callback)
+        self.streams.setdefault(input_device_index, []).append(stream)
+        return stream
+
+    def fail(self, index):
+        self.streams[index][-1].failed = True
+
+def report(handles):
+    for handle in handles:
+        m = handle.metrics
+        r = m.reconnect
+        print(f"     {handle.name} (port {m.port}): {m.restarts} restarts, {'live' if m.live else 'DOWN'}, "
+              f"reconnect mean {r.mean * 1000:.0f} ms, max {r.max * 1000:.0f} ms")
+
+def test_encoder_killed():
+    stop_event = threading.Event()
+    supervisor = streamer.StreamSupervisor(stop_event)
+    pending = [(synthetic_stream_task, (i, streamer.BASE_PORT_VIDEO + i, stop_event)) for i in range(STREAMS)]
+    try:
+        supervisor.start(pending).result()
+        handles = supervisor.handles
+        check(all(h.metrics.live for h in handles), "not every synthetic stream went live")
+        for kill in range(KILLS):
+            time.sleep(0.5)
+            for handle in handles:
+                handle.processes[-1].kill()
+            recovered = wait_until(lambda: all(h.metrics.live and h.metrics.restarts == kill + 1 for h in handles))
+            if not recovered:
+                report(handles)
+            check(recovered, f"not every stream was live again {RECOVERY_TIMEOUT:g} s after kill {kill + 1}")
+        report(handles)
+        for handle in handles:
+            m = handle.metrics
+            check(m.port == streamer.BASE_PORT_VIDEO + handles.index(handle), f"{handle.name} moved to port {m.port}")
+            check(m.restarts == KILLS, f"{handle.name}: {m.restarts} restarts for {KILLS} kills")
+            check(m.reconnect.count == KILLS, f"{handle.name}: {m.reconnect.count} reconnects for {KILLS} kills")
+    finally:
+        supervisor.shutdown()
+
+def stepping_task(port, stop_event, encoder=None, steps=5, width=320, height=240, fps=30):
+    """Synthetic stream that closes and restarts its encoder every half second, as an ABR step does."""
+    metrics = streamer.StreamMetrics('video', "stepping", port)
+    input_args = ['-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps)]
+    output_args = ['-c:v', 'libx264', '-preset', 'ultrafast', '-f', 'mpegts', f'udp://127.0.0.1:{port}?pkt_size=1316']
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    if encoder is None:
+        encoder = streamer.new_encoder()
+    try:
+        encoder.start(input_args, output_args)
+        metrics.writer = encoder.writer
+        next_step = time.monotonic() + 0.5
+        while not stop_event.wait(1 / fps):
+            if steps and time.monotonic() > next_step:
+                encoder.close()
+                encoder.start(input_args, output_args)
+                metrics.writer = encoder.writer
+                metrics.restarts += 1
+                steps -= 1
+                next_step += 0.5
+            encoder.writer.write(frame)
+            if not metrics.live:
+                metrics.set_live()
+    finally:
+        metrics.close()
+        encoder.close()
+
+def test_encoder_stepped():
+    stop_event = threading.Event()
+    supervisor = streamer.StreamSupervisor(stop_event)
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            supervisor.start([(stepping_task, (streamer.BASE_PORT_VIDEO, stop_event))]).result()
+            handle = supervisor.handles[0]
+            stepped = wait_until(lambda: handle.metrics.restarts == 5)
+            time.sleep(0.5)
+            tracked = len(handle.processes)
+    finally:
+        supervisor.shutdown()
+    print(f"     {handle.metrics.restarts} deliberate restarts, {tracked} FFmpeg process(es) tracked")
+    check(stepped, f"only {handle.metrics.restarts} of 5 restarts within {RECOVERY_TIMEOUT:g} s")
+    check("exited with code" not in output.getvalue(), "a deliberate restart was reported as an FFmpeg exit")
+    check(tracked == 1, f"{tracked} FFmpeg processes tracked after the restarts, 1 running")
+
+def run_microphone_faults(target, args, mics, failing):
+    """Runs one audio stream, fails each device in failing in turn and checks it comes back each time."""
+    mode = streamer.AUDIO_MODE
+    streamer.AUDIO_MODE = 'callback'
+    stop_event = threading.Event()
+    supervisor = streamer.StreamSupervisor(stop_event)
+    try:
+        supervisor.start([(target, (mics, *args, streamer.BASE_PORT_AUDIO, stop_event))]).result()
+        handle = supervisor.handles[0]
+        check(handle.metrics.live, "the audio stream never went live")
+        for fault, device in enumerate(failing):
+            opened = len(mics.streams[device])
+            mics.fail(device)
+            recovered = wait_until(lambda: handle.metrics.live and handle.metrics.restarts == fault + 1)
+            report([handle])
+            check(recovered, f"not live again {RECOVERY_TIMEOUT:g} s after device {device} failed")
+            check(len(mics.streams[device]) == opened + 1, f"device {device} was not reopened")
+        check(handle.metrics.port == streamer.BASE_PORT_AUDIO, f"stream moved to port {handle.metrics.port}")
+    finally:
+        supervisor.shutdown()
+        streamer.AUDIO_MODE = mode
+
+def test_callback_microphone_fails():
+    run_microphone_faults(streamer.stream_audio_task, (0, "fake mic 0"), FakeMicrophones(), [0, 0])
+
+def test_combined_microphone_fails():
+    devices = [(0, "fake mic 0"), (1, "fake mic 1")]
+    # The secondary runs at 44.1 kHz: it must be opened at that rate and resampled in-process
+    mics = FakeMicrophones(rates={1: 44100})
+    # A secondary goes quiet while the master keeps the mix running, then the master itself
+    run_microphone_faults(streamer.stream_multi_audio_task, (devices,), mics, [1, 0])
+    check(all(stream.rate == 44100 for stream in mics.streams[1]), "the 44.1 kHz mic was opened at another rate")
+
+def test_blocking_microphone_overflows():
+    mode = streamer.AUDIO_MODE
+    streamer.AUDIO_MODE = 'blocking'
+    stop_event = threading.Event()
+    supervisor = streamer.StreamSupervisor(stop_event)
+    mics = FakeMicrophones(overflow_every=5)
+    try:
+        supervisor.start([(streamer.stream_audio_task, (mics, 0, "fake mic 0", streamer.BASE_PORT_AUDIO, stop_event))]).result()
+        handle = supervisor.handles[0]
+        check(handle.metrics.live, "the audio stream never went live")
+        time.sleep(1.5)
+    finally:
+        supervisor.shutdown()
+        streamer.AUDIO_MODE = mode
+    reads = mics.streams[0][-1].reads
+    m = handle.metrics
+    print(f"     {reads} reads, {m.captured} periods captured, {m.restarts} restarts")
+    # Overflowed chunks still carry audio: none may be discarded, and no overflow count is claimed
+    check(m.captured == reads, f"{m.captured} periods captured of {reads} read")
+    check('audio_input_overflows_total' not in dict(m.samples()), "overflows reported for a blocking stream")
+    check(m.restarts == 0 and len(mics.streams[0]) == 1, "an overflow restarted the stream")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stream supervisor fault injection")
+    parser.add_argument("--streams", type=int, default=STREAMS)
+    parser.add_argument("--kills", type=int, default=KILLS)
+    args = parser.parse_args()
+    STREAMS, KILLS = args.streams, args.kills
+    if not streamer.get_ffmpeg_path():
+        print("FFmpeg not found.")
+        sys.exit(1)
+    run(globals())
@@ -0,0 +1,111 @@
+"""
+Capture jitter of video streams on the real capture -> pipe -> FFmpeg path
+(stream_video_task under the supervisor, paced synthetic 720p cameras, one
+per core) while one busy-loop process per core adds load: with default
+scheduling, with --cpu-affinity, and with --cpu-affinity --realtime.
+Fails if a stream doesn't go live or misses half its frames, or if
+affinity or real-time priority makes the mean jitter worse than default
+scheduling (beyond JITTER_TOLERANCE).
+
+    python tests/schedulingBenchmark.py [--seconds 5] [--fps 30]
+"""
+import argparse
+import functools
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from harness import streamer, check, SyntheticCapture
+
+JITTER_TOLERANCE = 1.25  # A configuration may be this much worse than default scheduling...
+JITTER_FLOOR = 0.0005    # ...plus this many seconds, before it counts as worse (run-to-run noise)
+
+def spin_until(stop):
+    """Busy loop standing in for other work that keeps a core fully loaded."""
+    while not stop.is_set():
+        sum(range(10000))
+
+def measure(label, cameras, fps, seconds, affinity, realtime):
+    """Streams the cameras for seconds after a warm-up; returns [(jitter stats, delay stats, captured)]."""
+    streamer.CPU_PLAN = streamer.CpuPlan() if affinity and hasattr(os, 'sched_getaffinity') else None
+    streamer.REALTIME_CAPTURE = realtime
+    if streamer.CPU_PLAN:
+        streamer.CPU_PLAN.expect(cameras)
+    camera = functools.partial(SyntheticCapture, width=1280, height=720, fps=fps)
+    task = functools.partial(streamer.stream_video_task, capture_class=camera)
+    stop_event = threading.Event()
+    supervisor = streamer.StreamSupervisor(stop_event)
+    pending = [(task, (i, f"synthetic {i}", streamer.BASE_PORT_VIDEO + i, stop_event)) for i in range(cameras)]
+    try:
+        supervisor.start(pending).result()
+        handles = supervisor.handles
+        check(all(h.metrics and h.metrics.live for h in handles), f"{label}: not every stream went live")
+        time.sleep(1)
+        # Measure from here on: the start-up (FFmpeg spawn, first writes) is not what scheduling changes
+        starts = []
+        for handle in handles:
+            m = handle.metrics
+            m.capture_jitter.deviation = streamer.RunningStats()
+            m.capture_delay = streamer.RunningStats()
+            starts.append(m.captured)
+        time.sleep(seconds)
+        results = [(h.metrics.capture_jitter.deviation, h.metrics.capture_delay, h.metrics.captured - start)
+                   for h, start in zip(handles, starts)]
+    finally:
+        supervisor.shutdown()
+        streamer.CPU_PLAN = None
+        streamer.REALTIME_CAPTURE = False
+    mean = sum(j.mean for j, _, _ in results) / cameras
+    std = max(j.std for j, _, _ in results)
+    worst = max(j.max for j, _, _ in results)
+    delay = sum(d.mean for _, d, _ in results) / cameras
+    print(f"{label:>20}: jitter mean {mean * 1000:.2f} ms, std {std * 1000:.2f} ms, max {worst * 1000:.2f} ms, "
+          f"capture-to-pipe {delay * 1000:.2f} ms")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture jitter under full CPU load")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--fps", type=int, default=30)
+    args = parser.parse_args()
+
+    if not streamer.get_ffmpeg_path():
+        print("FFmpeg not found.")
+        sys.exit(1)
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    cameras = max(2, cores)
+    ctx = multiprocessing.get_context('spawn')
+    spin_stop = ctx.Event()
+    spinners = [ctx.Process(target=spin_until, args=(spin_stop,), daemon=True) for _ in range(cores)]
+    for spinner in spinners:
+        spinner.start()
+    print(f"\nScheduling benchmark: {cameras} streams at {args.fps} fps, {cores} busy-loop processes as extra load")
+
+    results = {}
+    try:
+        for label, affinity, realtime in (('default', False, False), ('affinity', True, False),
+                                          ('affinity + realtime', True, True)):
+            results[label] = measure(label, cameras, args.fps, args.seconds, affinity, realtime)
+    finally:
+        spin_stop.set()
+        for spinner in spinners:
+            spinner.join(timeout=2)
+
+    try:
+        expected = args.seconds * args.fps
+        for label, streams in results.items():
+            for i, (_, _, captured) in enumerate(streams):
+                check(captured >= expected / 2, f"{label}: stream {i} captured {captured} of {expected:.0f} frames")
+        baseline = sum(j.mean for j, _, _ in results['default']) / cameras
+        for label in ('affinity', 'affinity + realtime'):
+            mean = sum(j.mean for j, _, _ in results[label]) / cameras
+            check(mean <= baseline * JITTER_TOLERANCE + JITTER_FLOOR,
+                  f"{label}: mean jitter {mean * 1000:.2f} ms, worse than {baseline * 1000:.2f} ms by default")
+    except AssertionError as e:
+        print(f"FAIL: {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Runs synthetic video streams under the StreamSupervisor and prints the
+time until all were live and the time to a clean exit. Fails if a stream
+doesn't go live or is still running at the shutdown deadline.
+
+    python tests/supervisorBenchmark.py [--streams 16] [--seconds 2]
+"""
+import argparse
+import sys
+import threading
+import time
+
+from harness import streamer, check, synthetic_stream_task
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream supervisor start/stop benchmark")
+    parser.add_argument("--streams", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=2)
+    args = parser.parse_args()
+
+    if not streamer.get_ffmpeg_path():
+        print("FFmpeg not found.")
+        sys.exit(1)
+
+    stop_event = threading.Event()
+    supervisor = streamer.StreamSupervisor(stop_event)
+    pending = [(synthetic_stream_task, (i, streamer.BASE_PORT_VIDEO + i, stop_event)) for i in range(args.streams)]
+    print(f"\nSupervisor benchmark: {args.streams} synthetic 320x240 streams")
+    live = supervisor.start(pending).result()
+    time.sleep(args.seconds)
+    spawned, running, threads, cpu = streamer.encoder_stats()
+    print(f"Encoders: {running} FFmpeg processes running with {threads} threads")
+    went_live = sum(1 for handle in supervisor.handles if handle.live.done())
+    stopped = supervisor.shutdown()
+    print(f"All live in {live * 1000:.0f} ms, clean exit in {stopped * 1000:.0f} ms "
+          f"(sleep-polling start/stop took at least {args.streams * 0.5:.1f} s and 1.0 s)")
+
+    try:
+        check(went_live == args.streams, f"{went_live} of {args.streams} streams went live")
+        check(stopped < streamer.SHUTDOWN_DEADLINE, f"shutdown took {stopped:.1f} s, past the deadline")
+    except AssertionError as e:
+        print(f"FAIL: {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()